@@ -3,13 +3,17 @@ PlusContableAPISII - Backend Server
 Servidor Python para scraping de libros SII (COMPRAS y VENTAS)
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
+import json
+import time
+import atexit
 import logging
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
 # Cargar variables de entorno
 load_dotenv()
@@ -28,9 +32,40 @@ CORS(app, resources={r"/api/*": {"origins": cors_origins}})
 # Importar servicios de scraping
 from services.sii_scraper import SIIScraper
 from services.sii_parser import SIIParser
+from services.metrics import metrics
+from services.timings import StepTimings, timing_scope
+from services.jobs import JobManager, JobQueueFull
+from services.book_cache import BookCache
+from services.book_store import BookStore, parse_token
+from services.admission import AdmissionRejected
+from services.batch import BatchScheduler
+from services.book_table import json_default
+
+
+class BookJSONProvider(DefaultJSONProvider):
+    """Los libros columnares (BookTable) se convierten a lista de dicts recién al serializar"""
+    
+    @staticmethod
+    def default(o):
+        try:
+            return json_default(o)
+        except TypeError:
+            return DefaultJSONProvider.default(o)
+
+
+app.json = BookJSONProvider(app)
 
 scraper = SIIScraper()
 parser = SIIParser()
+# Normalizar los registros por default (cada request puede pedirlo con "normalize")
+NORMALIZE_RECORDS = os.getenv('SII_NORMALIZE_RECORDS', 'false').lower() in ('1', 'true', 'on')
+jobs = JobManager.from_env()
+book_cache = BookCache.from_env()
+book_store = BookStore.from_env()
+batches = BatchScheduler.from_env(default_workers=scraper.admission.max_in_flight)
+atexit.register(jobs.shutdown)
+atexit.register(batches.shutdown)
+atexit.register(scraper.close)
 logger.info("Servicios SII importados correctamente")
 
 
@@ -45,10 +80,180 @@ def health():
         'status': 'ok',
         'service': 'PlusContableAPISII v2.0',
         'timestamp': datetime.now().isoformat(),
-        'endpoints': sorted(endpoints)
+        'endpoints': sorted(endpoints),
+        'browser_pool': scraper.pool.stats(),
+        'sii_sessions': scraper.sessions.stats(),
+        'jobs': jobs.stats(),
+        'batch': batches.stats(),
+        'book_cache': book_cache.stats() if book_cache else None,
+        'book_store': book_store.stats() if book_store else None,
+        'single_flight': scraper.flights.stats(),
+        'admission': scraper.admission.stats(),
+        'async_engine': scraper.async_engine.stats() if scraper.async_engine else None
+    }), 200
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Histogramas en proceso (tiempos de espera del scraper, etc.)"""
+    return jsonify({
+        'success': True,
+        'metrics': metrics.snapshot()
     }), 200
 
 
+def _wants_async(data) -> bool:
+    """La request pide ejecución asíncrona (body "async": true o ?async=1)"""
+    return bool(data.get('async')) or request.args.get('async', '').lower() in ('1', 'true')
+
+
+def _wants_timings(data) -> bool:
+    """La request pide los tiempos por paso del scraping (body "timings": true o ?timings=1)"""
+    return bool(data.get('timings')) or request.args.get('timings', '').lower() in ('1', 'true')
+
+
+def _timed(enabled: bool, run, *args, **kwargs):
+    """
+    run(*args, **kwargs) -> (body, status); con enabled agrega body["timings"]
+    
+    timings trae los pasos medidos en orden ({"paso", "segundos"}) y el total.
+    Con single-flight, una request que se sumó a un scraping en curso no ve
+    los pasos de ese scraping (los mide la request que lo inició).
+    """
+    if not enabled:
+        return run(*args, **kwargs)
+    recorder = StepTimings()
+    with timing_scope(recorder):
+        body, status = run(*args, **kwargs)
+    body['timings'] = recorder.to_dict()
+    return body, status
+
+
+def _json_response(body, status):
+    """jsonify(body) con Retry-After cuando la request fue rechazada por admisión"""
+    response = jsonify(body)
+    if status == 429 and 'retry_after' in body:
+        response.headers['Retry-After'] = str(body['retry_after'])
+    return response, status
+
+
+def _wants_ndjson() -> bool:
+    """El cliente pidió Accept: application/x-ndjson (y no prefiere JSON)"""
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+
+def _ndjson_records(data, timings=None):
+    """
+    Respuesta streaming: un registro por línea y al final una línea de resumen
+    
+    Evita armar en memoria el body JSON completo de libros grandes; el primer
+    byte sale apenas empieza la serialización.
+    """
+    records = data['registros']
+    summary = {key: value for key, value in data.items() if key != 'registros'}
+    
+    def generate():
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False, default=json_default) + '\n'
+        last = {'success': True, 'summary': summary}
+        if timings is not None:
+            last['timings'] = timings
+        yield json.dumps(last, ensure_ascii=False) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def _job_accepted(job):
+    """Respuesta 202 con el job encolado y la URL para consultar su estado"""
+    status_url = f'/api/jobs/{job.id}'
+    response = jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': status_url
+    })
+    response.headers['Location'] = status_url
+    return response, 202
+
+
+def _use_cache(data) -> bool:
+    """La request acepta resultados cacheados (body "cache": false fuerza ir al SII)"""
+    return book_cache is not None and data.get('cache', True) is not False
+
+
+def _normalize(data) -> bool:
+    """La request pide registros normalizados (body "normalize", default SII_NORMALIZE_RECORDS)"""
+    return bool(data.get('normalize', NORMALIZE_RECORDS))
+
+
+def _book_entry(records, book_type: str, normalize: bool, changes=None, **fields):
+    """
+    Entrada de un libro en la respuesta; con normalize pasa los registros por el parser
+    
+    Los registros se normalizan con el esquema de columnas (campos snake_case y
+    montos numéricos). Las celdas que no se pudieron interpretar quedan en null y
+    se listan en errores_normalizacion sin descartar el resto del libro. changes
+    (resultado de _store_books) se informa como "cambios".
+    """
+    entry = {'registros': records, 'cantidad': len(records), 'sync_date': datetime.now().isoformat(), **fields}
+    if changes is not None:
+        entry['cambios'] = changes
+    if normalize:
+        entry['registros'], errors = parser.normalize(records, book_type)
+        if errors:
+            entry['errores_normalizacion'] = errors
+    return entry
+
+
+def _cached_books(rut: str, password: str, mes: int, ano: int, book_type: str, use_cache: bool):
+    """Registros del cache de libros, o None si no hay (o si la request no lo usa)"""
+    if not use_cache:
+        return None
+    return book_cache.get(rut, password, mes, ano, book_type)
+
+
+def _store_books(rut: str, password: str, mes: int, ano: int, book_type: str, books):
+    """
+    Guardar en el cache (y en el store, si está habilitado) un resultado recién descargado
+    
+    Returns:
+        Documentos insertados/actualizados/eliminados respecto de la sincronización
+        anterior guardada, o None sin store
+    """
+    if books is None:
+        return None
+    if book_cache is not None:
+        book_cache.put(rut, password, mes, ano, book_type, books)
+    if book_store is None:
+        return None
+    try:
+        return book_store.save(rut, password, mes, ano, book_type, books)
+    except Exception as e:
+        logger.error(f"No se pudo guardar {book_type} {mes:02d}/{ano} en el store: {str(e)}", exc_info=True)
+        return None
+
+
+def _error_response(e: Exception):
+    """Mapear excepciones del scraping a (body, status) igual que los endpoints síncronos"""
+    if isinstance(e, AdmissionRejected):
+        return {
+            'success': False,
+            'error': f'Servidor ocupado, reintentar más tarde: {str(e)}',
+            'retry_after': e.retry_after
+        }, 429
+    if isinstance(e, ValueError):
+        logger.error(f"Error de validación: {str(e)}")
+        return {
+            'success': False,
+            'error': f'Error de validación: {str(e)}'
+        }, 400
+    logger.error(f"Error inesperado: {str(e)}", exc_info=True)
+    return {
+        'success': False,
+        'error': f'Error interno del servidor: {str(e)}'
+    }, 500
+
+
 @app.route('/api/sync-sii', methods=['POST'])
 def sync_sii():
     """
@@ -60,8 +265,26 @@ def sync_sii():
         "password": "Tr7795629.",
         "mes": 12,
         "ano": 2025,
-        "tipo": "COMPRAS"  # opcional, default: COMPRAS
+        "tipo": "COMPRAS",  # opcional, default: COMPRAS
+        "async": false,     # opcional: true responde 202 con un job_id
+        "cache": true,      # opcional: false ignora el cache y va al SII
+        "normalize": false, # opcional: true retorna registros normalizados por el parser
+        "timings": false    # opcional: true agrega "timings" con la duración de cada paso
     }
+    
+    data.cache indica si los registros vinieron del cache ("hit") o del SII ("miss").
+    Con el store habilitado data.token identifica la versión entregada y
+    cambios lista los documentos insertados/actualizados/eliminados.
+    
+    Con ?since=<token> (o "since" en el body) data no trae registros sino
+    agregados, modificados y eliminados desde ese token, más el token nuevo.
+    since=0 entrega el libro completo como agregados. Si el store no pudo
+    guardar el libro recién descargado se entrega completo, con delta=false y
+    sin token.
+    
+    Con Accept: application/x-ndjson la respuesta exitosa es streaming: un
+    registro por línea y una última línea {"success": true, "summary": {...}}
+    con el resto de data. Los errores siguen siendo JSON con su status.
     """
     try:
         data = request.get_json()
@@ -87,57 +310,131 @@ def sync_sii():
                 'error': 'tipo debe ser COMPRAS o VENTAS'
             }), 400
         
+        since = request.args.get('since') or data.get('since')
+        if since is not None:
+            since = str(since)
+            if book_store is None:
+                raise ValueError('since requiere el store de libros (SII_BOOK_STORE_PATH)')
+            if since != '0':
+                parse_token(since)
+        
+    except ValueError as e:
+        body, status = _error_response(e)
+        return jsonify(body), status
+    
+    use_cache = _use_cache(data)
+    normalize = _normalize(data)
+    timed = _wants_timings(data)
+    
+    if _wants_async(data):
+        job = jobs.submit('sync-sii', {'rut': rut, 'mes': mes, 'ano': ano, 'tipo': book_type},
+                          lambda: _timed(timed, _run_sync_sii, rut, password, mes, ano, book_type, use_cache,
+                                         normalize, since))
+        return _job_accepted(job)
+    
+    body, status = _timed(timed, _run_sync_sii, rut, password, mes, ano, book_type, use_cache, normalize, since)
+    if status == 200 and since is None and _wants_ndjson():
+        return _ndjson_records(body['data'], body.get('timings'))
+    return _json_response(body, status)
+
+
+def _run_sync_sii(rut: str, password: str, mes: int, ano: int, book_type: str, use_cache: bool = False,
+                  normalize: bool = False, since: Optional[str] = None):
+    """Scraping de un libro (o sólo sus cambios desde el token since); retorna (body, status)"""
+    try:
         logger.info(f"Iniciando sincronización de {book_type} para RUT: {rut}, mes: {mes}, año: {ano}")
         
-        # Realizar scraping con Playwright
-        logger.info(f"Conectándose al SII con Playwright para obtener {book_type}...")
-        try:
-            books = scraper.fetch_books(rut, password, mes, ano, book_type)
-        except TimeoutError as e:
-            logger.error(f"Timeout conectándose al SII: {str(e)}")
-            raise TimeoutError(f"SII no respondió en tiempo: {str(e)}")
-        except Exception as e:
-            logger.error(f"Error en scraping: {str(e)}", exc_info=True)
-            raise
+        books = _cached_books(rut, password, mes, ano, book_type, use_cache)
+        cache_status = 'hit' if books is not None else 'miss'
+        changes = None
         
         if books is None:
-            error_msg = f'No se pudieron obtener los {book_type} del SII'
-            logger.error(error_msg)
-            raise ValueError(error_msg)
+            # Realizar scraping con Playwright
+            logger.info(f"Conectándose al SII con Playwright para obtener {book_type}...")
+            try:
+                books = scraper.fetch_books(rut, password, mes, ano, book_type)
+            except TimeoutError as e:
+                logger.error(f"Timeout conectándose al SII: {str(e)}")
+                raise TimeoutError(f"SII no respondió en tiempo: {str(e)}")
+            except Exception as e:
+                logger.error(f"Error en scraping: {str(e)}", exc_info=True)
+                raise
+            
+            if books is None:
+                error_msg = f'No se pudieron obtener los {book_type} del SII'
+                logger.error(error_msg)
+                raise ValueError(error_msg)
+            
+            changes = _store_books(rut, password, mes, ano, book_type, books)
         
-        logger.info(f"{book_type} obtenidos exitosamente: {len(books)} registros")
+        logger.info(f"{book_type} obtenidos exitosamente: {len(books)} registros (cache: {cache_status})")
         
-        return jsonify({
-            'success': True,
-            'data': {
-                'tipo': book_type,
-                'registros': books,
-                'mes': mes,
-                'ano': ano,
-                'rut': rut,
-                'cantidad': len(books),
-                'sync_date': datetime.now().isoformat()
-            }
-        }), 200
+        # Si el store no guardó lo recién descargado, su versión (y su token) es la anterior
+        stored = book_store is not None and (cache_status == 'hit' or changes is not None)
+        if since is not None:
+            delta = _delta_entry(rut, password, mes, ano, book_type, books, since, normalize,
+                                 cache_status) if stored else None
+            if delta is not None:
+                return {'success': True, 'data': delta}, 200
+            logger.warning(f"Store sin la versión actual de {book_type} {mes:02d}/{ano}: "
+                           f"se entrega el libro completo sin token")
+        
+        entry = _book_entry(books, book_type, normalize, changes, tipo=book_type, mes=mes, ano=ano, rut=rut,
+                            cache=cache_status)
+        if since is not None:
+            entry['delta'] = False
+        if stored:
+            entry['token'] = changes['token'] if changes else book_store.token(rut, mes, ano, book_type)
+        return {'success': True, 'data': entry}, 200
         
-    except ValueError as e:
-        logger.error(f"Error de validación: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': f'Error de validación: {str(e)}'
-        }), 400
     except Exception as e:
-        logger.error(f"Error inesperado: {str(e)}", exc_info=True)
-        return jsonify({
-            'success': False,
-            'error': f'Error interno del servidor: {str(e)}'
-        }), 500
+        return _error_response(e)
+
+
+def _delta_entry(rut: str, password: str, mes: int, ano: int, book_type: str, books, since: str,
+                 normalize: bool, cache_status: str):
+    """
+    data de /api/sync-sii?since=: sólo los documentos que cambiaron desde el token
+    
+    Los cambios salen del store, que compara por hash de contenido de cada fila.
+    Si el libro vino del cache y el store todavía no lo tiene, se guarda primero;
+    si eso falla retorna None (no hay versión contra la cual comparar).
+    """
+    if book_store.token(rut, mes, ano, book_type) is None:
+        try:
+            book_store.save(rut, password, mes, ano, book_type, books)
+        except Exception as e:
+            logger.error(f"No se pudo guardar {book_type} {mes:02d}/{ano} en el store: {str(e)}", exc_info=True)
+            return None
+    
+    delta = book_store.changes_since(rut, mes, ano, book_type, since)
+    if normalize:
+        for group in ('agregados', 'modificados'):
+            items = delta[group]
+            normalized, errors = parser.normalize([item['registro'] for item in items], book_type)
+            for item, registro in zip(items, normalized):
+                item['registro'] = registro
+            if errors:
+                delta.setdefault('errores_normalizacion', {})[group] = errors
+    
+    return {
+        'tipo': book_type,
+        'mes': mes,
+        'ano': ano,
+        'rut': rut,
+        'delta': True,
+        'since': since,
+        **delta,
+        'cantidad': len(books),
+        'sync_date': datetime.now().isoformat(),
+        'cache': cache_status
+    }
 
 
 @app.route('/api/sync-books', methods=['POST'])
 def sync_books():
     """
-    Endpoint para sincronizar COMPRAS y VENTAS simultáneamente (por un mes específico)
+    Endpoint para sincronizar COMPRAS y VENTAS en una sola sesión SII (por un mes específico)
     Este es el endpoint usado por el botón "Sinc" de la app Lova
     
     Body esperado:
@@ -145,7 +442,11 @@ def sync_books():
         "rut": "77956294-8",
         "password": "Tr7795629.",
         "mes": 10,
-        "ano": 2025
+        "ano": 2025,
+        "async": false,    # opcional: true responde 202 con un job_id
+        "cache": true,     # opcional: false ignora el cache y va al SII
+        "normalize": false, # opcional: true retorna registros normalizados por el parser
+        "timings": false    # opcional: true agrega "timings" con la duración de cada paso
     }
     
     Respuesta:
@@ -155,12 +456,14 @@ def sync_books():
             "COMPRAS": {
                 "registros": [...],
                 "cantidad": 5,
-                "sync_date": "2025-12-03T10:30:00"
+                "sync_date": "2025-12-03T10:30:00",
+                "cache": "miss"
             },
             "VENTAS": {
                 "registros": [...],
                 "cantidad": 3,
-                "sync_date": "2025-12-03T10:30:00"
+                "sync_date": "2025-12-03T10:30:00",
+                "cache": "hit"
             }
         }
     }
@@ -182,43 +485,59 @@ def sync_books():
         mes = int(data.get('mes'))
         ano = int(data.get('ano'))
         
+    except ValueError as e:
+        body, status = _error_response(e)
+        return jsonify(body), status
+    
+    use_cache = _use_cache(data)
+    normalize = _normalize(data)
+    timed = _wants_timings(data)
+    
+    if _wants_async(data):
+        job = jobs.submit('sync-books', {'rut': rut, 'mes': mes, 'ano': ano},
+                          lambda: _timed(timed, _run_sync_books, rut, password, mes, ano, use_cache, normalize))
+        return _job_accepted(job)
+    
+    body, status = _timed(timed, _run_sync_books, rut, password, mes, ano, use_cache, normalize)
+    return _json_response(body, status)
+
+
+def _run_sync_books(rut: str, password: str, mes: int, ano: int, use_cache: bool = False,
+                    normalize: bool = False):
+    """Scraping de COMPRAS y VENTAS de un período; retorna (body, status)"""
+    try:
         logger.info(f"Iniciando sincronización de COMPRAS y VENTAS para RUT: {rut}, mes: {mes}, año: {ano}")
         
-        # Descargar COMPRAS y VENTAS en paralelo usando ThreadPoolExecutor
-        books_result = {}
+        books_result = {'COMPRAS': None, 'VENTAS': None}
         errors = []
         
-        def fetch_book_type(book_type):
-            """Función para descargar un tipo de libro"""
-            try:
-                logger.info(f"Descargando {book_type}...")
-                books = scraper.fetch_books(rut, password, mes, ano, book_type)
-                
-                if books is None:
-                    error = f'No se pudieron obtener los {book_type} del SII'
-                    logger.error(error)
-                    errors.append(error)
-                    return None
-                
-                logger.info(f"{book_type} obtenidos exitosamente: {len(books)} registros")
-                return {
-                    'registros': books,
-                    'cantidad': len(books),
-                    'sync_date': datetime.now().isoformat()
-                }
-            except Exception as e:
-                error = f'Error descargando {book_type}: {str(e)}'
-                logger.error(error, exc_info=True)
-                errors.append(error)
-                return None
+        books_by_type = {t: _cached_books(rut, password, mes, ano, t, use_cache) for t in ('COMPRAS', 'VENTAS')}
+        cached_types = {t for t, books in books_by_type.items() if books is not None}
+        missing = tuple(t for t in ('COMPRAS', 'VENTAS') if t not in cached_types)
+        changes = {}
         
-        # Ejecutar descargas en paralelo
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_compras = executor.submit(fetch_book_type, 'COMPRAS')
-            future_ventas = executor.submit(fetch_book_type, 'VENTAS')
+        if missing:
+            # Descargar lo que falte con un solo login y una sola consulta del período
+            fetched = scraper.fetch_books_multi(rut, password, mes, ano, missing)
+            if fetched is None:
+                errors.append('No se pudo iniciar sesión o consultar el período en el SII')
+                fetched = {}
+            for book_type in missing:
+                books_by_type[book_type] = fetched.get(book_type)
+                changes[book_type] = _store_books(rut, password, mes, ano, book_type, books_by_type[book_type])
+        
+        for book_type in ('COMPRAS', 'VENTAS'):
+            books = books_by_type.get(book_type)
+            if books is None:
+                error = f'No se pudieron obtener los {book_type} del SII'
+                logger.error(error)
+                errors.append(error)
+                continue
             
-            books_result['COMPRAS'] = future_compras.result()
-            books_result['VENTAS'] = future_ventas.result()
+            cache_status = 'hit' if book_type in cached_types else 'miss'
+            logger.info(f"{book_type} obtenidos exitosamente: {len(books)} registros (cache: {cache_status})")
+            books_result[book_type] = _book_entry(books, book_type, normalize, changes.get(book_type),
+                                                  cache=cache_status)
         
         # Verificar si hubo errores
         if errors:
@@ -226,14 +545,14 @@ def sync_books():
         
         # Si ambos fueron None, retornar error
         if books_result['COMPRAS'] is None and books_result['VENTAS'] is None:
-            return jsonify({
+            return {
                 'success': False,
                 'error': 'No se pudieron obtener ni COMPRAS ni VENTAS del SII',
                 'errors': errors
-            }), 500
+            }, 500
         
         # Si al menos uno fue exitoso, retornar con data parcial
-        return jsonify({
+        return {
             'success': True,
             'data': {
                 'COMPRAS': books_result['COMPRAS'],
@@ -242,20 +561,612 @@ def sync_books():
                 'ano': ano,
                 'rut': rut
             }
-        }), 200
+        }, 200
+        
+    except Exception as e:
+        return _error_response(e)
+
+
+@app.route('/api/summary', methods=['POST'])
+def summary():
+    """
+    Endpoint de resumen del período: totales agrupados de COMPRAS y VENTAS y cifras del F29
+    Usa el mismo cache que /api/sync-books, así un resumen tras un "Sinc" no vuelve al SII
+    
+    Body esperado:
+    {
+        "rut": "77956294-8",
+        "password": "Tr7795629.",
+        "mes": 10,
+        "ano": 2025,
+        "async": false,  # opcional: true responde 202 con un job_id
+        "cache": true    # opcional: false ignora el cache y va al SII
+    }
+    
+    Respuesta:
+    {
+        "success": true,
+        "data": {
+            "COMPRAS": {"totales": {...}, "por_tipo_documento": [...], "por_rut": [...], ...},
+            "VENTAS": {...},
+            "f29": {"iva_debito": 190000, "iva_credito": 95000, "iva_determinado": 95000},
+            "mes": 10,
+            "ano": 2025,
+            "rut": "77956294-8"
+        }
+    }
+    """
+    try:
+        data = request.get_json()
+        
+        # Validar datos requeridos
+        required_fields = ['rut', 'password', 'mes', 'ano']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({
+                    'success': False,
+                    'error': f'Campo requerido faltante: {field}'
+                }), 400
+        
+        rut = data.get('rut')
+        password = data.get('password')
+        mes = int(data.get('mes'))
+        ano = int(data.get('ano'))
         
     except ValueError as e:
+        body, status = _error_response(e)
+        return jsonify(body), status
+    
+    use_cache = _use_cache(data)
+    timed = _wants_timings(data)
+    
+    if _wants_async(data):
+        job = jobs.submit('summary', {'rut': rut, 'mes': mes, 'ano': ano},
+                          lambda: _timed(timed, _run_summary, rut, password, mes, ano, use_cache))
+        return _job_accepted(job)
+    
+    body, status = _timed(timed, _run_summary, rut, password, mes, ano, use_cache)
+    return _json_response(body, status)
+
+
+def _run_summary(rut: str, password: str, mes: int, ano: int, use_cache: bool = False):
+    """Libros del período (vía _run_sync_books) resumidos; retorna (body, status)"""
+    # Sin normalizar: summarize lee las columnas del BookTable crudo con el esquema
+    body, status = _run_sync_books(rut, password, mes, ano, use_cache, normalize=False)
+    if status != 200:
+        return body, status
+    
+    try:
+        books = body['data']
+        result = {'mes': mes, 'ano': ano, 'rut': rut}
+        for book_type in ('COMPRAS', 'VENTAS'):
+            book = books.get(book_type)
+            if book is None:
+                result[book_type] = None
+                continue
+            book_summary = parser.summarize(book['registros'], book_type)
+            book_summary['cache'] = book['cache']
+            result[book_type] = book_summary
+        
+        iva_debito = (result['VENTAS'] or {}).get('f29', {}).get('iva_debito', 0)
+        iva_credito = (result['COMPRAS'] or {}).get('f29', {}).get('iva_credito', 0)
+        result['f29'] = {
+            'iva_debito': iva_debito,
+            'iva_credito': iva_credito,
+            'iva_determinado': iva_debito - iva_credito
+        }
+        
+        return {'success': True, 'data': result}, 200
+        
+    except Exception as e:
+        return _error_response(e)
+
+
+MAX_RANGE_PERIODS = int(os.getenv('SII_MAX_RANGE_PERIODS', 24))
+
+
+def _parse_periods(data):
+    """Validar "periodos" y "tipos" de un body; retorna (periods, book_types)"""
+    periods = [(int(p['mes']), int(p['ano'])) for p in data.get('periodos')]
+    book_types = tuple(data.get('tipos', ['COMPRAS', 'VENTAS']))
+    
+    if not periods:
+        raise ValueError('periodos no puede estar vacío')
+    if len(periods) > MAX_RANGE_PERIODS:
+        raise ValueError(f'Máximo {MAX_RANGE_PERIODS} períodos por solicitud')
+    if any(mes < 1 or mes > 12 for mes, _ in periods):
+        raise ValueError('mes debe estar entre 1 y 12')
+    if not book_types or any(t not in ['COMPRAS', 'VENTAS'] for t in book_types):
+        raise ValueError('tipos debe contener solo COMPRAS y/o VENTAS')
+    return periods, book_types
+
+
+@app.route('/api/sync-range', methods=['POST'])
+def sync_range():
+    """
+    Endpoint para sincronizar varios períodos con un solo login en el SII
+    
+    Body esperado:
+    {
+        "rut": "77956294-8",
+        "password": "Tr7795629.",
+        "periodos": [{"mes": 1, "ano": 2025}, {"mes": 2, "ano": 2025}],
+        "tipos": ["COMPRAS", "VENTAS"],  # opcional, default: ambos
+        "async": false,                  # opcional: true responde 202 con un job_id
+        "cache": true                    # opcional: false ignora el cache y va al SII
+    }
+    
+    Respuesta:
+    {
+        "success": true,
+        "data": {
+            "rut": "77956294-8",
+            "periodos": [
+                {
+                    "mes": 1,
+                    "ano": 2025,
+                    "COMPRAS": {"registros": [...], "cantidad": 5, "sync_date": "..."},
+                    "VENTAS": {"registros": [...], "cantidad": 3, "sync_date": "..."}
+                }
+            ]
+        }
+    }
+    """
+    try:
+        data = request.get_json()
+        
+        # Validar datos requeridos
+        required_fields = ['rut', 'password', 'periodos']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({
+                    'success': False,
+                    'error': f'Campo requerido faltante: {field}'
+                }), 400
+        
+        rut = data.get('rut')
+        password = data.get('password')
+        periods, book_types = _parse_periods(data)
+        
+    except (ValueError, KeyError, TypeError) as e:
         logger.error(f"Error de validación: {str(e)}")
         return jsonify({
             'success': False,
             'error': f'Error de validación: {str(e)}'
         }), 400
+    
+    use_cache = _use_cache(data)
+    normalize = _normalize(data)
+    timed = _wants_timings(data)
+    
+    if _wants_async(data):
+        job = jobs.submit('sync-range', {'rut': rut, 'periodos': [list(p) for p in periods], 'tipos': list(book_types)},
+                          lambda: _timed(timed, _run_sync_range, rut, password, periods, book_types, use_cache,
+                                         normalize))
+        return _job_accepted(job)
+    
+    body, status = _timed(timed, _run_sync_range, rut, password, periods, book_types, use_cache, normalize)
+    return _json_response(body, status)
+
+
+def _run_sync_range(rut: str, password: str, periods, book_types, use_cache: bool = False,
+                    normalize: bool = False):
+    """Scraping de varios períodos; retorna (body, status)"""
+    try:
+        logger.info(f"Iniciando sincronización de {len(periods)} períodos para RUT: {rut}")
+        
+        results = {
+            (mes, ano): {t: _cached_books(rut, password, mes, ano, t, use_cache) for t in book_types}
+            for mes, ano in periods
+        }
+        cached = {(period, t) for period, books in results.items() for t, records in books.items() if records is not None}
+        missing = [period for period in periods if any(v is None for v in results[period].values())]
+        changes = {}
+        
+        if missing:
+            fetched = scraper.fetch_range(rut, password, missing, book_types)
+            if fetched is None:
+                return {
+                    'success': False,
+                    'error': 'No se pudo iniciar sesión en el SII'
+                }, 500
+            for period, books in fetched.items():
+                for book_type, records in books.items():
+                    if (period, book_type) not in cached:
+                        results[period][book_type] = records
+                        changes[(period, book_type)] = _store_books(rut, password, period[0], period[1],
+                                                                    book_type, records)
+        
+        errors = []
+        periodos = []
+        for mes, ano in periods:
+            periodo = {'mes': mes, 'ano': ano}
+            for book_type in book_types:
+                books = results.get((mes, ano), {}).get(book_type)
+                if books is None:
+                    errors.append(f'No se pudieron obtener los {book_type} de {mes:02d}/{ano}')
+                    periodo[book_type] = None
+                    continue
+                periodo[book_type] = _book_entry(
+                    books, book_type, normalize, changes.get(((mes, ano), book_type)),
+                    cache='hit' if ((mes, ano), book_type) in cached else 'miss'
+                )
+            periodos.append(periodo)
+        
+        if errors:
+            logger.error(f"Errores durante la sincronización: {errors}")
+        
+        response = {
+            'success': True,
+            'data': {
+                'rut': rut,
+                'periodos': periodos
+            }
+        }
+        if errors:
+            response['errors'] = errors
+        return response, 200
+        
+    except Exception as e:
+        return _error_response(e)
+
+
+@app.route('/api/sync-portfolio', methods=['POST'])
+def sync_portfolio():
+    """
+    Endpoint para sincronizar todas las empresas de una persona natural con un solo login
+    
+    Recorre las empresas del select de RUT de consdcvinternetui (las que
+    representa el usuario) y obtiene los libros del período de cada una.
+    
+    Body esperado:
+    {
+        "rut": "12345678-9",            # RUT de la persona natural
+        "password": "...",
+        "mes": 10,
+        "ano": 2025,
+        "tipos": ["COMPRAS", "VENTAS"],  # opcional, default: ambos
+        "async": false                   # opcional: true responde 202 con un job_id
+    }
+    
+    Respuesta:
+    {
+        "success": true,
+        "data": {
+            "rut": "12345678-9",
+            "mes": 10,
+            "ano": 2025,
+            "empresas": [
+                {"rut": "77956294-8", "COMPRAS": {"registros": [...], "cantidad": 5, ...}, "VENTAS": {...}}
+            ]
+        }
+    }
+    """
+    try:
+        data = request.get_json()
+        
+        # Validar datos requeridos
+        required_fields = ['rut', 'password', 'mes', 'ano']
+        for field in required_fields:
+            if field not in data:
+                return jsonify({
+                    'success': False,
+                    'error': f'Campo requerido faltante: {field}'
+                }), 400
+        
+        rut = data.get('rut')
+        password = data.get('password')
+        mes = int(data.get('mes'))
+        ano = int(data.get('ano'))
+        book_types = tuple(data.get('tipos', ['COMPRAS', 'VENTAS']))
+        
+        if not book_types or any(t not in ['COMPRAS', 'VENTAS'] for t in book_types):
+            raise ValueError('tipos debe contener solo COMPRAS y/o VENTAS')
+        
+    except (ValueError, TypeError) as e:
+        body, status = _error_response(ValueError(str(e)))
+        return jsonify(body), status
+    
+    normalize = _normalize(data)
+    timed = _wants_timings(data)
+    
+    if _wants_async(data):
+        job = jobs.submit('sync-portfolio', {'rut': rut, 'mes': mes, 'ano': ano, 'tipos': list(book_types)},
+                          lambda: _timed(timed, _run_sync_portfolio, rut, password, mes, ano, book_types, normalize))
+        return _job_accepted(job)
+    
+    body, status = _timed(timed, _run_sync_portfolio, rut, password, mes, ano, book_types, normalize)
+    return _json_response(body, status)
+
+
+def _run_sync_portfolio(rut: str, password: str, mes: int, ano: int, book_types, normalize: bool = False):
+    """Scraping de la cartera de una persona natural; retorna (body, status)"""
+    try:
+        logger.info(f"Iniciando sincronización de cartera para RUT: {rut}, mes: {mes}, año: {ano}")
+        
+        portfolio = scraper.fetch_portfolio(rut, password, mes, ano, book_types)
+        if portfolio is None:
+            return {
+                'success': False,
+                'error': 'No se pudo iniciar sesión en el SII'
+            }, 500
+        
+        errors = []
+        empresas = []
+        for company, books in portfolio.items():
+            empresa = {'rut': company}
+            for book_type in book_types:
+                records = books.get(book_type)
+                if records is None:
+                    errors.append(f'No se pudieron obtener los {book_type} de {company}')
+                    empresa[book_type] = None
+                    continue
+                empresa[book_type] = _book_entry(records, book_type, normalize)
+            empresas.append(empresa)
+        
+        if errors:
+            logger.error(f"Errores durante la sincronización: {errors}")
+        
+        response = {
+            'success': True,
+            'data': {
+                'rut': rut,
+                'mes': mes,
+                'ano': ano,
+                'empresas': empresas
+            }
+        }
+        if errors:
+            response['errors'] = errors
+        return response, 200
+        
     except Exception as e:
-        logger.error(f"Error inesperado: {str(e)}", exc_info=True)
+        return _error_response(e)
+
+
+MAX_BATCH_COMPANIES = int(os.getenv('SII_MAX_BATCH_COMPANIES', 200))
+# Períodos consecutivos de una empresa que se sincronizan con un solo login (una tarea del batch)
+BATCH_PERIODS_PER_TASK = max(1, int(os.getenv('SII_BATCH_PERIODS_PER_TASK', 12)))
+
+
+@app.route('/api/sync-batch', methods=['POST'])
+def sync_batch():
+    """
+    Endpoint para sincronizar muchas empresas en una sola request
+    
+    Los períodos de cada empresa se agrupan de a BATCH_PERIODS_PER_TASK en
+    tareas que usan fetch_range (un login por tarea); el planificador las
+    reparte entre los navegadores en round-robin por RUT (una tarea por RUT a
+    la vez) y la respuesta va llegando como NDJSON: una línea por empresa
+    apenas termina, y al final una línea de resumen.
+    
+    Body esperado:
+    {
+        "empresas": [
+            {
+                "rut": "77956294-8",
+                "password": "Tr7795629.",
+                "periodos": [{"mes": 1, "ano": 2025}],
+                "tipos": ["COMPRAS", "VENTAS"]  # opcional, default: ambos
+            }
+        ],
+        "cache": true  # opcional: false ignora el cache y va al SII
+    }
+    
+    Respuesta (application/x-ndjson):
+    {"rut": "77956294-8", "success": true, "periodos": [...], "errors": []}
+    ...
+    {"done": true, "empresas": 1, "exitosas": 1, "fallidas": 0, "duration_seconds": 12.3}
+    """
+    try:
+        data = request.get_json()
+        
+        if 'empresas' not in data:
+            return jsonify({
+                'success': False,
+                'error': 'Campo requerido faltante: empresas'
+            }), 400
+        
+        companies = []
+        for empresa in data.get('empresas'):
+            for field in ['rut', 'password', 'periodos']:
+                if field not in empresa:
+                    raise ValueError(f'Campo requerido faltante en empresa: {field}')
+            periods, book_types = _parse_periods(empresa)
+            companies.append((empresa['rut'], empresa['password'], periods, book_types))
+        
+        if not companies:
+            raise ValueError('empresas no puede estar vacío')
+        if len(companies) > MAX_BATCH_COMPANIES:
+            raise ValueError(f'Máximo {MAX_BATCH_COMPANIES} empresas por solicitud')
+        ruts = [rut for rut, _, _, _ in companies]
+        if len(set(ruts)) != len(ruts):
+            raise ValueError('Cada RUT debe aparecer una sola vez')
+        
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Error de validación: {str(e)}")
         return jsonify({
             'success': False,
-            'error': f'Error interno del servidor: {str(e)}'
-        }), 500
+            'error': f'Error de validación: {str(e)}'
+        }), 400
+    
+    use_cache = _use_cache(data)
+    normalize = _normalize(data)
+    logger.info(f"Iniciando sincronización batch de {len(companies)} empresas")
+    
+    chunks_by_rut = {
+        rut: [periods[i:i + BATCH_PERIODS_PER_TASK] for i in range(0, len(periods), BATCH_PERIODS_PER_TASK)]
+        for rut, _, periods, _ in companies
+    }
+    handle = batches.submit([
+        (rut, [lambda rut=rut, password=password, chunk=chunk, book_types=book_types:
+               _run_batch_periods(rut, password, chunk, book_types, use_cache, normalize)
+               for chunk in chunks_by_rut[rut]])
+        for rut, password, _, book_types in companies
+    ])
+    
+    def generate():
+        started = time.monotonic()
+        succeeded = 0
+        for rut, results in handle.results():
+            line = _batch_company_result(rut, chunks_by_rut[rut], results)
+            succeeded += line['success']
+            yield json.dumps(line, ensure_ascii=False, default=json_default) + '\n'
+        yield json.dumps({
+            'done': True,
+            'empresas': len(companies),
+            'exitosas': succeeded,
+            'fallidas': len(companies) - succeeded,
+            'duration_seconds': round(time.monotonic() - started, 1)
+        }) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def _run_batch_periods(rut: str, password: str, periods, book_types, use_cache: bool, normalize: bool = False,
+                       attempts: int = 3):
+    """Períodos de una empresa del batch con un login; si la admisión lo rechaza espera Retry-After y reintenta"""
+    for attempt in range(attempts):
+        body, status = _run_sync_range(rut, password, periods, book_types, use_cache, normalize)
+        if status != 429 or attempt == attempts - 1:
+            return body, status
+        time.sleep(min(body.get('retry_after', 1), 30))
+
+
+def _batch_company_result(rut: str, chunks, results):
+    """Línea NDJSON de una empresa a partir de los (body, status) de cada grupo de períodos"""
+    periodos = []
+    errors = []
+    for chunk, result in zip(chunks, results):
+        body, status = _error_response(result) if isinstance(result, Exception) else result
+        if status == 200:
+            periodos.extend(body['data']['periodos'])
+            errors.extend(body.get('errors', []))
+        else:
+            label = ', '.join(f"{mes:02d}/{ano}" for mes, ano in chunk)
+            errors.append(f"{label}: {body.get('error')}")
+    
+    return {
+        'rut': rut,
+        'success': bool(periodos),
+        'periodos': periodos,
+        'errors': errors
+    }
+
+
+@app.route('/api/books', methods=['POST'])
+def get_books():
+    """
+    Endpoint para leer libros ya sincronizados desde el store local (no va al SII)
+    
+    Body esperado:
+    {
+        "rut": "77956294-8",
+        "password": "Tr7795629.",  # la de la última sincronización guardada
+        "mes": 10,                 # opcional (requiere ano)
+        "ano": 2025,               # opcional: solo ano = todo el año
+        "tipo": "COMPRAS",         # opcional
+        "folio": "12345",          # opcional
+        "normalize": false         # opcional
+    }
+    
+    Respuesta:
+    {
+        "success": true,
+        "data": {
+            "rut": "77956294-8",
+            "libros": [
+                {"periodo": "2025-10", "tipo": "COMPRAS", "synced_at": "...", "registros": [...], "cantidad": 5}
+            ]
+        }
+    }
+    """
+    if book_store is None:
+        return jsonify({
+            'success': False,
+            'error': 'Store de libros deshabilitado (configurar SII_BOOK_STORE_PATH)'
+        }), 503
+    
+    try:
+        data = request.get_json()
+        
+        for field in ['rut', 'password']:
+            if field not in data:
+                return jsonify({
+                    'success': False,
+                    'error': f'Campo requerido faltante: {field}'
+                }), 400
+        
+        rut = data.get('rut')
+        password = data.get('password')
+        mes = int(data['mes']) if data.get('mes') is not None else None
+        ano = int(data['ano']) if data.get('ano') is not None else None
+        book_type = data.get('tipo')
+        
+        if mes is not None and ano is None:
+            raise ValueError('mes requiere ano')
+        if book_type is not None and book_type not in ['COMPRAS', 'VENTAS']:
+            raise ValueError('tipo debe ser COMPRAS o VENTAS')
+        
+    except (ValueError, TypeError) as e:
+        logger.error(f"Error de validación: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error de validación: {str(e)}'
+        }), 400
+    
+    if not book_store.authorized(rut, password):
+        return jsonify({
+            'success': False,
+            'error': 'RUT sin libros guardados o contraseña distinta a la de la última sincronización'
+        }), 401
+    
+    normalize = _normalize(data)
+    libros = book_store.books(rut, mes, ano, book_type, data.get('folio'))
+    if normalize:
+        for libro in libros:
+            libro['registros'], errors = parser.normalize(libro['registros'], libro['tipo'])
+            if errors:
+                libro['errores_normalizacion'] = errors
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'rut': rut,
+            'libros': libros
+        }
+    }), 200
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Estado de una sincronización asíncrona
+    
+    Respuesta:
+    {
+        "success": true,
+        "job": {
+            "job_id": "...",
+            "status": "queued" | "running" | "succeeded" | "failed",
+            "current_step": "libro:VENTAS",
+            "progress": [{"step": "login", "at": "..."}, ...],
+            "http_status": 200,
+            "result": {...}  # mismo body que el endpoint síncrono
+        }
+    }
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job no encontrado (o expirado)'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job.to_dict()
+    }), 200
 
 
 @app.route('/api/test-connection', methods=['POST'])
@@ -275,34 +1186,7 @@ def test_connection():
                 'error': 'RUT y contraseña requeridos'
             }), 400
         
-        logger.info(f"Testeando conexión para RUT: {rut}")
-        
-        # Intentar conexión REAL - sin fallback
-        try:
-            is_valid = scraper.test_credentials(rut, password)
-        except TimeoutError as e:
-            logger.error(f"Timeout en test de conexión: {str(e)}")
-            return jsonify({
-                'success': False,
-                'error': f'SII no respondió en tiempo: {str(e)}'
-            }), 504
-        except Exception as e:
-            logger.error(f"Error en test de credenciales: {str(e)}", exc_info=True)
-            return jsonify({
-                'success': False,
-                'error': f'Error conectando a SII: {str(e)}'
-            }), 500
-        
-        if is_valid:
-            return jsonify({
-                'success': True,
-                'message': 'Conexión exitosa con SII'
-            }), 200
-        else:
-            return jsonify({
-                'success': False,
-                'error': 'Credenciales inválidas o SII rechazó la autenticación'
-            }), 401
+        return _json_response(*_timed(_wants_timings(data), _run_test_connection, rut, password))
             
     except Exception as e:
         logger.error(f"Error en test de conexión: {str(e)}")
@@ -312,6 +1196,47 @@ def test_connection():
         }), 500
 
 
+def _run_test_connection(rut: str, password: str):
+    """Login de prueba contra el SII; retorna (body, status)"""
+    logger.info(f"Testeando conexión para RUT: {rut}")
+    
+    # Intentar conexión REAL - sin fallback
+    try:
+        is_valid = scraper.test_credentials(rut, password)
+    except AdmissionRejected as e:
+        return _error_response(e)
+    except TimeoutError as e:
+        logger.error(f"Timeout en test de conexión: {str(e)}")
+        return {
+            'success': False,
+            'error': f'SII no respondió en tiempo: {str(e)}'
+        }, 504
+    except Exception as e:
+        logger.error(f"Error en test de credenciales: {str(e)}", exc_info=True)
+        return {
+            'success': False,
+            'error': f'Error conectando a SII: {str(e)}'
+        }, 500
+    
+    if is_valid:
+        return {
+            'success': True,
+            'message': 'Conexión exitosa con SII'
+        }, 200
+    return {
+        'success': False,
+        'error': 'Credenciales inválidas o SII rechazó la autenticación'
+    }, 401
+
+
+@app.errorhandler(JobQueueFull)
+def job_queue_full(e):
+    return jsonify({
+        'success': False,
+        'error': f'Demasiadas sincronizaciones en cola: {str(e)}'
+    }), 503
+
+
 @app.errorhandler(404)
 def not_found(e):
     return jsonify({
@@ -0,0 +1,3 @@
+"""
+Benchmarks de la API contra el SII falso (fake_sii.py)
+"""
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+"""
+Benchmark de /api/sync-sii, /api/sync-books y /api/test-connection contra el SII falso
+
+Levanta fake_sii.py en un hilo y la API (app.py) en un subproceso apuntando
+a él, y por cada tamaño de libro, endpoint y concurrencia mide:
+latencia p50/p95/p99, throughput, RSS máximo de la API + Chromium, cantidad
+máxima de procesos Chromium y los tiempos por paso que la API publica en
+/api/metrics. El resultado se guarda en JSON para comparar entre commits.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_sync --rows 6,500 --concurrency 1,4 --requests 20
+    python -m benchmarks.bench_sync --compare benchmarks/results/anterior.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from fake_sii import FakeSIIConfig, format_rut, parse_latency, serve_in_thread, sii_env
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+
+ENDPOINTS = ('sync-sii', 'sync-books', 'test-connection')
+
+# Histogramas de /api/metrics que se reportan como tiempos por paso
+STEP_METRICS = ('scraper_step_seconds', 'scraper_wait_seconds', 'admission_wait_seconds')
+
+PASSWORD = 'benchmark'
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentil por interpolación lineal (q en 0..1)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+class ProcessSampler:
+    """
+    Muestrea RSS y procesos Chromium del árbol de procesos de la API
+
+    Lee /proc directamente (Linux); en otros sistemas no reporta nada.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_bytes = 0
+        self.peak_chromium = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    @property
+    def supported(self) -> bool:
+        return os.path.isdir('/proc/self')
+
+    def __enter__(self):
+        if self.supported:
+            self._thread = threading.Thread(target=self._run, name='bench-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss, chromium = self.sample()
+            self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+            self.peak_chromium = max(self.peak_chromium, chromium)
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        """(RSS total del árbol en bytes, procesos Chromium en el árbol)"""
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            # El nombre va entre paréntesis y puede contener espacios
+            ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+
+        rss = chromium = 0
+        pending = [self.pid]
+        while pending:
+            pid = pending.pop()
+            pending.extend(children.get(pid, ()))
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    rss += int(f.read().split()[1]) * self._page_size
+                with open(f'/proc/{pid}/comm') as f:
+                    name = f.read().strip().lower()
+            except OSError:
+                continue
+            if 'chrom' in name or 'headless_shell' in name:
+                chromium += 1
+        return rss, chromium
+
+
+class ApiProcess:
+    """La API (app.py) en un subproceso apuntando al SII falso"""
+
+    def __init__(self, fake_base_url: str, env: Dict[str, str], log_path: Optional[str] = None):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ, **env, **sii_env(fake_base_url), 'PORT': str(self.port), 'FLASK_DEBUG': 'False'}
+        self.log_path = log_path
+        self.process: Optional[subprocess.Popen] = None
+
+    def __enter__(self):
+        log = open(self.log_path, 'ab') if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen([sys.executable, 'app.py'], cwd=BACKEND_DIR, env=self.env,
+                                        stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"La API terminó al iniciar (código {self.process.returncode})")
+            try:
+                if requests.get(f"{self.base_url}/health", timeout=2).ok:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        self.__exit__()
+        raise RuntimeError("La API no respondió /health en 60s")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def metrics(self) -> Dict[str, Any]:
+        response = requests.get(f"{self.base_url}/api/metrics", timeout=10)
+        response.raise_for_status()
+        return response.json().get('metrics', {})
+
+
+def _payload(endpoint: str, index: int, mes: int, ano: int) -> Dict[str, Any]:
+    # RUT distinto por request: sin reutilizar sesiones entre requests concurrentes
+    payload: Dict[str, Any] = {'rut': format_rut(76000000 + index), 'password': PASSWORD}
+    if endpoint != 'test-connection':
+        payload.update({'mes': mes, 'ano': ano, 'cache': False})
+    return payload
+
+
+def step_deltas(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Tiempos por paso del escenario: diferencia de count/sum de cada histograma
+
+    Returns:
+        {metric: [{'labels', 'count', 'mean', 'p50', 'p95', 'max'}]}; los
+        percentiles son los acumulados del proceso (buckets de metrics.py)
+    """
+    steps: Dict[str, Any] = {}
+    for name in STEP_METRICS:
+        previous = {json.dumps(h['labels'], sort_keys=True): h for h in before.get(name, [])}
+        for histogram in after.get(name, []):
+            old = previous.get(json.dumps(histogram['labels'], sort_keys=True), {})
+            count = histogram['count'] - old.get('count', 0)
+            if count <= 0:
+                continue
+            total = histogram['sum'] - old.get('sum', 0)
+            steps.setdefault(name, []).append({
+                'labels': histogram['labels'],
+                'count': count,
+                'mean': round(total / count, 4),
+                'p50': histogram['p50'],
+                'p95': histogram['p95'],
+                'max': histogram['max'],
+            })
+    return steps
+
+
+def run_scenario(api: ApiProcess, endpoint: str, concurrency: int, total: int,
+                 mes: int, ano: int, timeout: float, first_index: int) -> Dict[str, Any]:
+    """Lanzar `total` requests a un endpoint con `concurrency` clientes en paralelo"""
+    url = f"{api.base_url}/api/{endpoint}"
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def call(index: int):
+        started = time.perf_counter()
+        try:
+            response = requests.post(url, json=_payload(endpoint, index, mes, ano), timeout=timeout)
+            status = str(response.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == '200':
+                latencies.append(elapsed)
+
+    before = api.metrics()
+    with ProcessSampler(api.process.pid) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(call, range(first_index, first_index + total)))
+        wall = time.perf_counter() - started
+    after = api.metrics()
+
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': total,
+        'ok': len(latencies),
+        'status': statuses,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 3) if wall else None,
+        'latency_seconds': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'max': max(latencies) if latencies else None,
+        },
+        'peak_rss_mb': round(sampler.peak_rss_bytes / 1024 / 1024, 1) if sampler.supported else None,
+        'peak_chromium_processes': sampler.peak_chromium if sampler.supported else None,
+        'steps': step_deltas(before, after),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> Dict[str, Any]:
+    """Ejecutar todos los escenarios y retornar el resultado completo"""
+    api_env = {
+        'SII_SESSION_TTL_MINUTES': '15' if args.reuse_sessions else '0',
+        'SII_BOOK_STORE_PATH': '',
+    }
+    for item in args.env:
+        name, _, value = item.partition('=')
+        api_env[name] = value
+
+    result: Dict[str, Any] = {
+        'commit': _git_commit(),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(),
+                 'cpus': os.cpu_count()},
+        'config': {
+            'rows': args.rows, 'concurrency': args.concurrency, 'requests': args.requests,
+            'endpoints': args.endpoints, 'latency': args.latency, 'jitter': args.jitter,
+            'csv_only': args.csv_only, 'warmup': args.warmup, 'env': api_env,
+        },
+        'scenarios': [],
+    }
+
+    index = 0
+    for rows in args.rows:
+        config = FakeSIIConfig(rows=rows, latency_ms=parse_latency(args.latency),
+                               jitter=args.jitter, csv_only=args.csv_only)
+        server, fake_url = serve_in_thread(config)
+        try:
+            with ApiProcess(fake_url, api_env, args.api_log) as api:
+                for endpoint in args.endpoints:
+                    # Calentar: el primer request lanza Chromium y llena el pool
+                    if args.warmup:
+                        run_scenario(api, endpoint, 1, args.warmup, args.mes, args.ano, args.timeout, index)
+                        index += args.warmup
+                    for concurrency in args.concurrency:
+                        logger.info(f"rows={rows} {endpoint} concurrencia={concurrency}")
+                        scenario = run_scenario(api, endpoint, concurrency, args.requests,
+                                                args.mes, args.ano, args.timeout, index)
+                        index += args.requests
+                        scenario['rows'] = rows
+                        result['scenarios'].append(scenario)
+                        _print_scenario(scenario)
+        finally:
+            server.shutdown()
+    return result
+
+
+def _fmt(value: Optional[float], scale: float = 1000) -> str:
+    return '-' if value is None else f"{value * scale:.0f}"
+
+
+def _print_scenario(s: Dict[str, Any]):
+    latency = s['latency_seconds']
+    print(f"{s['endpoint']:<16} rows={s['rows']:<6} c={s['concurrency']:<3} "
+          f"ok={s['ok']}/{s['requests']}  p50={_fmt(latency['p50'])}ms p95={_fmt(latency['p95'])}ms "
+          f"p99={_fmt(latency['p99'])}ms  {s['throughput_rps']} req/s  "
+          f"rss={s['peak_rss_mb']}MB chromium={s['peak_chromium_processes']}")
+
+
+def _scenario_key(s: Dict[str, Any]):
+    return (s['endpoint'], s['rows'], s['concurrency'])
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]):
+    """Imprimir la variación de p50/p95/throughput respecto de un resultado anterior"""
+    previous = {_scenario_key(s): s for s in baseline.get('scenarios', [])}
+    print(f"\nComparación con {baseline.get('commit')} ({baseline.get('fecha')}):")
+    for s in current['scenarios']:
+        old = previous.get(_scenario_key(s))
+        if old is None:
+            continue
+        parts = []
+        for field in ('p50', 'p95'):
+            new_value, old_value = s['latency_seconds'][field], old['latency_seconds'][field]
+            if new_value is not None and old_value:
+                parts.append(f"{field} {(new_value / old_value - 1) * 100:+.1f}%")
+        if s['throughput_rps'] is not None and old['throughput_rps']:
+            parts.append(f"throughput {(s['throughput_rps'] / old['throughput_rps'] - 1) * 100:+.1f}%")
+        print(f"  {s['endpoint']:<16} rows={s['rows']:<6} c={s['concurrency']:<3} {'  '.join(parts)}")
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los endpoints de sync contra el SII falso")
+    parser.add_argument('--endpoints', type=lambda v: [e.strip() for e in v.split(',')],
+                        default=list(ENDPOINTS), help="endpoints separados por coma")
+    parser.add_argument('--rows', type=_int_list, default=[6, 500],
+                        help="filas por libro, una corrida de la API por valor (ej: 6,500,5000)")
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 4], help="clientes en paralelo (ej: 1,4,8)")
+    parser.add_argument('--requests', type=int, default=10, help="requests por escenario")
+    parser.add_argument('--warmup', type=int, default=1, help="requests de calentamiento por endpoint")
+    parser.add_argument('--latency', default='', help="demoras del SII falso en ms, ej: login=800,resumen=1500")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--csv-only', action='store_true', help="forzar el camino del data URI")
+    parser.add_argument('--mes', type=int, default=10)
+    parser.add_argument('--ano', type=int, default=2025)
+    parser.add_argument('--timeout', type=float, default=300.0, help="timeout por request (s)")
+    parser.add_argument('--reuse-sessions', action='store_true',
+                        help="mantener el cache de sesiones de la API (default: cada request hace login)")
+    parser.add_argument('--env', action='append', default=[], metavar='NOMBRE=VALOR',
+                        help="variable extra para la API, ej: --env SII_BROWSER_POOL_SIZE=4")
+    parser.add_argument('--api-log', help="archivo donde guardar la salida de la API")
+    parser.add_argument('--output', help="archivo JSON de resultados (default: benchmarks/results/<fecha>-<commit>.json)")
+    parser.add_argument('--compare', help="resultado JSON anterior para comparar")
+    args = parser.parse_args()
+
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"endpoints desconocidos: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    result = run(args)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{result['commit'] or 'sin-commit'}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), result)
+
+
+if __name__ == '__main__':
+    main()
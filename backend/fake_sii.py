@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+"""
+Fake SII - SII local y determinista para medir el scraper sin tocar zeusr.sii.cl / www4.sii.cl
+
+Reproduce lo que usa el scraper: el formulario de login (input#rutcntr,
+input#clave, button#bt_ingresar), la redirección con cookie TOKEN, la página
+consdcvinternetui con sus selects (RUT, mes, año), el modal #esperaDialog,
+los tabs COMPRA / VENTA, el XHR facadeService/getResumen y el link de
+descarga con data URI. Cada respuesta puede demorarse a propósito.
+
+Uso:
+    python fake_sii.py --port 5055 --rows 500 --latency login=800,page=200,resumen=1500
+
+y levantar la API apuntando al SII falso:
+    SII_LOGIN_URL=http://127.0.0.1:5055/AUT2000/InicioAutenticacion/IngresoRutClave.html
+    SII_DESTINATION_URL=http://127.0.0.1:5055/consdcvinternetui/#/index
+"""
+
+import argparse
+import csv
+import html
+import io
+import json
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import Flask, Response, jsonify, make_response, redirect, request
+
+from services.sii_records import OPERACIONES, resumen_to_records
+
+logger = logging.getLogger(__name__)
+
+LOGIN_PATH = "/AUT2000/InicioAutenticacion/IngresoRutClave.html"
+LOGIN_POST_PATH = "/cgi_AUT2000/CAutInicio.cgi"
+DESTINATION_PATH = "/consdcvinternetui/"
+FACADE_PATH = "/consdcvinternetui/services/data/facadeService/"
+
+# Tipos de documento reales para las primeras filas del resumen; el resto es sintético
+DOCUMENT_TYPES = [
+    (33, "Factura Electrónica"),
+    (34, "Factura No Afecta o Exenta Electrónica"),
+    (61, "Nota de Crédito Electrónica"),
+    (56, "Nota de Débito Electrónica"),
+    (46, "Factura de Compra Electrónica"),
+    (43, "Liquidación Factura Electrónica"),
+]
+
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio",
+         "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+
+
+class FakeSIIConfig:
+    """Parámetros del SII falso (tamaño de libros, latencias, credenciales)"""
+
+    def __init__(self, rows: int = 6, companies: int = 1, password: Optional[str] = None,
+                 latency_ms: Optional[Dict[str, float]] = None, jitter: float = 0.0,
+                 csv_only: bool = False, seed: int = 0):
+        """
+        Args:
+            rows: Filas del resumen de cada libro (JSON de getResumen y CSV de descarga)
+            companies: Empresas del select de RUT; más de una = login de persona natural
+            password: Única contraseña aceptada (None: cualquiera no vacía)
+            latency_ms: Demora por tipo de respuesta: login, page, resumen
+            jitter: Variación relativa de la demora (0.2 = ±20%)
+            csv_only: getResumen responde con error y los registros sólo salen del data URI
+            seed: Semilla de los montos generados
+        """
+        self.rows = rows
+        self.companies = max(1, companies)
+        self.password = password
+        self.latency_ms = {'login': 0.0, 'page': 0.0, 'resumen': 0.0, **(latency_ms or {})}
+        self.jitter = jitter
+        self.csv_only = csv_only
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls) -> "FakeSIIConfig":
+        """Crear la configuración desde FAKE_SII_ROWS, FAKE_SII_COMPANIES, FAKE_SII_PASSWORD,
+        FAKE_SII_LATENCY (ej: "login=800,resumen=1500"), FAKE_SII_JITTER y FAKE_SII_CSV_ONLY"""
+        return cls(
+            rows=int(os.getenv('FAKE_SII_ROWS', 6)),
+            companies=int(os.getenv('FAKE_SII_COMPANIES', 1)),
+            password=os.getenv('FAKE_SII_PASSWORD') or None,
+            latency_ms=parse_latency(os.getenv('FAKE_SII_LATENCY', '')),
+            jitter=float(os.getenv('FAKE_SII_JITTER', 0)),
+            csv_only=os.getenv('FAKE_SII_CSV_ONLY', '').lower() in ('1', 'true', 'on'),
+            seed=int(os.getenv('FAKE_SII_SEED', 0)),
+        )
+
+    def delay(self, kind: str):
+        """Dormir la latencia configurada para kind"""
+        base = self.latency_ms.get(kind, 0.0)
+        if base <= 0:
+            return
+        factor = 1 + random.uniform(-self.jitter, self.jitter) if self.jitter else 1
+        time.sleep(max(0.0, base * factor) / 1000)
+
+
+def parse_latency(spec: str) -> Dict[str, float]:
+    """'login=800,resumen=1500' -> {'login': 800.0, 'resumen': 1500.0}"""
+    latency = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        kind, _, value = part.partition('=')
+        latency[kind.strip()] = float(value)
+    return latency
+
+
+def rut_dv(numero: int) -> str:
+    """Dígito verificador (módulo 11) de un RUT"""
+    total, factor = 0, 2
+    for digit in reversed(str(numero)):
+        total += int(digit) * factor
+        factor = 2 if factor == 7 else factor + 1
+    dv = 11 - total % 11
+    return {11: '0', 10: 'K'}.get(dv, str(dv))
+
+
+def format_rut(numero: int) -> str:
+    return f"{numero:,}".replace(',', '.') + f"-{rut_dv(numero)}"
+
+
+def resumen_rows(config: FakeSIIConfig, rut_emisor: str, ptributario: str, operacion: str) -> List[Dict[str, Any]]:
+    """Filas 'data' de getResumen; las mismas para los mismos parámetros (montos deterministas)"""
+    rng = random.Random(f"{config.seed}|{rut_emisor}|{ptributario}|{operacion}")
+    rows = []
+    for i in range(config.rows):
+        if i < len(DOCUMENT_TYPES):
+            codigo, nombre = DOCUMENT_TYPES[i]
+        else:
+            codigo, nombre = 1000 + i, f"Documento Sintético {1000 + i}"
+        neto = rng.randint(10_000, 50_000_000)
+        exento = rng.choice([0, 0, 0, rng.randint(1_000, 1_000_000)])
+        iva = round(neto * 0.19)
+        rows.append({
+            'dcvNombreTipoDoc': nombre,
+            'rsmnTipoDocInteger': codigo,
+            'rsmnTotDoc': rng.randint(1, 500),
+            'rsmnMntExe': exento,
+            'rsmnMntNeto': neto,
+            'rsmnMntIVA': iva,
+            'rsmnIVAUsoComun': 0,
+            'rsmnMntIVANoRec': 0,
+            'rsmnMntTotal': neto + exento + iva,
+        })
+    return rows
+
+
+def resumen_csv(rows: List[Dict[str, Any]], operacion: str) -> str:
+    """CSV de descarga (separado por ';') con las mismas columnas que arma sii_records para el libro"""
+    book_type = next((book for book, op in OPERACIONES.items() if op == operacion), 'COMPRAS')
+    records = resumen_to_records(rows, book_type)
+    buffer = io.StringIO()
+    if records:
+        writer = csv.DictWriter(buffer, fieldnames=list(records[0]), delimiter=';', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+    return buffer.getvalue()
+
+
+LOGIN_HTML = """<!DOCTYPE html>
+<html lang="es"><head><meta charset="utf-8"><title>SII - Ingreso (falso)</title></head>
+<body>
+<form id="myform" method="post" action="{action}">
+  <input type="hidden" name="referencia" value="{referencia}">
+  <label>RUT <input type="text" id="rutcntr" name="rutclave"></label>
+  <label>Clave <input type="password" id="clave" name="password"></label>
+  <button type="submit" id="bt_ingresar">Ingresar</button>
+</form>
+{error}
+</body></html>"""
+
+BOOKS_HTML = """<!DOCTYPE html>
+<html lang="es"><head><meta charset="utf-8"><title>Registro de Compras y Ventas (falso)</title>
+<style>#esperaDialog {{ position: fixed; inset: 0; background: #fff8; }} .oculto {{ display: none; }}</style>
+</head>
+<body>
+<div id="esperaDialog" class="oculto">Espere un momento...</div>
+<form onsubmit="return false">
+  <select id="rut" {rut_disabled}>{rut_options}</select>
+  <select id="periodoMes"><option value="">Mes</option>{month_options}</select>
+  <select id="periodoAnho"><option value="">Año</option>{year_options}</select>
+  <button type="button" id="consultar">Consultar</button>
+</form>
+<div id="resultado" class="oculto">
+  <ul id="tabs"><li><a href="#" data-op="COMPRA">COMPRA</a></li><li><a href="#" data-op="VENTA">VENTA</a></li></ul>
+  <button type="button" id="descargar">Descargar</button>
+  <a id="descarga" download="resumen.csv">Descargar Detalles</a>
+  <table id="tabla"></table>
+</div>
+<script>
+const dialog = document.getElementById('esperaDialog');
+function consultar(operacion) {{
+  const rut = document.getElementById('rut').value.split('-');
+  const ptributario = document.getElementById('periodoAnho').value + document.getElementById('periodoMes').value;
+  dialog.classList.remove('oculto');
+  return fetch('{facade}getResumen', {{
+    method: 'POST',
+    headers: {{'Content-Type': 'application/json'}},
+    body: JSON.stringify({{
+      metaData: {{namespace: 'cl.sii.sdi.lob.diii.consdcv.data.api.interfaces.FacadeService/getResumen', page: null}},
+      data: {{rutEmisor: rut[0], dvEmisor: rut[1], ptributario: ptributario, estadoContab: 'REGISTRO',
+             operacion: operacion, busquedaInicial: true}}
+    }})
+  }}).then(r => r.json()).then(body => {{
+    document.getElementById('tabla').innerHTML = (body.data || []).map(
+      d => '<tr><td>' + d.dcvNombreTipoDoc + '</td><td>' + d.rsmnMntTotal + '</td></tr>').join('');
+    document.getElementById('descarga').href = 'data:text/csv;charset=utf-8,' + encodeURIComponent(body.descarga || '');
+    document.getElementById('resultado').classList.remove('oculto');
+  }}).finally(() => dialog.classList.add('oculto'));
+}}
+document.getElementById('consultar').addEventListener('click', () => consultar('COMPRA'));
+document.querySelectorAll('#tabs a').forEach(a => a.addEventListener('click', e => {{
+  e.preventDefault();
+  consultar(a.dataset.op);
+}}));
+</script>
+</body></html>"""
+
+
+def create_app(config: Optional[FakeSIIConfig] = None) -> Flask:
+    """App Flask del SII falso"""
+    config = config or FakeSIIConfig.from_env()
+    app = Flask(__name__)
+    # TOKEN de sesión -> RUT autenticado
+    sessions: Dict[str, str] = {}
+    counters: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def count(name: str):
+        with lock:
+            counters[name] = counters.get(name, 0) + 1
+
+    def session_rut() -> Optional[str]:
+        return sessions.get(request.cookies.get('TOKEN', ''))
+
+    def login_page(referencia: str, error: str = '') -> str:
+        return LOGIN_HTML.format(action=LOGIN_POST_PATH, referencia=html.escape(referencia, quote=True),
+                                 error=f'<p class="error">{html.escape(error)}</p>' if error else '')
+
+    @app.route(LOGIN_PATH, methods=['GET'])
+    def login():
+        count('login_page')
+        config.delay('page')
+        referencia = request.query_string.decode('utf-8') or request.host_url.rstrip('/') + DESTINATION_PATH
+        return login_page(referencia)
+
+    @app.route(LOGIN_POST_PATH, methods=['POST'])
+    def login_post():
+        count('login_post')
+        config.delay('login')
+        form = request.form
+        rut = (form.get('rutcntr') or form.get('rutclave') or '').replace('.', '').upper()
+        password = form.get('clave') or form.get('password') or ''
+        referencia = form.get('referencia') or request.host_url.rstrip('/') + DESTINATION_PATH
+
+        if '-' not in rut:
+            return login_page(referencia, 'Usuario no existe')
+        if not password or (config.password is not None and password != config.password):
+            return login_page(referencia, 'Clave incorrecta')
+
+        token = secrets.token_hex(16)
+        with lock:
+            sessions[token] = rut
+        response = make_response(redirect(referencia))
+        response.set_cookie('TOKEN', token, httponly=True)
+        return response
+
+    @app.route(DESTINATION_PATH, methods=['GET'])
+    def books_page():
+        count('books_page')
+        config.delay('page')
+        rut = session_rut()
+        if rut is None:
+            return redirect(f"{LOGIN_PATH}?{request.host_url.rstrip('/')}{DESTINATION_PATH}#/index")
+
+        numero = int(rut.split('-')[0])
+        ruts = [format_rut(numero)] + [format_rut(76_000_000 + i) for i in range(1, config.companies)]
+        rut_options = ''.join(
+            f'<option value="{r.replace(".", "")}">{r} EMPRESA DE PRUEBA {i + 1} SPA</option>'
+            for i, r in enumerate(ruts)
+        )
+        month_options = ''.join(f'<option value="{m:02d}">{MESES[m - 1]}</option>' for m in range(1, 13))
+        this_year = time.localtime().tm_year
+        year_options = ''.join(f'<option value="{y}">{y}</option>' for y in range(this_year, this_year - 10, -1))
+        return BOOKS_HTML.format(
+            rut_disabled='' if config.companies > 1 else 'disabled',
+            rut_options=rut_options,
+            month_options=month_options,
+            year_options=year_options,
+            facade=FACADE_PATH,
+        )
+
+    @app.route(f"{FACADE_PATH}getResumen", methods=['POST'])
+    def get_resumen():
+        count('get_resumen')
+        if session_rut() is None:
+            # El SII real responde HTML del login cuando la sesión expiró
+            return redirect(LOGIN_PATH)
+        config.delay('resumen')
+
+        data = (request.get_json(silent=True) or {}).get('data') or {}
+        rows = resumen_rows(config, str(data.get('rutEmisor')), str(data.get('ptributario')),
+                            str(data.get('operacion')))
+        body: Dict[str, Any] = {
+            'data': rows,
+            'metaData': None,
+            'respEstado': {'codRespuesta': 0, 'msgeRespuesta': None},
+            # Sólo del SII falso: contenido del link de descarga que arma la página
+            'descarga': resumen_csv(rows, str(data.get('operacion'))),
+        }
+        if config.csv_only:
+            body['data'] = []
+            body['respEstado'] = {'codRespuesta': 99, 'msgeRespuesta': 'Resumen deshabilitado (csv_only)'}
+        return Response(json.dumps(body, ensure_ascii=False), mimetype='application/json')
+
+    @app.route('/fake/stats', methods=['GET'])
+    def stats():
+        with lock:
+            return jsonify({'requests': dict(counters), 'sessions': len(sessions)})
+
+    return app
+
+
+def serve_in_thread(config: Optional[FakeSIIConfig] = None, host: str = '127.0.0.1',
+                    port: int = 0) -> Tuple[Any, str]:
+    """
+    Levantar el SII falso en un hilo (para benchmarks y scripts)
+
+    Returns:
+        (servidor werkzeug, URL base); server.shutdown() lo detiene
+    """
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, create_app(config), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='fake-sii', daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def sii_env(base_url: str) -> Dict[str, str]:
+    """Variables de entorno que apuntan el scraper al SII falso en base_url"""
+    return {
+        'SII_LOGIN_URL': f"{base_url}{LOGIN_PATH}",
+        'SII_DESTINATION_URL': f"{base_url}{DESTINATION_PATH}#/index",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SII falso para pruebas y benchmarks del scraper")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--rows', type=int, default=int(os.getenv('FAKE_SII_ROWS', 6)),
+                        help="filas del resumen de cada libro")
+    parser.add_argument('--companies', type=int, default=int(os.getenv('FAKE_SII_COMPANIES', 1)),
+                        help="empresas en el select de RUT (>1 = persona natural)")
+    parser.add_argument('--password', default=os.getenv('FAKE_SII_PASSWORD'),
+                        help="única contraseña aceptada (default: cualquiera)")
+    parser.add_argument('--latency', default=os.getenv('FAKE_SII_LATENCY', ''),
+                        help="demoras en ms, ej: login=800,page=200,resumen=1500")
+    parser.add_argument('--jitter', type=float, default=float(os.getenv('FAKE_SII_JITTER', 0)))
+    parser.add_argument('--csv-only', action='store_true',
+                        help="getResumen responde error: los registros salen del data URI")
+    args = parser.parse_args()
+
+    config = FakeSIIConfig(rows=args.rows, companies=args.companies, password=args.password,
+                           latency_ms=parse_latency(args.latency), jitter=args.jitter,
+                           csv_only=args.csv_only or FakeSIIConfig.from_env().csv_only)
+    base_url = f"http://{args.host}:{args.port}"
+    logging.basicConfig(level=logging.INFO)
+    print("SII falso escuchando. Para apuntar la API:")
+    for name, value in sii_env(base_url).items():
+        print(f"  export {name}='{value}'")
+    create_app(config).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Admission - Control de admisión para el trabajo que usa navegadores
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from .metrics import MetricsRegistry, metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """La cola de espera por navegador está llena (o la espera se agotó)"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Semáforo global para el scraping con navegador más una cola de espera acotada.
+
+    Hasta max_in_flight trabajos corren a la vez; los siguientes esperan en una
+    cola de hasta max_queue lugares. Si la cola está llena se rechaza de
+    inmediato con AdmissionRejected, cuyo retry_after se estima con el tiempo
+    promedio (EWMA) que tardan los trabajos en liberar su lugar. Así una ráfaga
+    de requests se degrada a 429 en vez de acumular Chromiums hasta el OOM.
+    """
+
+    def __init__(self, max_in_flight: int = 2, max_queue: int = 10, max_wait_seconds: Optional[float] = 120,
+                 initial_service_seconds: float = 30, registry: Optional[MetricsRegistry] = None):
+        """
+        Inicializar el controlador
+
+        Args:
+            max_in_flight: Trabajos con navegador ejecutándose a la vez
+            max_queue: Trabajos esperando lugar antes de rechazar (0 = sin cola)
+            max_wait_seconds: Espera máxima en cola antes de rechazar (None = sin límite)
+            initial_service_seconds: Duración supuesta de un trabajo mientras no hay mediciones
+            registry: Registro de métricas (default: el global)
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight debe ser al menos 1")
+
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.metrics = registry or default_metrics
+
+        self._in_flight = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._service_seconds = initial_service_seconds
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls, default_in_flight: int = 2) -> "AdmissionController":
+        """
+        Crear el controlador desde SII_MAX_BROWSER_JOBS (default: tamaño del pool),
+        SII_ADMISSION_QUEUE y SII_ADMISSION_WAIT_SECONDS (0 = sin límite)
+        """
+        max_wait = float(os.getenv('SII_ADMISSION_WAIT_SECONDS', 120))
+        return cls(
+            max_in_flight=int(os.getenv('SII_MAX_BROWSER_JOBS', default_in_flight)),
+            max_queue=int(os.getenv('SII_ADMISSION_QUEUE', 10)),
+            max_wait_seconds=max_wait or None,
+        )
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        """
+        Ocupar un lugar durante el bloque (esperando en cola si hace falta)
+
+        Raises:
+            AdmissionRejected: Si la cola está llena o la espera supera max_wait_seconds
+        """
+        wait_started = time.monotonic()
+        self._acquire()
+        waited = time.monotonic() - wait_started
+        self.metrics.observe('admission_wait_seconds', waited)
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def retry_after(self) -> int:
+        """Segundos sugeridos al cliente antes de reintentar"""
+        with self._cond:
+            return self._retry_after_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self._in_flight,
+                'queue_depth': self._waiting,
+                'max_queue': self.max_queue,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'avg_service_seconds': round(self._service_seconds, 2),
+            }
+
+    def _acquire(self):
+        with self._cond:
+            # Los que llegan no se saltan a los que ya esperan
+            if self._in_flight < self.max_in_flight and self._waiting == 0:
+                self._in_flight += 1
+                self._admitted += 1
+                return
+
+            if self._waiting >= self.max_queue:
+                self._reject(f"Cola de navegadores llena ({self._waiting} esperando)")
+
+            self._waiting += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self._in_flight < self.max_in_flight,
+                                               timeout=self.max_wait_seconds)
+            finally:
+                self._waiting -= 1
+            if not admitted:
+                self._reject(f"Sin navegador libre tras {int(self.max_wait_seconds)}s en cola")
+
+            self._in_flight += 1
+            self._admitted += 1
+
+    def _release(self, service_seconds: float):
+        with self._cond:
+            self._in_flight -= 1
+            # EWMA: reacciona a cambios de latencia del SII sin saltar con cada outlier
+            self._service_seconds = 0.2 * service_seconds + 0.8 * self._service_seconds
+            self._cond.notify()
+
+    def _reject(self, message: str):
+        """Registrar y lanzar el rechazo; se llama con el lock tomado"""
+        self._rejected += 1
+        retry_after = self._retry_after_locked()
+        logger.warning(f"{message}; reintentar en {retry_after}s")
+        raise AdmissionRejected(message, retry_after)
+
+    def _retry_after_locked(self) -> int:
+        # Cada "ronda" libera max_in_flight lugares cada ~_service_seconds
+        rounds = (self._waiting + 1) / self.max_in_flight
+        return max(1, min(600, math.ceil(rounds * self._service_seconds)))
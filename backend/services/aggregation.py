@@ -0,0 +1,147 @@
+"""
+Aggregation - Totales agrupados de libros en una sola pasada (NumPy opcional)
+"""
+
+import logging
+import os
+from array import array
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# Bajo este número de filas el camino en Python puro es más rápido que armar arrays
+NUMPY_MIN_ROWS = 2000
+
+Groups = Dict[str, Dict[Hashable, Dict[str, float]]]
+
+# Columna codificada por diccionario: (código de cada fila, valor de cada código)
+Encoded = Tuple[Sequence[int], Sequence[Hashable]]
+
+
+def _use_numpy(rows: int, use_numpy: Optional[bool]) -> bool:
+    if use_numpy is not None:
+        return use_numpy and NUMPY_AVAILABLE
+    if os.getenv('SII_AGGREGATION_NUMPY', 'auto').lower() in ('0', 'false', 'off'):
+        return False
+    return NUMPY_AVAILABLE and rows >= NUMPY_MIN_ROWS
+
+
+def encode(values: Sequence[Hashable]) -> Encoded:
+    """Codificar una columna por diccionario (valores distintos en orden de aparición)"""
+    index: Dict[Hashable, int] = {}
+    codes = array('I', [index.setdefault(value, len(index)) for value in values])
+    return codes, list(index)
+
+
+def relabel(encoded: Encoded, fn: Callable[[Any], Hashable]) -> Encoded:
+    """
+    Aplicar fn a cada valor distinto (no a cada fila) y re-codificar
+
+    Los valores que fn vuelve iguales quedan en un solo código; sólo en ese
+    caso se recorren las filas para traducir sus códigos.
+    """
+    codes, labels = encoded
+    index: Dict[Hashable, int] = {}
+    remap = [index.setdefault(fn(label), len(index)) for label in labels]
+    if remap == list(range(len(labels))):
+        return codes, list(index)
+    if NUMPY_AVAILABLE:
+        return np.asarray(remap, dtype=np.intp)[np.asarray(codes, dtype=np.intp)], list(index)
+    return array('I', [remap[code] for code in codes]), list(index)
+
+
+def group_sums(keys: Dict[str, Encoded], values: Dict[str, Sequence[float]],
+               signs: Optional[Tuple[str, Sequence[int]]] = None,
+               use_numpy: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Sumar varias columnas agrupando por varias dimensiones a la vez
+
+    Args:
+        keys: {dimensión: columna codificada (encode / BookTable.encoded)}
+        values: {columna: valor de cada fila}
+        signs: (dimensión, signo de cada código de esa dimensión): multiplica
+            cada fila por el signo de su grupo, ej: notas de crédito restan
+        use_numpy: Forzar (True) o evitar (False) NumPy; None decide por tamaño
+
+    Returns:
+        {'totales': {columna: suma, 'cantidad': n},
+         dimensión: {clave: {columna: suma, 'cantidad': n}}, ...,
+         'engine': 'numpy' | 'python'}
+    """
+    rows = len(next(iter(values.values()))) if values else 0
+    if _use_numpy(rows, use_numpy):
+        result = _group_sums_numpy(keys, values, signs, rows)
+        result['engine'] = 'numpy'
+    else:
+        result = _group_sums_python(keys, values, signs, rows)
+        result['engine'] = 'python'
+    return result
+
+
+def _group_sums_python(keys: Dict[str, Encoded], values: Dict[str, Sequence[float]],
+                       signs: Optional[Tuple[str, Sequence[int]]], rows: int) -> Dict[str, Any]:
+    names = list(values)
+    columns = [values[name] for name in names]
+    dimensions = [(dimension, codes, labels, [None] * len(labels)) for dimension, (codes, labels) in keys.items()]
+    sign_codes, sign_of = (keys[signs[0]][0], signs[1]) if signs else (None, None)
+    totals = [0.0] * len(names)
+
+    width = len(names)
+    # Una sola pasada: cada fila suma en los totales y en su grupo de cada dimensión
+    for i, row in enumerate(zip(*columns)):
+        if sign_codes is not None and sign_of[sign_codes[i]] != 1:
+            sign = sign_of[sign_codes[i]]
+            row = [value * sign for value in row]
+        for j in range(width):
+            totals[j] += row[j]
+        for _, codes, _, groups in dimensions:
+            code = codes[i]
+            acc = groups[code]
+            if acc is None:
+                acc = groups[code] = [0.0] * (width + 1)
+            for j in range(width):
+                acc[j] += row[j]
+            acc[width] += 1
+
+    result: Dict[str, Any] = {'totales': {**dict(zip(names, totals)), 'cantidad': rows}}
+    for dimension, _, labels, groups in dimensions:
+        result[dimension] = {
+            labels[code]: {**dict(zip(names, acc[:-1])), 'cantidad': int(acc[-1])}
+            for code, acc in enumerate(groups) if acc is not None
+        }
+    return result
+
+
+def _group_sums_numpy(keys: Dict[str, Encoded], values: Dict[str, Sequence[float]],
+                      signs: Optional[Tuple[str, Sequence[int]]], rows: int) -> Dict[str, Any]:
+    names = list(values)
+    matrix = np.array([np.asarray(values[name], dtype=np.float64) for name in names]).reshape(len(names), rows)
+    if signs:
+        dimension, sign_of = signs
+        matrix *= np.asarray(sign_of, dtype=np.float64)[np.asarray(keys[dimension][0], dtype=np.intp)]
+
+    result: Dict[str, Any] = {
+        'totales': {**{name: float(total) for name, total in zip(names, matrix.sum(axis=1))}, 'cantidad': rows}
+    }
+    for dimension, (codes, labels) in keys.items():
+        # Los códigos ya son enteros 0..n-1: bincount directo, sin ordenar claves
+        codes = np.asarray(codes, dtype=np.intp)
+        counts = np.bincount(codes, minlength=len(labels))
+        sums = [np.bincount(codes, weights=matrix[j], minlength=len(labels)) for j in range(len(names))]
+        result[dimension] = {
+            labels[g]: {**{name: float(sums[j][g]) for j, name in enumerate(names)}, 'cantidad': int(counts[g])}
+            for g in range(len(labels)) if counts[g]
+        }
+    return result
+
+
+def to_list(groups: Dict[Hashable, Dict[str, float]], key_name: str) -> List[Dict[str, Any]]:
+    """Grupos como lista (para JSON) con la clave en key_name, ordenados por clave"""
+    return [{key_name: key, **sums} for key, sums in sorted(groups.items(), key=lambda item: str(item[0]))]
@@ -0,0 +1,502 @@
+"""
+Async SII Scraper - Scraper de libros SII sobre playwright.async_api (muchas sesiones en un event loop)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from playwright.async_api import async_playwright
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+    PLAYWRIGHT_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"Playwright async no disponible: {e}")
+    PLAYWRIGHT_AVAILABLE = False
+    PlaywrightTimeoutError = TimeoutError
+
+from .browser_pool import DEFAULT_LAUNCH_ARGS
+from .session_cache import SessionCache
+from .resource_filter import ResourceFilter
+from .readiness import (ANGULAR_IDLE_JS, FRESH_DATA_LINK_SELECTOR, MARK_DATA_LINKS_READ_JS,
+                        MARK_FRESH_DATA_LINKS_JS, RESUME_OUTCOME_SELECTOR, SELECT_OPTIONS_JS)
+from .sii_records import OPERACIONES, resumen_body_to_records, rut_in_option
+from .csv_stream import iter_csv_records
+from .book_table import BookTable
+from . import progress
+from . import sii_urls
+
+STEALTH_JS = """
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => false,
+    });
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => [1, 2, 3, 4, 5],
+    });
+    Object.defineProperty(navigator, 'languages', {
+        get: () => ['es-CL'],
+    });
+"""
+
+GET_RESUMEN = "facadeService/getResumen"
+
+
+class AsyncSIIScraper:
+    """
+    Scraper de libros SII nativo de asyncio.
+
+    Un solo Chromium y un solo event loop atienden muchas sesiones a la vez:
+    cada sesión es un BrowserContext propio y mientras una espera al SII las
+    demás avanzan, sin un hilo del sistema por scraping en curso. El número de
+    sesiones simultáneas se acota con max_sessions.
+
+    Los registros se leen de la respuesta JSON de getResumen que dispara la
+    SPA al presionar Consultar o cambiar de tab; el link de descarga con data
+    URI queda de respaldo.
+    """
+
+    LOGIN_URL = sii_urls.LOGIN_URL
+    DESTINATION_URL = sii_urls.DESTINATION_URL
+
+    def __init__(self, headless: bool = True, timeout: int = 120000, max_sessions: int = 16,
+                 sessions: Optional[SessionCache] = None, resource_filter: Optional[ResourceFilter] = None):
+        """
+        Inicializar el scraper (el navegador se lanza con el primer uso)
+
+        Args:
+            headless: Ejecutar navegador sin interfaz gráfica
+            timeout: Timeout en milisegundos para navegación y login
+            max_sessions: BrowserContexts abiertos a la vez sobre el mismo navegador
+            sessions: Cache de sesiones autenticadas (puede compartirse con SIIScraper)
+            resource_filter: Filtro de recursos por contexto (default: según SII_BLOCK_RESOURCES)
+        """
+        if not PLAYWRIGHT_AVAILABLE:
+            raise ImportError("Playwright no está instalado. Ejecuta: pip install playwright && playwright install chromium")
+
+        self.headless = headless
+        self.timeout = timeout
+        self.max_sessions = max_sessions
+        self.sessions = sessions or SessionCache.from_env()
+        self.resource_filter = resource_filter or ResourceFilter.from_env()
+
+        self._playwright = None
+        self._browser = None
+        # Se crean dentro del loop que usa el scraper (ver _ensure_browser)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._launch_lock: Optional[asyncio.Lock] = None
+        self._active = 0
+
+    async def test_credentials(self, rut: str, password: str) -> bool:
+        """True si el SII acepta las credenciales"""
+        try:
+            logger.info(f"Testeando credenciales para RUT: {rut}")
+            async with self._context() as context:
+                page = await self._new_page(context)
+                return await self._login(page, rut, password)
+        except Exception as e:
+            logger.error(f"Error al testear credenciales: {str(e)}")
+            return False
+
+    async def fetch_books(self, rut: str, password: str, mes: int, ano: int,
+                          book_type: str = "COMPRAS") -> Optional[List[Dict[str, Any]]]:
+        """
+        Obtener un libro del SII (COMPRAS o VENTAS)
+
+        Returns:
+            Lista de registros del libro o None si hay error
+        """
+        results = await self.fetch_books_multi(rut, password, mes, ano, (book_type,))
+        return results.get(book_type) if results else None
+
+    async def fetch_books_multi(self, rut: str, password: str, mes: int, ano: int,
+                                book_types: Tuple[str, ...] = ("COMPRAS", "VENTAS")) -> Optional[Dict[str, Optional[List[Dict[str, Any]]]]]:
+        """
+        Obtener varios libros del mismo período con un solo login y una sola consulta
+
+        Returns:
+            Dict {book_type: registros o None}, o None si fallaron el login o la consulta
+        """
+        try:
+            logger.info(f"[async] Iniciando fetch de {', '.join(book_types)} para RUT: {rut}, mes: {mes}, año: {ano}")
+            return await self._run_authenticated(rut, password, lambda page: self._fetch_on_page(page, rut, mes, ano, book_types))
+        except Exception as e:
+            logger.error(f"[async] EXCEPCIÓN al obtener {', '.join(book_types)}: {str(e)}", exc_info=True)
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'launched': self._browser is not None,
+            'max_sessions': self.max_sessions,
+            'active_sessions': self._active,
+        }
+
+    async def close(self):
+        """Cerrar navegador y Playwright"""
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                logger.warning(f"Error cerrando navegador async: {e}")
+            self._browser = None
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception as e:
+                logger.warning(f"Error deteniendo Playwright async: {e}")
+            self._playwright = None
+
+    async def _ensure_browser(self):
+        if self._launch_lock is None:
+            self._launch_lock = asyncio.Lock()
+            self._slots = asyncio.Semaphore(self.max_sessions)
+
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            logger.info("Lanzando Chromium (scraper async)...")
+            self._browser = await self._playwright.chromium.launch(headless=self.headless, args=DEFAULT_LAUNCH_ARGS)
+
+    def _context(self, storage_state: Optional[Dict[str, Any]] = None):
+        return _ContextSlot(self, storage_state)
+
+    async def _new_page(self, context):
+        if self.resource_filter is not None:
+            await self.resource_filter.install_async(context)
+        page = await context.new_page()
+        await page.add_init_script(STEALTH_JS)
+        return page
+
+    async def _run_authenticated(self, rut: str, password: str, fn: Callable[[Any], Awaitable[Any]]):
+        """
+        Ejecutar fn(page) en un contexto nuevo con sesión SII iniciada
+
+        Igual que SIIScraper: reanuda la sesión en cache si la hay y sólo hace
+        login completo si el SII la rechaza.
+        """
+        state = self.sessions.get(rut, password)
+        progress.report('esperando_navegador')
+        async with self._context(storage_state=state) as context:
+            page = await self._new_page(context)
+
+            if state is not None:
+                progress.report('reanudando_sesion')
+            if state is not None and await self._resume_session(page, rut, password):
+                logger.info("[async] Sesión SII reutilizada desde cache, omitiendo login")
+            else:
+                progress.report('login')
+                if not await self._login(page, rut, password):
+                    logger.error("[async] Fallo en login")
+                    self.sessions.invalidate(rut, password)
+                    return None
+                try:
+                    self.sessions.put(rut, password, await context.storage_state())
+                except Exception as e:
+                    logger.warning(f"No se pudo guardar la sesión en cache: {e}")
+
+            return await fn(page)
+
+    async def _resume_session(self, page, rut: str, password: str) -> bool:
+        try:
+            await page.goto(self.DESTINATION_URL, wait_until="domcontentloaded", timeout=self.timeout)
+            # Selects (sesión vigente) o el login de AUT2000 (expirada), lo que aparezca primero
+            if "consdcvinternetui" in page.url:
+                await page.locator(RESUME_OUTCOME_SELECTOR).first.wait_for(state="attached", timeout=15000)
+            if "consdcvinternetui" in page.url and await page.locator("select").count() > 0:
+                return True
+        except PlaywrightTimeoutError:
+            pass
+        except Exception as e:
+            logger.warning(f"Error reanudando sesión SII: {e}")
+
+        logger.info(f"[async] Sesión en cache rechazada por el SII para RUT: {rut}, haciendo login completo")
+        self.sessions.invalidate(rut, password)
+        return False
+
+    async def _login(self, page, rut: str, password: str) -> bool:
+        """Login con redirección a la página de libros; True si se llegó a consdcvinternetui"""
+        try:
+            logger.info(f"[async] Iniciando login para RUT: {rut}")
+            await page.add_init_script(STEALTH_JS)
+            await page.goto(f"{self.LOGIN_URL}?{self.DESTINATION_URL}", wait_until="domcontentloaded", timeout=self.timeout)
+            await page.wait_for_selector("input#rutcntr", timeout=self.timeout)
+
+            await page.fill('input#rutcntr', rut)
+            await page.fill('input#clave', password)
+            await page.click('button#bt_ingresar')
+
+            try:
+                await page.wait_for_url(lambda url: "consdcvinternetui" in url, timeout=self.timeout)
+            except PlaywrightTimeoutError:
+                content = (await page.content()).lower()
+                for error in ("usuario no existe", "clave incorrecta", "usuario inactivo", "bloqueado"):
+                    if error in content:
+                        logger.error(f"[async] Error del SII: {error}")
+                        return False
+                logger.error(f"[async] No llegamos a página de libros. URL final: {page.url}")
+                return False
+
+            logger.info("[async] ✓ Navegado exitosamente a página de libros")
+            return True
+
+        except PlaywrightTimeoutError as e:
+            logger.error(f"[async] Timeout durante login: {str(e)}")
+            return False
+        except Exception as e:
+            logger.error(f"[async] Error durante login: {str(e)}", exc_info=True)
+            return False
+
+    async def _fetch_on_page(self, page, rut: str, mes: int, ano: int,
+                             book_types: Tuple[str, ...]) -> Optional[Dict[str, Optional[List[Dict[str, Any]]]]]:
+        """Consultar el período y leer cada libro cambiando de tab"""
+        compra_response = await self._query_period(page, rut, mes, ano)
+        if compra_response is False:
+            return None
+
+        results = {}
+        for i, book_type in enumerate(book_types):
+            progress.report(f'libro:{book_type}')
+            try:
+                # Tras Consultar el tab COMPRA ya está activo con su respuesta
+                if i == 0 and book_type == "COMPRAS":
+                    response = compra_response
+                else:
+                    response = await self._click_tab(page, book_type)
+                records = await self._records_from_response(response, book_type, mes, ano)
+                if records is None:
+                    logger.info(f"[async] Sin respuesta JSON utilizable para {book_type}, usando link de descarga")
+                    records = await self._records_from_data_link(page)
+                results[book_type] = records
+            except Exception as e:
+                logger.error(f"[async] Error obteniendo {book_type}: {str(e)}", exc_info=True)
+                results[book_type] = None
+
+            logger.info(f"[async] {book_type} obtenidos: {len(results[book_type]) if results[book_type] else 0} registros")
+
+        return results
+
+    async def _query_period(self, page, rut: str, mes: int, ano: int):
+        """
+        Seleccionar RUT/mes/año y presionar Consultar
+
+        Returns:
+            La respuesta de getResumen (tab COMPRA) que dispara Consultar, None si
+            no llegó a tiempo, o False si la consulta no se pudo hacer
+        """
+        progress.report(f'consulta_periodo:{mes:02d}/{ano}')
+        try:
+            if "consdcvinternetui" not in page.url:
+                await page.goto(self.DESTINATION_URL, wait_until="networkidle", timeout=self.timeout)
+
+            selects = page.locator("select")
+            await selects.first.wait_for(state="attached", timeout=30000)
+            await self._idle(page, lambda t: page.wait_for_function(ANGULAR_IDLE_JS, timeout=t), 5000)
+            await self._idle(page, lambda t: page.wait_for_function(SELECT_OPTIONS_JS, arg=[1], timeout=t), 10000)
+
+            # Persona natural: el select de RUT está habilitado y hay que elegirlo
+            rut_select = selects.first
+            if not await rut_select.get_attribute("disabled"):
+                options = rut_select.locator("option")
+                for i in range(await options.count()):
+                    if rut_in_option(rut, await options.nth(i).inner_text()):
+                        await rut_select.select_option(await options.nth(i).get_attribute("value"))
+                        await self._idle(page, lambda t: page.wait_for_function(ANGULAR_IDLE_JS, timeout=t), 5000)
+                        break
+
+            if await selects.count() < 3:
+                logger.error(f"[async] Se esperaban 3 selects, hay {await selects.count()}")
+                return False
+            await selects.nth(1).select_option(f"{mes:02d}")
+            await self._idle(page, lambda t: page.wait_for_function(ANGULAR_IDLE_JS, timeout=t), 5000)
+            await selects.nth(2).select_option(str(ano))
+            await self._idle(page, lambda t: page.wait_for_function(ANGULAR_IDLE_JS, timeout=t), 5000)
+
+            consultar_btn = page.locator("button").filter(has_text="Consultar").first
+            await consultar_btn.wait_for(state="visible", timeout=5000)
+            # Los links de descarga que ya estén en la página son de otro período
+            await self._mark_data_links_read(page)
+            response = await self._response_after(page, consultar_btn.click, 20000)
+            await self._idle(page, lambda t: page.locator("#esperaDialog").wait_for(state="hidden", timeout=t), 20000)
+            return response
+
+        except Exception as e:
+            logger.error(f"[async] Error consultando período {mes:02d}/{ano}: {str(e)}", exc_info=True)
+            return False
+
+    async def _click_tab(self, page, book_type: str):
+        """Activar el tab del libro y retornar la respuesta de getResumen que dispare (o None)"""
+        tab_label = "VENTA" if book_type == "VENTAS" else "COMPRA"
+        tab = page.locator(f'text="{tab_label}"')
+        if await tab.count() == 0:
+            logger.warning(f"[async] Tab {tab_label} no encontrado")
+            return None
+        # Los links de descarga que ya estén en la página son del libro anterior
+        await self._mark_data_links_read(page)
+        response = await self._response_after(page, tab.first.click, 8000)
+        await self._idle(page, lambda t: page.wait_for_function(ANGULAR_IDLE_JS, timeout=t), 5000)
+        return response
+
+    @staticmethod
+    async def _response_after(page, action: Callable[[], Awaitable[None]], timeout: float):
+        """Ejecutar action() y retornar la respuesta de getResumen, o None si no llega a tiempo"""
+        try:
+            async with page.expect_response(lambda r: GET_RESUMEN in r.url, timeout=timeout) as info:
+                await action()
+            return await info.value
+        except PlaywrightTimeoutError:
+            return None
+
+    @staticmethod
+    async def _idle(page, wait: Callable[[float], Awaitable[Any]], timeout: float) -> bool:
+        """Esperar una señal de la SPA; un timeout no es error"""
+        try:
+            await wait(timeout)
+            return True
+        except PlaywrightTimeoutError:
+            return False
+
+    @staticmethod
+    async def _records_from_response(response, book_type: str, mes: int, ano: int) -> Optional[List[Dict[str, Any]]]:
+        if response is None or not response.ok:
+            return None
+        try:
+            data = (response.request.post_data_json or {}).get('data') or {}
+        except Exception:
+            data = {}
+        # Descartar respuestas de otro libro o período
+        if data.get('operacion') not in (None, OPERACIONES[book_type]):
+            return None
+        if data.get('ptributario') not in (None, f"{ano}{mes:02d}"):
+            return None
+        try:
+            return resumen_body_to_records(await response.json(), book_type)
+        except Exception as e:
+            logger.warning(f"[async] No se pudo leer la respuesta de getResumen: {e}")
+            return None
+
+    async def _records_from_data_link(self, page) -> Optional[List[Dict[str, Any]]]:
+        """
+        Respaldo: CSV desde el data URI del link de descarga
+
+        Igual que en SIIScraper sólo sirven los links que no se leyeron antes en
+        la página; si tras Descargar no aparece uno nuevo retorna None en vez del
+        CSV de otro libro o período.
+        """
+        if not await page.evaluate(MARK_FRESH_DATA_LINKS_JS):
+            descargar = page.locator("button").filter(has_text="Descargar")
+            if await descargar.count() == 0:
+                return None
+            await descargar.first.click()
+            if not await self._idle(page, lambda t: page.wait_for_function(MARK_FRESH_DATA_LINKS_JS, timeout=t), 10000):
+                logger.warning("[async] No apareció un link de descarga nuevo")
+                return None
+
+        href = await page.locator(FRESH_DATA_LINK_SELECTOR).first.get_attribute("href")
+        if not href or not href.startswith("data:"):
+            return None
+        records = BookTable.from_rows(iter_csv_records(href))
+        await self._mark_data_links_read(page)
+        return records
+
+    @staticmethod
+    async def _mark_data_links_read(page):
+        """Marcar los links con data URI actuales como ya leídos"""
+        try:
+            await page.evaluate(MARK_DATA_LINKS_READ_JS)
+        except Exception as e:
+            logger.warning(f"[async] No se pudieron marcar los links leídos: {e}")
+
+
+class _ContextSlot:
+    """async with: lugar en el semáforo + BrowserContext nuevo, cerrado al salir"""
+
+    def __init__(self, scraper: AsyncSIIScraper, storage_state: Optional[Dict[str, Any]]):
+        self.scraper = scraper
+        self.storage_state = storage_state
+        self.context = None
+
+    async def __aenter__(self):
+        await self.scraper._ensure_browser()
+        await self.scraper._slots.acquire()
+        self.scraper._active += 1
+        try:
+            options = {'storage_state': self.storage_state} if self.storage_state else {}
+            self.context = await self.scraper._browser.new_context(**options)
+        except BaseException:
+            self.scraper._active -= 1
+            self.scraper._slots.release()
+            raise
+        return self.context
+
+    async def __aexit__(self, *exc):
+        try:
+            await self.context.close()
+        except Exception as e:
+            logger.warning(f"Error cerrando contexto async: {e}")
+        finally:
+            self.scraper._active -= 1
+            self.scraper._slots.release()
+
+
+class AsyncScraperBridge:
+    """
+    Puente para usar AsyncSIIScraper desde código síncrono (rutas Flask).
+
+    Corre un event loop en un hilo de fondo; cada llamada agenda la corrutina
+    en ese loop y bloquea sólo al hilo que la pidió. El callback de progreso
+    del llamador se traslada a la task.
+    """
+
+    def __init__(self, scraper: AsyncSIIScraper, call_timeout: Optional[float] = None):
+        self.scraper = scraper
+        self.call_timeout = call_timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='sii-async-loop', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls, sessions: Optional[SessionCache] = None, headless: bool = True) -> "AsyncScraperBridge":
+        """Crear el puente desde SII_ASYNC_MAX_SESSIONS"""
+        scraper = AsyncSIIScraper(
+            headless=headless,
+            max_sessions=int(os.getenv('SII_ASYNC_MAX_SESSIONS', 16)),
+            sessions=sessions,
+        )
+        return cls(scraper)
+
+    def test_credentials(self, rut: str, password: str) -> bool:
+        return self._call(self.scraper.test_credentials(rut, password))
+
+    def fetch_books(self, rut: str, password: str, mes: int, ano: int,
+                    book_type: str = "COMPRAS") -> Optional[List[Dict[str, Any]]]:
+        return self._call(self.scraper.fetch_books(rut, password, mes, ano, book_type))
+
+    def fetch_books_multi(self, rut: str, password: str, mes: int, ano: int,
+                          book_types: Tuple[str, ...] = ("COMPRAS", "VENTAS")) -> Optional[Dict[str, Optional[List[Dict[str, Any]]]]]:
+        return self._call(self.scraper.fetch_books_multi(rut, password, mes, ano, book_types))
+
+    def stats(self) -> Dict[str, Any]:
+        return self.scraper.stats()
+
+    def close(self):
+        """Cerrar el scraper y detener el loop"""
+        try:
+            asyncio.run_coroutine_threadsafe(self.scraper.close(), self._loop).result(timeout=30)
+        except Exception as e:
+            logger.warning(f"Error cerrando scraper async: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def _call(self, coro: Awaitable[Any]) -> Any:
+        on_progress = progress.current()
+
+        async def scoped():
+            with progress.progress_scope(on_progress):
+                return await coro
+
+        return asyncio.run_coroutine_threadsafe(scoped(), self._loop).result(timeout=self.call_timeout)
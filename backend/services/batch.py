@@ -0,0 +1,154 @@
+"""
+Batch - Planificador de sincronizaciones de muchas empresas con reparto justo por RUT
+"""
+
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Task = Callable[[], Any]
+
+
+class _Group:
+    """Tareas de una empresa dentro de un batch; se ejecutan de a una"""
+
+    def __init__(self, handle: "BatchHandle", key: Hashable, tasks: List[Task]):
+        self.handle = handle
+        self.key = key
+        self.tasks: Deque[Tuple[int, Task]] = deque(enumerate(tasks))
+        self.results: List[Any] = [None] * len(tasks)
+        self.pending = len(tasks)
+
+
+class BatchHandle:
+    """Resultados de un batch, entregados a medida que cada empresa termina"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self._done: "queue.Queue[Tuple[Hashable, List[Any]]]" = queue.Queue()
+
+    def results(self) -> Iterator[Tuple[Hashable, List[Any]]]:
+        """
+        Iterar (clave, resultados) en orden de término
+
+        Los resultados de cada tarea quedan en el orden en que se pasaron; una
+        tarea que lanzó una excepción deja esa excepción como resultado.
+        """
+        for _ in range(self.total):
+            yield self._done.get()
+
+
+class BatchScheduler:
+    """
+    Workers persistentes compartidos por todos los batches.
+
+    Las empresas pendientes forman una cola round-robin: cada worker toma la
+    próxima tarea de la empresa al frente y, si le quedan tareas, la empresa
+    vuelve al final recién cuando esa tarea termina. Así ninguna empresa ocupa
+    más de un worker a la vez (un login por RUT en curso) y una con muchos
+    períodos no deja esperando a las demás.
+    """
+
+    def __init__(self, workers: int = 2):
+        """
+        Inicializar el planificador
+
+        Args:
+            workers: Tareas ejecutándose a la vez (normalmente, lo que admite el pool de navegadores)
+        """
+        if workers < 1:
+            raise ValueError("El planificador necesita al menos un worker")
+
+        self.workers = workers
+        self._ready: Deque[_Group] = deque()
+        self._running = 0
+        self._completed = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._work, name=f'sync-batch-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @classmethod
+    def from_env(cls, default_workers: int = 2) -> "BatchScheduler":
+        """Crear el planificador desde SII_BATCH_WORKERS (default: lo que admite el pool)"""
+        return cls(workers=int(os.getenv('SII_BATCH_WORKERS', default_workers)))
+
+    def submit(self, groups: List[Tuple[Hashable, List[Task]]]) -> BatchHandle:
+        """
+        Encolar un batch
+
+        Args:
+            groups: Lista de (clave de la empresa, tareas de esa empresa)
+
+        Returns:
+            BatchHandle para ir leyendo los resultados por empresa
+        """
+        handle = BatchHandle(len(groups))
+        with self._cond:
+            for key, tasks in groups:
+                group = _Group(handle, key, tasks)
+                if group.pending == 0:
+                    handle._done.put((key, []))
+                else:
+                    self._ready.append(group)
+            self._cond.notify_all()
+        logger.info(f"Batch encolado: {len(groups)} empresas")
+        return handle
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued_companies': len(self._ready),
+                'queued_tasks': sum(len(g.tasks) for g in self._ready),
+                'completed_tasks': self._completed,
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _next(self) -> Optional[Tuple[_Group, int, Task]]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._ready or self._stopped)
+            if self._stopped:
+                return None
+            group = self._ready.popleft()
+            index, task = group.tasks.popleft()
+            self._running += 1
+            return group, index, task
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            group, index, task = item
+
+            try:
+                result = task()
+            except Exception as e:
+                logger.error(f"Tarea de batch para {group.key} falló: {str(e)}", exc_info=True)
+                result = e
+
+            with self._cond:
+                self._running -= 1
+                self._completed += 1
+                group.results[index] = result
+                group.pending -= 1
+                if group.tasks:
+                    self._ready.append(group)
+                    self._cond.notify()
+            if group.pending == 0:
+                group.handle._done.put((group.key, group.results))
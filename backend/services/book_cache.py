@@ -0,0 +1,234 @@
+"""
+Book Cache - Cache de libros descargados por (rut, mes, año, tipo)
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from .book_table import BookTable, json_default
+
+logger = logging.getLogger(__name__)
+
+BookKey = Tuple[str, int, int, str]
+
+# Iteraciones de PBKDF2 para el digest de la contraseña guardado con cada entrada
+_DIGEST_ITERATIONS = 20000
+
+
+class BookCache:
+    """
+    Cache de registros de libros con tier en memoria (LRU con presupuesto en
+    bytes) y tier opcional en disco.
+
+    Los períodos abiertos (el mes actual y el anterior mientras se puede
+    declarar) expiran rápido; los cerrados no cambian y duran mucho o para
+    siempre. Cada entrada guarda un digest con sal de la contraseña que la
+    obtuvo: sólo se sirve a requests con esa misma contraseña, así conocer un
+    RUT no basta para leer sus libros.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 open_ttl_seconds: float = 600, closed_ttl_seconds: float = 0, open_grace_day: int = 20):
+        """
+        Inicializar el cache
+
+        Args:
+            max_bytes: Presupuesto del tier en memoria (tamaño JSON de los registros)
+            disk_dir: Directorio del tier en disco (None = sin disco)
+            open_ttl_seconds: TTL de períodos abiertos (0 = no cachearlos)
+            closed_ttl_seconds: TTL de períodos cerrados (0 = sin expiración)
+            open_grace_day: Hasta este día del mes el período anterior sigue abierto
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.open_ttl_seconds = open_ttl_seconds
+        self.closed_ttl_seconds = closed_ttl_seconds
+        self.open_grace_day = open_grace_day
+
+        self._entries: "OrderedDict[BookKey, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+        if disk_dir:
+            os.makedirs(disk_dir, mode=0o700, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["BookCache"]:
+        """
+        Crear el cache desde SII_BOOK_CACHE_MB (0 deshabilita), SII_BOOK_CACHE_DIR,
+        SII_BOOK_CACHE_OPEN_TTL_MINUTES y SII_BOOK_CACHE_CLOSED_TTL_HOURS
+        """
+        max_mb = float(os.getenv('SII_BOOK_CACHE_MB', 64))
+        if max_mb <= 0:
+            return None
+        return cls(
+            max_bytes=int(max_mb * 1024 * 1024),
+            disk_dir=os.getenv('SII_BOOK_CACHE_DIR') or None,
+            open_ttl_seconds=float(os.getenv('SII_BOOK_CACHE_OPEN_TTL_MINUTES', 10)) * 60,
+            closed_ttl_seconds=float(os.getenv('SII_BOOK_CACHE_CLOSED_TTL_HOURS', 0)) * 3600,
+        )
+
+    def is_open_period(self, mes: int, ano: int, today: Optional[date] = None) -> bool:
+        """El período todavía puede cambiar (mes en curso/futuro o anterior dentro del plazo)"""
+        today = today or date.today()
+        current = today.year * 12 + today.month
+        period = ano * 12 + mes
+        if period >= current:
+            return True
+        return period == current - 1 and today.day <= self.open_grace_day
+
+    def ttl_for(self, mes: int, ano: int) -> Optional[float]:
+        """Segundos de vida para el período; None = sin expiración, 0 = no cachear"""
+        if self.is_open_period(mes, ano):
+            return self.open_ttl_seconds
+        return self.closed_ttl_seconds or None
+
+    def get(self, rut: str, password: str, mes: int, ano: int, book_type: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Registros cacheados del libro
+
+        Returns:
+            Los registros, o None si no hay entrada vigente para esa contraseña
+        """
+        key = (rut, mes, ano, book_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            entry = self._load_from_disk(key)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, entry)
+
+        if entry is None or not self._password_matches(entry, password):
+            with self._lock:
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._hits += 1
+        logger.info(f"Cache hit: {book_type} {mes:02d}/{ano} RUT {rut}")
+        return entry['records']
+
+    def put(self, rut: str, password: str, mes: int, ano: int, book_type: str, records: List[Dict[str, Any]]):
+        """Guardar los registros recién descargados"""
+        ttl = self.ttl_for(mes, ano)
+        if ttl == 0:
+            return
+
+        key = (rut, mes, ano, book_type)
+        salt = secrets.token_bytes(16)
+        entry = {
+            'records': records,
+            'salt': salt.hex(),
+            'digest': self._digest(password, salt).hex(),
+            'expires_at': time.time() + ttl if ttl else None,
+            'size': self._size_of(records),
+        }
+
+        with self._lock:
+            self._store(key, entry)
+        self._save_to_disk(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'disk': bool(self.disk_dir),
+            }
+
+    def _store(self, key: BookKey, entry: Dict[str, Any]):
+        if entry['size'] > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry['size']
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def _remove(self, key: BookKey):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry['size']
+
+    @staticmethod
+    def _size_of(records) -> int:
+        """Bytes que ocupan los registros (BookTable informa su tamaño columnar)"""
+        if isinstance(records, BookTable):
+            return records.nbytes()
+        return len(json.dumps(records, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def _expired(entry: Dict[str, Any]) -> bool:
+        return entry['expires_at'] is not None and time.time() >= entry['expires_at']
+
+    @staticmethod
+    def _digest(password: str, salt: bytes) -> bytes:
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, _DIGEST_ITERATIONS)
+
+    def _password_matches(self, entry: Dict[str, Any], password: str) -> bool:
+        expected = bytes.fromhex(entry['digest'])
+        return hmac.compare_digest(expected, self._digest(password, bytes.fromhex(entry['salt'])))
+
+    def _disk_path(self, key: BookKey) -> str:
+        name = hashlib.sha256('|'.join(str(part) for part in key).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{name}.json")
+
+    def _load_from_disk(self, key: BookKey) -> Optional[Dict[str, Any]]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Entrada de cache en disco ilegible ({path}): {e}")
+            return None
+
+        if self._expired(entry):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _save_to_disk(self, key: BookKey, entry: Dict[str, Any]):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, default=json_default)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la entrada de cache en disco: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,236 @@
+"""
+Book Schema - Normalización de registros del SII guiada por un esquema de columnas
+"""
+
+import logging
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .book_table import BookTable
+
+logger = logging.getLogger(__name__)
+
+# Campo normalizado -> (tipo, encabezados aceptados). Incluye los del CSV de
+# descarga (resumen y detalle) y los nombres camelCase que usaba el parser.
+COMMON_FIELDS: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ('tipo_documento', 'str', ('Tipo Documento', 'Tipo Doc', 'tipoDocumento')),
+    ('total_documentos', 'number', ('Total Documentos',)),
+    ('numero_documento', 'str', ('Folio', 'Numero Documento', 'numeroDocumento')),
+    ('fecha_documento', 'str', ('Fecha Docto', 'Fecha Documento', 'fechaDocumento')),
+    ('monto_exento', 'number', ('Monto Exento',)),
+    ('monto_neto', 'number', ('Monto Neto', 'montoNeto')),
+    ('monto_total', 'number', ('Monto Total', 'montoTotal')),
+    ('estado', 'str', ('Estado', 'estado')),
+]
+
+BOOK_FIELDS: Dict[str, List[Tuple[str, str, Tuple[str, ...]]]] = {
+    'COMPRAS': COMMON_FIELDS + [
+        ('rut_proveedor', 'str', ('RUT Proveedor', 'rutProveedor')),
+        ('razon_social', 'str', ('Razon Social', 'nombreProveedor')),
+        ('impuesto_iva', 'number', ('IVA Recuperable', 'Monto IVA Recuperable', 'impuestoIva')),
+        ('iva_uso_comun', 'number', ('IVA Uso Comun', 'Monto Iva Uso Comun')),
+        ('iva_no_recuperable', 'number', ('IVA No Recuperable', 'Monto Iva No Recuperable')),
+    ],
+    'VENTAS': COMMON_FIELDS + [
+        ('rut_cliente', 'str', ('Rut cliente', 'rutCliente')),
+        ('razon_social', 'str', ('Razon Social', 'nombreCliente')),
+        ('impuesto_iva', 'number', ('Monto IVA', 'impuestoIva')),
+    ],
+}
+
+# Montos con separador de miles chileno, ej: "1.234.567"
+_THOUSANDS = re.compile(r'-?\d{1,3}(?:\.\d{3})+')
+
+# Código del tipo de documento, ej: "Nota de Crédito Electrónica(61)" o "61"
+_DOC_CODE = re.compile(r'(\d+)\)?\s*$')
+
+
+def document_code(tipo_documento: Any) -> Optional[str]:
+    """Código SII del tipo de documento ("61"), o None si el texto no lo trae"""
+    match = _DOC_CODE.search(str(tipo_documento))
+    return match.group(1) if match else None
+
+
+def _header_key(header: Any) -> str:
+    """Encabezado comparable: sin tildes, mayúsculas, espacios ni puntuación"""
+    text = unicodedata.normalize('NFKD', str(header))
+    return ''.join(c for c in text if c.isalnum()).lower()
+
+
+class CompiledSchema:
+    """Mapeo ya resuelto de un conjunto de encabezados a los campos normalizados"""
+
+    def __init__(self, book_type: str, headers: Tuple[Any, ...]):
+        by_key = {}
+        for header in headers:
+            by_key.setdefault(_header_key(header), header)
+
+        self.book_type = book_type
+        self.headers = headers
+        # (campo, tipo, encabezado de origen o None si el CSV no lo trae)
+        self.fields: List[Tuple[str, str, Optional[Any]]] = []
+        for name, kind, aliases in BOOK_FIELDS[book_type]:
+            source = next((by_key[_header_key(a)] for a in aliases if _header_key(a) in by_key), None)
+            self.fields.append((name, kind, source))
+
+        mapped = {source for _, _, source in self.fields if source is not None}
+        self.unmapped = [header for header in headers if header not in mapped]
+
+    def source(self, name: str) -> Optional[Any]:
+        """Encabezado de origen de un campo normalizado (None si estos encabezados no lo traen)"""
+        return next((source for field, _, source in self.fields if field == name), None)
+
+    def numbers(self, rows: Sequence[Mapping], name: str,
+                errors: Optional[List[Dict[str, Any]]] = None) -> Sequence[Any]:
+        """
+        Columna numérica de un campo: 0 si los encabezados no lo traen, None en
+        las celdas que no se pudieron interpretar (reportadas en errors)
+
+        Con un BookTable cuya columna es completamente entera se entrega su
+        array('q') sin copiarlo.
+        """
+        source = self.source(name)
+        if source is None:
+            return [0] * len(rows)
+        if isinstance(rows, BookTable):
+            values = rows.int_array(source)
+            if values is not None:
+                return values
+        return self._numbers(rows, name, source, 0, [] if errors is None else errors)
+
+    def normalize(self, rows: Sequence[Mapping], offset: int = 0) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Normalizar filas que comparten estos encabezados, columna por columna
+
+        Args:
+            rows: Filas crudas (dicts, o un BookTable con estas columnas)
+            offset: Posición de la primera fila dentro del libro (para reportar errores)
+
+        Returns:
+            (items normalizados, errores por celda)
+        """
+        names = []
+        columns = []
+        errors: List[Dict[str, Any]] = []
+        for name, kind, source in self.fields:
+            names.append(name)
+            if source is None:
+                columns.append([0 if kind == 'number' else ''] * len(rows))
+            elif kind == 'number':
+                columns.append(self._numbers(rows, name, source, offset, errors))
+            else:
+                columns.append(self._strings(rows, source))
+        items = [dict(zip(names, values)) for values in zip(*columns)]
+        return items, errors
+
+    @staticmethod
+    def _strings(rows: Sequence[Mapping], source: Any) -> List[Any]:
+        values = [row[source] for row in rows]
+        return ['' if value is None else value for value in values]
+
+    @staticmethod
+    def _numbers(rows: Sequence[Mapping], name: str, source: Any, offset: int,
+                 errors: List[Dict[str, Any]]) -> List[Any]:
+        if isinstance(rows, BookTable):
+            # Columna ya entera en el BookTable: sin parsear; sólo se revisan las celdas no enteras
+            numbers = rows.column(source)
+            if None not in numbers:
+                return numbers
+            raw = [rows[i][source] if n is None else None for i, n in enumerate(numbers)]
+        else:
+            raw = [row[source] for row in rows]
+            if all(type(value) is str for value in raw):
+                try:
+                    # Caso normal del CSV del SII: todos los montos son strings enteros
+                    return list(map(int, raw))
+                except ValueError:
+                    pass
+            numbers = [None] * len(raw)
+
+        for i, value in enumerate(raw):
+            if numbers[i] is not None:
+                continue
+            number = _parse_number(value)
+            if number is None:
+                errors.append({'fila': offset + i + 1, 'campo': name, 'columna': source,
+                               'valor': value, 'error': 'no es un número'})
+            numbers[i] = number
+        return numbers
+
+
+def _parse_number(value: Any) -> Optional[Any]:
+    """Monto de una celda: vacío es 0; None si no se puede interpretar"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value).strip()
+    if not text:
+        return 0
+    if _THOUSANDS.fullmatch(text):
+        return int(text.replace('.', ''))
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else number
+
+
+@lru_cache(maxsize=64)
+def compile_schema(book_type: str, headers: Tuple[Any, ...]) -> CompiledSchema:
+    """Esquema compilado para estos encabezados (se compila una vez por conjunto de encabezados)"""
+    schema = CompiledSchema(book_type, headers)
+    if schema.unmapped:
+        logger.debug(f"{book_type}: columnas sin campo normalizado: {schema.unmapped}")
+    return schema
+
+
+def normalize_records(records: Sequence[Mapping], book_type: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Normalizar los registros de un libro a los campos de BOOK_FIELDS
+
+    Las filas consecutivas con los mismos encabezados se procesan juntas con
+    un esquema compilado una sola vez; los montos se convierten por columna.
+    Una celda que no se puede interpretar queda en None y se reporta, sin
+    descartar el resto del libro.
+
+    Args:
+        records: Registros crudos (lista de dicts o BookTable)
+        book_type: "COMPRAS" o "VENTAS"
+
+    Returns:
+        (items normalizados, errores [{'fila', 'campo', 'columna', 'valor', 'error'}])
+    """
+    if book_type not in BOOK_FIELDS:
+        raise ValueError(f"Tipo de libro desconocido: {book_type}")
+
+    if isinstance(records, BookTable) and not records.ragged:
+        return compile_schema(book_type, tuple(records.columns)).normalize(records)
+
+    items: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    start = 0
+    headers = None
+    rows = list(records)
+    for i, row in enumerate(rows):
+        row_headers = tuple(row)
+        if row_headers != headers:
+            if i > start:
+                _extend(items, errors, compile_schema(book_type, headers), rows[start:i], start)
+            headers, start = row_headers, i
+    if rows:
+        _extend(items, errors, compile_schema(book_type, headers), rows[start:], start)
+    return items, errors
+
+
+def _extend(items: List[Dict[str, Any]], errors: List[Dict[str, Any]], schema: CompiledSchema,
+            rows: Sequence[Mapping], offset: int):
+    run_items, run_errors = schema.normalize(rows, offset)
+    items.extend(run_items)
+    errors.extend(run_errors)
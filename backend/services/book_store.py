@@ -0,0 +1,364 @@
+"""
+Book Store - Persistencia local de libros en SQLite con re-sincronización incremental
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from .book_schema import document_code, normalize_records
+from .book_table import json_default, row_hashes
+
+logger = logging.getLogger(__name__)
+
+# Iteraciones de PBKDF2 para el digest de la contraseña (igual que BookCache)
+_DIGEST_ITERATIONS = 20000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    rut        TEXT NOT NULL,
+    periodo    TEXT NOT NULL,
+    tipo       TEXT NOT NULL,
+    doc_key    TEXT NOT NULL,
+    folio      TEXT NOT NULL,
+    position   INTEGER NOT NULL,
+    hash       TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    created_version INTEGER NOT NULL DEFAULT 0,
+    version    INTEGER NOT NULL DEFAULT 0,
+    deleted    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (rut, periodo, tipo, doc_key)
+);
+CREATE INDEX IF NOT EXISTS idx_documents_folio ON documents (folio);
+CREATE INDEX IF NOT EXISTS idx_documents_book ON documents (rut, periodo, tipo, deleted, position);
+CREATE INDEX IF NOT EXISTS idx_documents_version ON documents (rut, periodo, tipo, version);
+
+CREATE TABLE IF NOT EXISTS syncs (
+    rut        TEXT NOT NULL,
+    periodo    TEXT NOT NULL,
+    tipo       TEXT NOT NULL,
+    synced_at  TEXT NOT NULL,
+    cantidad   INTEGER NOT NULL,
+    version    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (rut, periodo, tipo)
+);
+
+CREATE TABLE IF NOT EXISTS credentials (
+    rut    TEXT PRIMARY KEY,
+    salt   TEXT NOT NULL,
+    digest TEXT NOT NULL
+);
+"""
+
+
+def _periodo(mes: int, ano: int) -> str:
+    return f"{ano:04d}-{mes:02d}"
+
+
+def make_token(rut: str, periodo: str, book_type: str, version: int) -> str:
+    """Token de sincronización: identifica el libro y la versión que el cliente ya tiene"""
+    raw = f"{rut}|{periodo}|{book_type}|{version}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def parse_token(token: str) -> Tuple[str, str, str, int]:
+    """(rut, periodo, tipo, versión) de un token; ValueError si no es válido"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        rut, periodo, book_type, version = raw.split('|')
+        return rut, periodo, book_type, int(version)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Token de sincronización inválido')
+
+
+def document_keys(records: Iterable[Mapping], book_type: str) -> List[Tuple[str, str]]:
+    """
+    Identidad de cada registro dentro de su libro: (doc_key, folio)
+
+    En el detalle un documento es tipo + RUT de la contraparte + folio; en el
+    resumen (sin folio) cada fila es un tipo de documento. Si una clave se
+    repite dentro del libro se numera según su orden de aparición.
+    """
+    items, _ = normalize_records(records, book_type)
+    rut_field = 'rut_proveedor' if book_type == 'COMPRAS' else 'rut_cliente'
+    keys = []
+    seen: Dict[str, int] = {}
+    for item in items:
+        tipo = str(item.get('tipo_documento', ''))
+        folio = str(item.get('numero_documento', ''))
+        key = '|'.join((document_code(tipo) or tipo, str(item.get(rut_field, '')), folio))
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        keys.append((f"{key}#{count}" if count else key, folio))
+    return keys
+
+
+class BookStore:
+    """
+    Libros sincronizados guardados en SQLite (modo WAL).
+
+    Cada sincronización reemplaza el libro (rut, período, tipo) comparando por
+    documento: sólo se escriben las filas nuevas o cuyo hash cambió y se borran
+    las que ya no vienen. Las lecturas de /api/books salen de acá sin ir al SII.
+    Como en BookCache, se guarda un digest con sal de la contraseña de la
+    última sincronización de cada RUT y sólo se sirve a quien la conozca.
+    """
+
+    def __init__(self, path: str):
+        """
+        Inicializar el store
+
+        Args:
+            path: Archivo SQLite (se crea si no existe)
+        """
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        logger.info(f"Store de libros en {path}")
+
+    @classmethod
+    def from_env(cls) -> Optional["BookStore"]:
+        """Crear el store desde SII_BOOK_STORE_PATH (vacío = deshabilitado)"""
+        path = os.getenv('SII_BOOK_STORE_PATH')
+        if not path:
+            return None
+        return cls(path)
+
+    def save(self, rut: str, password: str, mes: int, ano: int, book_type: str,
+             records: List[Mapping]) -> Dict[str, Any]:
+        """
+        Guardar un libro recién descargado, escribiendo sólo lo que cambió
+
+        Cada sincronización con cambios sube la versión del libro; los documentos
+        escritos quedan con esa versión y los eliminados quedan como tombstone,
+        así changes_since() puede responder qué cambió desde cualquier token.
+
+        Returns:
+            {'insertados': [...], 'actualizados': [...], 'eliminados': [...], 'sin_cambios': n,
+             'token': ...} con los doc_key de cada documento
+        """
+        periodo = _periodo(mes, ano)
+        now = datetime.now().isoformat()
+        keys = document_keys(records, book_type)
+        rows = [
+            (doc_key, folio, position, digest, record)
+            for position, (record, (doc_key, folio), digest) in enumerate(zip(records, keys, row_hashes(records)))
+        ]
+
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            current = {
+                doc_key: (digest, position)
+                for doc_key, digest, position in conn.execute(
+                    'SELECT doc_key, hash, position FROM documents '
+                    'WHERE rut = ? AND periodo = ? AND tipo = ? AND deleted = 0',
+                    (rut, periodo, book_type)
+                )
+            }
+            previous_version = self._version(conn, rut, periodo, book_type)
+
+            inserted, updated, unchanged, writes, moves = [], [], 0, [], []
+            for doc_key, folio, position, digest, record in rows:
+                previous, previous_position = current.pop(doc_key, (None, None))
+                if previous == digest:
+                    unchanged += 1
+                    if previous_position != position:
+                        moves.append((position, rut, periodo, book_type, doc_key))
+                    continue
+                (inserted if previous is None else updated).append(doc_key)
+                writes.append((doc_key, folio, position, digest,
+                               json.dumps(dict(record), ensure_ascii=False, default=json_default)))
+            removed = list(current)
+            version = previous_version + 1 if (writes or removed) else previous_version
+
+            conn.executemany(
+                'INSERT INTO documents (rut, periodo, tipo, doc_key, folio, position, hash, data, updated_at, '
+                'created_version, version, deleted) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0) '
+                'ON CONFLICT (rut, periodo, tipo, doc_key) DO UPDATE SET '
+                'folio = excluded.folio, position = excluded.position, hash = excluded.hash, '
+                'data = excluded.data, updated_at = excluded.updated_at, version = excluded.version, '
+                'created_version = CASE WHEN deleted = 1 THEN excluded.created_version ELSE created_version END, '
+                'deleted = 0',
+                [(rut, periodo, book_type, doc_key, folio, position, digest, data, now, version, version)
+                 for doc_key, folio, position, digest, data in writes]
+            )
+            conn.executemany(
+                'UPDATE documents SET position = ? WHERE rut = ? AND periodo = ? AND tipo = ? AND doc_key = ?',
+                moves
+            )
+            conn.executemany(
+                'UPDATE documents SET deleted = 1, version = ?, updated_at = ? '
+                'WHERE rut = ? AND periodo = ? AND tipo = ? AND doc_key = ?',
+                [(version, now, rut, periodo, book_type, doc_key) for doc_key in removed]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO syncs (rut, periodo, tipo, synced_at, cantidad, version) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (rut, periodo, book_type, now, len(rows), version)
+            )
+            self._save_credentials(conn, rut, password)
+
+        logger.info(f"Store {book_type} {periodo} RUT {rut}: {len(inserted)} nuevos, "
+                    f"{len(updated)} actualizados, {len(removed)} eliminados, {unchanged} sin cambios")
+        return {
+            'insertados': inserted,
+            'actualizados': updated,
+            'eliminados': removed,
+            'sin_cambios': unchanged,
+            'token': make_token(rut, periodo, book_type, version),
+        }
+
+    def token(self, rut: str, mes: int, ano: int, book_type: str) -> Optional[str]:
+        """Token de la versión guardada del libro (None si nunca se sincronizó)"""
+        periodo = _periodo(mes, ano)
+        row = self._connection().execute(
+            'SELECT version FROM syncs WHERE rut = ? AND periodo = ? AND tipo = ?', (rut, periodo, book_type)
+        ).fetchone()
+        return make_token(rut, periodo, book_type, row[0]) if row else None
+
+    def changes_since(self, rut: str, mes: int, ano: int, book_type: str, since: str) -> Dict[str, Any]:
+        """
+        Documentos agregados, modificados y eliminados desde el token since
+
+        since "0" pide el libro completo como agregados. Un token de otro libro
+        o de una versión que el store no conoce lanza ValueError (el cliente
+        debe volver a pedir el libro completo).
+
+        Returns:
+            {'agregados': [{'doc_key', 'registro'}], 'modificados': [...], 'eliminados': [doc_key],
+             'token': token de la versión actual}
+        """
+        periodo = _periodo(mes, ano)
+        if since == '0':
+            since_version = 0
+        else:
+            token_rut, token_periodo, token_type, since_version = parse_token(since)
+            if (token_rut, token_periodo, token_type) != (rut, periodo, book_type):
+                raise ValueError('El token de sincronización corresponde a otro libro')
+
+        conn = self._connection()
+        version = self._version(conn, rut, periodo, book_type)
+        if since_version > version:
+            raise ValueError('Token de sincronización más nuevo que el libro guardado')
+
+        added, modified, removed = [], [], []
+        cursor = conn.execute(
+            'SELECT doc_key, data, created_version, deleted FROM documents '
+            'WHERE rut = ? AND periodo = ? AND tipo = ? AND version > ? ORDER BY position',
+            (rut, periodo, book_type, since_version)
+        )
+        for doc_key, data, created_version, deleted in cursor:
+            if deleted:
+                # Creado y borrado después del token: el cliente nunca lo vio
+                if created_version <= since_version:
+                    removed.append(doc_key)
+            elif created_version > since_version:
+                added.append({'doc_key': doc_key, 'registro': json.loads(data)})
+            else:
+                modified.append({'doc_key': doc_key, 'registro': json.loads(data)})
+
+        return {
+            'agregados': added,
+            'modificados': modified,
+            'eliminados': removed,
+            'token': make_token(rut, periodo, book_type, version),
+        }
+
+    def authorized(self, rut: str, password: str) -> bool:
+        """La contraseña coincide con la de la última sincronización guardada de ese RUT"""
+        row = self._connection().execute('SELECT salt, digest FROM credentials WHERE rut = ?', (rut,)).fetchone()
+        if row is None:
+            return False
+        salt, digest = row
+        return hmac.compare_digest(bytes.fromhex(digest), self._digest(password, bytes.fromhex(salt)))
+
+    def books(self, rut: str, mes: Optional[int] = None, ano: Optional[int] = None,
+              book_type: Optional[str] = None, folio: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Libros guardados de un RUT, filtrando por período, tipo y/o folio
+
+        Returns:
+            [{'periodo', 'tipo', 'synced_at', 'registros', 'cantidad'}] ordenado por período y tipo
+        """
+        where = ['d.rut = ?', 'd.deleted = 0']
+        params: List[Any] = [rut]
+        if mes is not None and ano is not None:
+            where.append('d.periodo = ?')
+            params.append(_periodo(mes, ano))
+        elif ano is not None:
+            where.append('d.periodo LIKE ?')
+            params.append(f"{ano:04d}-%")
+        if book_type:
+            where.append('d.tipo = ?')
+            params.append(book_type)
+        if folio:
+            where.append('d.folio = ?')
+            params.append(str(folio))
+
+        cursor = self._connection().execute(
+            'SELECT d.periodo, d.tipo, s.synced_at, d.data FROM documents d '
+            'JOIN syncs s ON s.rut = d.rut AND s.periodo = d.periodo AND s.tipo = d.tipo '
+            f"WHERE {' AND '.join(where)} ORDER BY d.periodo, d.tipo, d.position",
+            params
+        )
+        books: List[Dict[str, Any]] = []
+        for periodo, tipo, synced_at, data in cursor:
+            if not books or (books[-1]['periodo'], books[-1]['tipo']) != (periodo, tipo):
+                books.append({'periodo': periodo, 'tipo': tipo, 'synced_at': synced_at, 'registros': []})
+            books[-1]['registros'].append(json.loads(data))
+        for book in books:
+            book['cantidad'] = len(book['registros'])
+        return books
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connection()
+        return {
+            'path': self.path,
+            'books': conn.execute('SELECT COUNT(*) FROM syncs').fetchone()[0],
+            'documents': conn.execute('SELECT COUNT(*) FROM documents WHERE deleted = 0').fetchone()[0],
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        """Una conexión por hilo (sqlite3 no comparte conexiones entre hilos)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _version(conn: sqlite3.Connection, rut: str, periodo: str, book_type: str) -> int:
+        row = conn.execute(
+            'SELECT version FROM syncs WHERE rut = ? AND periodo = ? AND tipo = ?', (rut, periodo, book_type)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _save_credentials(self, conn: sqlite3.Connection, rut: str, password: str):
+        salt = secrets.token_bytes(16)
+        conn.execute(
+            'INSERT OR REPLACE INTO credentials (rut, salt, digest) VALUES (?, ?, ?)',
+            (rut, salt.hex(), self._digest(password, salt).hex())
+        )
+
+    @staticmethod
+    def _digest(password: str, salt: bytes) -> bytes:
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, _DIGEST_ITERATIONS)
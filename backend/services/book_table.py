@@ -0,0 +1,324 @@
+"""
+Book Table - Representación columnar y compacta de los registros de un libro
+"""
+
+import hashlib
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Clave ausente en una fila (filas con columnas distintas entre sí)
+MISSING = object()
+
+# Una columna entera pasa a ser de strings si más de 1 de cada N valores no son enteros
+_MAX_EXCEPTION_RATIO = 8
+
+# Bytes del hash de contenido de cada fila
+ROW_HASH_SIZE = 16
+
+
+def row_digest(row: Mapping) -> bytes:
+    """Hash del contenido de una fila, independiente del orden de sus columnas"""
+    h = hashlib.blake2b(digest_size=ROW_HASH_SIZE)
+    for name, value in sorted(row.items(), key=lambda item: str(item[0])):
+        h.update(f"{name}\x1f{value}\x1e".encode('utf-8'))
+    return h.digest()
+
+
+def _as_int(value: Any) -> Optional[int]:
+    """Entero equivalente a value si str(entero) lo reproduce exacto ('007' o '1.5' no)"""
+    if type(value) is str and value and len(value) < 19:
+        try:
+            number = int(value)
+        except ValueError:
+            return None
+        if str(number) == value:
+            return number
+    return None
+
+
+class _IntColumn:
+    """Enteros en array('q'); los pocos valores que no lo son quedan en un dict disperso"""
+
+    kind = 'int'
+
+    def __init__(self):
+        self.values = array('q')
+        self.exceptions: Dict[int, Any] = {}
+
+    def append(self, value: Any) -> bool:
+        """Agregar value; False (sin agregarlo) si la columna ya no conviene como entera"""
+        number = _as_int(value)
+        if number is None:
+            size = len(self.values) + 1
+            if size >= 16 and (len(self.exceptions) + 1) * _MAX_EXCEPTION_RATIO > size:
+                return False
+            self.exceptions[len(self.values)] = value
+            self.values.append(0)
+            return True
+        self.values.append(number)
+        return True
+
+    def get(self, index: int) -> Any:
+        if index in self.exceptions:
+            return self.exceptions[index]
+        return str(self.values[index])
+
+    def number(self, index: int) -> Optional[int]:
+        """Valor numérico (None si la celda no es un entero)"""
+        return None if index in self.exceptions else self.values[index]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def nbytes(self) -> int:
+        return self.values.itemsize * len(self.values) + sys.getsizeof(self.exceptions)
+
+
+class _DictColumn:
+    """Strings codificados por diccionario: cada valor distinto se guarda una vez"""
+
+    kind = 'str'
+
+    def __init__(self):
+        self.dictionary: List[Any] = []
+        self.index: Dict[Any, int] = {}
+        self.codes = array('I')
+
+    def append(self, value: Any) -> bool:
+        try:
+            code = self.index.get(value)
+        except TypeError:
+            return False
+        if code is None:
+            code = self.index[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        self.codes.append(code)
+        return True
+
+    def get(self, index: int) -> Any:
+        return self.dictionary[self.codes[index]]
+
+    def number(self, index: int) -> Optional[int]:
+        return _as_int(self.get(index))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def nbytes(self) -> int:
+        return (self.codes.itemsize * len(self.codes)
+                + sum(sys.getsizeof(value) for value in self.dictionary)
+                + sys.getsizeof(self.index))
+
+
+class _ObjectColumn:
+    """Último recurso para valores no hashables (ej: campos extra de csv.DictReader)"""
+
+    kind = 'object'
+
+    def __init__(self, values: Optional[List[Any]] = None):
+        self.values = values or []
+
+    def append(self, value: Any) -> bool:
+        self.values.append(value)
+        return True
+
+    def get(self, index: int) -> Any:
+        return self.values[index]
+
+    def number(self, index: int) -> Optional[int]:
+        return _as_int(self.values[index])
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.values)
+
+
+class Row(Mapping):
+    """Vista de una fila de un BookTable; se lee como el dict del registro original"""
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table: "BookTable", index: int):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key: Any) -> Any:
+        column = self._table._columns[key]
+        value = column.get(self._index)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[Any]:
+        if not self._table._ragged:
+            return iter(self._table._columns)
+        return (name for name, column in self._table._columns.items() if column.get(self._index) is not MISSING)
+
+    def __len__(self) -> int:
+        if not self._table._ragged:
+            return len(self._table._columns)
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"Row({dict(self)!r})"
+
+
+class BookTable(Sequence):
+    """
+    Registros de un libro guardados por columnas.
+
+    Los montos y contadores van en array('q') (8 bytes por celda en vez de un
+    str de Python por fila) y el resto se codifica por diccionario, así los
+    nombres de columna y los valores repetidos (tipo de documento, estado)
+    existen una sola vez. table[i] entrega una vista Row que se comporta como
+    el dict original; to_records() reconstruye exactamente la lista de dicts
+    y sólo se usa al serializar la respuesta.
+
+    Al agregar cada fila se calcula su hash de contenido (row_hash), que usan
+    el store y las respuestas delta para detectar documentos modificados sin
+    volver a recorrer los registros.
+    """
+
+    def __init__(self):
+        self._columns: Dict[Any, Any] = {}
+        self._length = 0
+        self._ragged = False
+        self._hashes = bytearray()
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Mapping]) -> "BookTable":
+        """Construir la tabla consumiendo las filas de a una (sirve con un generador)"""
+        table = cls()
+        for row in rows:
+            table.append(row)
+        return table
+
+    def append(self, row: Mapping):
+        self._hashes += row_digest(row)
+        if self._length and len(row) != len(self._columns):
+            self._ragged = True
+        for name, value in row.items():
+            column = self._columns.get(name)
+            if column is None:
+                column = self._new_column(name)
+            if not column.append(value):
+                self._columns[name] = self._widen(column, value)
+        self._length += 1
+        # Columnas que esta fila no trae
+        for name, column in self._columns.items():
+            if len(column) < self._length:
+                self._ragged = True
+                if not column.append(MISSING):
+                    self._columns[name] = self._widen(column, MISSING)
+
+    def column(self, name: Any) -> List[Optional[int]]:
+        """Valores numéricos de una columna (None donde la celda no es un entero)"""
+        column = self._columns[name]
+        if column.kind == 'int' and not column.exceptions:
+            return column.values.tolist()
+        return [column.number(i) for i in range(self._length)]
+
+    def int_array(self, name: Any) -> Optional[array]:
+        """array('q') de la columna si es completamente entera (sin copias), si no None"""
+        column = self._columns.get(name)
+        if column is not None and column.kind == 'int' and not column.exceptions:
+            return column.values
+        return None
+
+    def encoded(self, name: Any) -> Tuple[Sequence[int], List[Any]]:
+        """
+        (código de cada fila, valor de cada código) de una columna
+
+        Las columnas de texto ya están codificadas por diccionario y se
+        entregan sin copiarlas; las demás se codifican en una pasada.
+        """
+        column = self._columns[name]
+        if column.kind == 'str':
+            return column.codes, column.dictionary
+        index: Dict[Any, int] = {}
+        codes = array('I', [index.setdefault(column.get(i), len(index)) for i in range(self._length)])
+        return codes, list(index)
+
+    def row_hash(self, index: int) -> str:
+        """Hash de contenido (hex) de la fila index, calculado al agregarla"""
+        start = index * ROW_HASH_SIZE
+        return self._hashes[start:start + ROW_HASH_SIZE].hex()
+
+    @property
+    def columns(self) -> List[Any]:
+        return list(self._columns)
+
+    @property
+    def ragged(self) -> bool:
+        """Alguna fila no trae todas las columnas"""
+        return self._ragged
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Lista de dicts con la forma que retornaba el scraper (para JSON)"""
+        return [dict(row) for row in self]
+
+    def nbytes(self) -> int:
+        """Tamaño aproximado en memoria de los datos de la tabla"""
+        return sum(column.nbytes() for column in self._columns.values()) + len(self._hashes)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Row(self, i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("BookTable index out of range")
+        return Row(self, index)
+
+    def __iter__(self) -> Iterator[Row]:
+        return (Row(self, i) for i in range(self._length))
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (BookTable, list)):
+            return len(self) == len(other) and all(dict(a) == dict(b) for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"BookTable({self._length} filas, columnas={self.columns!r})"
+
+    def _new_column(self, name: Any):
+        column = _IntColumn()
+        self._columns[name] = column
+        if self._length:
+            self._ragged = True
+            for _ in range(self._length):
+                column.append(MISSING)
+        return column
+
+    def _widen(self, column, value: Any):
+        """Reemplazar una columna que no admite value por una más general, copiando lo que tenía"""
+        values = [column.get(i) for i in range(len(column))]
+        values.append(value)
+        if column.kind == 'int':
+            wider = _DictColumn()
+            if all(wider.append(v) for v in values):
+                return wider
+        return _ObjectColumn(values)
+
+
+def row_hashes(records: Sequence) -> List[str]:
+    """Hash de contenido (hex) de cada registro; un BookTable ya los trae calculados"""
+    if isinstance(records, BookTable):
+        return [records.row_hash(i) for i in range(len(records))]
+    return [row_digest(record).hex() for record in records]
+
+
+def json_default(value: Any) -> Any:
+    """default= para json.dumps: BookTable y Row se serializan como los registros originales"""
+    if isinstance(value, BookTable):
+        return value.to_records()
+    if isinstance(value, Row):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
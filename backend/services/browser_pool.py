@@ -0,0 +1,239 @@
+"""
+Browser Pool - Pool de navegadores Chromium reutilizables para el scraper
+"""
+
+import logging
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from . import timings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from playwright.sync_api import sync_playwright
+    PLAYWRIGHT_AVAILABLE = True
+except ImportError:
+    PLAYWRIGHT_AVAILABLE = False
+
+
+# Flags de Chromium usados por el scraper (anti-bot + contenedores con poca memoria)
+DEFAULT_LAUNCH_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-dev-shm-usage',
+    '--no-sandbox',
+    '--disable-gpu',
+    '--disable-web-resources',
+    '--disable-extensions',
+]
+
+
+class PooledBrowser:
+    """
+    Navegador Chromium de larga vida atado a un hilo dedicado.
+
+    La API síncrona de Playwright no es thread-safe: el objeto Playwright y el
+    navegador sólo pueden usarse desde el hilo que los creó. Por eso cada
+    navegador vive en su propio executor de un hilo y todo el trabajo que lo
+    usa se despacha a ese hilo.
+    """
+
+    def __init__(self, slot_id: int, headless: bool, launch_args: List[str],
+                 max_uses: int, max_age_seconds: float):
+        self.slot_id = slot_id
+        self.headless = headless
+        self.launch_args = launch_args
+        self.max_uses = max_uses
+        self.max_age_seconds = max_age_seconds
+
+        self.uses = 0
+        self.launches = 0
+        self.launched_at: Optional[float] = None
+
+        self._playwright = None
+        self._browser = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"browser-{slot_id}")
+
+    def submit(self, fn: Callable[[Any], Any], context_options: Optional[Dict[str, Any]] = None):
+        """Encolar fn(context) en el hilo del navegador. Retorna un Future."""
+        # Los pasos medidos en el hilo del navegador van al registro de quien encoló
+        return self._executor.submit(self._run, fn, context_options, timings.current())
+
+    def close(self):
+        """Cerrar navegador y Playwright desde su propio hilo"""
+        try:
+            self._executor.submit(self._stop).result()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'slot': self.slot_id,
+            'launched': self._browser is not None,
+            'uses': self.uses,
+            'launches': self.launches,
+            'age_seconds': round(time.monotonic() - self.launched_at, 1) if self.launched_at else None,
+        }
+
+    def _run(self, fn: Callable[[Any], Any], context_options: Optional[Dict[str, Any]],
+             recorder: Optional[timings.StepTimings] = None):
+        with timings.timing_scope(recorder):
+            self._ensure_browser()
+            self.uses += 1
+
+            with timings.span('browser_context'):
+                context = self._browser.new_context(**(context_options or {}))
+            try:
+                return fn(context)
+            finally:
+                try:
+                    context.close()
+                except Exception as e:
+                    logger.warning(f"Error cerrando contexto del navegador {self.slot_id}: {e}")
+
+    def _recycle_reason(self) -> Optional[str]:
+        """Motivo por el que el navegador debe (re)lanzarse, o None si está sano"""
+        if self._browser is None:
+            return "sin navegador"
+        if not self._browser.is_connected():
+            return "navegador desconectado"
+        if self.max_uses and self.uses >= self.max_uses:
+            return f"alcanzó {self.uses} usos"
+        if self.max_age_seconds and time.monotonic() - self.launched_at >= self.max_age_seconds:
+            return f"superó {int(self.max_age_seconds)}s de vida"
+        return None
+
+    def _ensure_browser(self):
+        reason = self._recycle_reason()
+        if reason is None:
+            return
+
+        if self._browser is not None:
+            logger.info(f"Reciclando navegador {self.slot_id}: {reason}")
+        self._close_browser()
+
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+
+        logger.info(f"Lanzando Chromium para slot {self.slot_id}...")
+        with timings.span('browser_launch'):
+            self._browser = self._playwright.chromium.launch(
+                headless=self.headless,
+                args=self.launch_args,
+            )
+        self.launched_at = time.monotonic()
+        self.uses = 0
+        self.launches += 1
+        logger.info(f"Chromium lanzado exitosamente (slot {self.slot_id}, lanzamiento #{self.launches})")
+
+    def _close_browser(self):
+        if self._browser is None:
+            return
+        try:
+            self._browser.close()
+        except Exception as e:
+            logger.warning(f"Error cerrando navegador {self.slot_id}: {e}")
+        self._browser = None
+
+    def _stop(self):
+        self._close_browser()
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception as e:
+                logger.warning(f"Error deteniendo Playwright del slot {self.slot_id}: {e}")
+            self._playwright = None
+
+
+class BrowserPool:
+    """
+    Pool de navegadores Chromium de larga vida.
+
+    Cada llamada a run() toma un navegador libre, le crea un BrowserContext
+    nuevo (cookies y storage aislados por request) y lo cierra al terminar.
+    Los navegadores se lanzan la primera vez que se usan y se reciclan tras
+    max_uses usos, tras max_age_seconds de vida o si se desconectan.
+    """
+
+    def __init__(self, size: int = 1, headless: bool = True, launch_args: Optional[List[str]] = None,
+                 max_uses: int = 50, max_age_seconds: float = 1800, acquire_timeout: Optional[float] = None):
+        """
+        Inicializar el pool
+
+        Args:
+            size: Cantidad de navegadores simultáneos
+            headless: Ejecutar navegadores sin interfaz gráfica
+            launch_args: Flags de Chromium (default: DEFAULT_LAUNCH_ARGS)
+            max_uses: Contextos servidos antes de reciclar un navegador (0 = sin límite)
+            max_age_seconds: Segundos de vida antes de reciclar un navegador (0 = sin límite)
+            acquire_timeout: Segundos máximos esperando un navegador libre (None = sin límite)
+        """
+        if not PLAYWRIGHT_AVAILABLE:
+            raise ImportError("Playwright no está instalado. Ejecuta: pip install playwright && playwright install chromium")
+        if size < 1:
+            raise ValueError("El pool necesita al menos un navegador")
+
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._slots = [
+            PooledBrowser(i, headless, list(launch_args or DEFAULT_LAUNCH_ARGS), max_uses, max_age_seconds)
+            for i in range(size)
+        ]
+        self._idle: "queue.Queue[PooledBrowser]" = queue.Queue()
+        for slot in self._slots:
+            self._idle.put(slot)
+
+    @classmethod
+    def from_env(cls, headless: bool = True) -> "BrowserPool":
+        """
+        Crear el pool leyendo la configuración de variables de entorno:
+        SII_BROWSER_POOL_SIZE, SII_BROWSER_MAX_USES y SII_BROWSER_MAX_AGE_MINUTES
+        """
+        return cls(
+            size=int(os.getenv('SII_BROWSER_POOL_SIZE', 2)),
+            headless=headless,
+            max_uses=int(os.getenv('SII_BROWSER_MAX_USES', 50)),
+            max_age_seconds=float(os.getenv('SII_BROWSER_MAX_AGE_MINUTES', 30)) * 60,
+        )
+
+    def run(self, fn: Callable[[Any], Any], context_options: Optional[Dict[str, Any]] = None,
+            timeout: Optional[float] = None) -> Any:
+        """
+        Ejecutar fn(context) con un BrowserContext nuevo de un navegador libre
+
+        Args:
+            fn: Función que recibe el BrowserContext; se ejecuta en el hilo del navegador
+            context_options: kwargs para browser.new_context()
+            timeout: Segundos máximos esperando un navegador libre
+
+        Returns:
+            Lo que retorne fn (las excepciones de fn se propagan)
+        """
+        wait = timeout if timeout is not None else self.acquire_timeout
+        try:
+            slot = self._idle.get(timeout=wait)
+        except queue.Empty:
+            raise TimeoutError(f"No hay navegadores libres en el pool tras {wait}s")
+
+        try:
+            return slot.submit(fn, context_options).result()
+        finally:
+            self._idle.put(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': self.size,
+            'idle': self._idle.qsize(),
+            'browsers': [slot.stats() for slot in self._slots],
+        }
+
+    def close(self):
+        """Cerrar todos los navegadores del pool"""
+        for slot in self._slots:
+            try:
+                slot.close()
+            except Exception as e:
+                logger.warning(f"Error cerrando slot {slot.slot_id}: {e}")
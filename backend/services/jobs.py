@@ -0,0 +1,174 @@
+"""
+Jobs - Ejecución asíncrona de sincronizaciones largas (202 + polling)
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .progress import progress_scope
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """Hay demasiados jobs pendientes para aceptar uno nuevo"""
+
+
+class Job:
+    """Sincronización en segundo plano con su estado, pasos y resultado"""
+
+    def __init__(self, kind: str, params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = 'queued'
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.progress: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.http_status: Optional[int] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def report(self, step: str):
+        """Registrar el inicio de un paso (se usa como callback de progreso)"""
+        with self._lock:
+            self.progress.append({'step': step, 'at': datetime.now().isoformat()})
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            progress = list(self.progress)
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'current_step': progress[-1]['step'] if progress else None,
+            'progress': progress,
+            'http_status': self.http_status,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """
+    Pool acotado de workers para sincronizaciones en segundo plano.
+
+    submit() retorna de inmediato con el Job en estado "queued"; un worker lo
+    ejecuta cuando hay capacidad. Los jobs terminados se conservan ttl_seconds
+    para que el cliente pueda consultar el resultado.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 50, ttl_seconds: float = 3600):
+        """
+        Inicializar el manager
+
+        Args:
+            max_workers: Jobs ejecutándose a la vez
+            max_pending: Jobs en cola + en ejecución antes de rechazar nuevos
+            ttl_seconds: Segundos que se conserva un job terminado
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sync-job')
+        self._jobs: Dict[str, Job] = {}
+        self._finished_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "JobManager":
+        """Crear el manager leyendo SII_JOB_WORKERS, SII_JOB_MAX_PENDING y SII_JOB_TTL_MINUTES"""
+        return cls(
+            max_workers=int(os.getenv('SII_JOB_WORKERS', 2)),
+            max_pending=int(os.getenv('SII_JOB_MAX_PENDING', 50)),
+            ttl_seconds=float(os.getenv('SII_JOB_TTL_MINUTES', 60)) * 60,
+        )
+
+    def submit(self, kind: str, params: Dict[str, Any],
+               fn: Callable[[], Tuple[Dict[str, Any], int]]) -> Job:
+        """
+        Encolar un job
+
+        Args:
+            kind: Tipo de sincronización (ej: "sync-sii")
+            params: Parámetros visibles en el estado del job (sin contraseña)
+            fn: Trabajo a ejecutar; retorna (body, http_status) como el endpoint síncrono
+
+        Raises:
+            JobQueueFull: Si ya hay max_pending jobs sin terminar
+        """
+        self._prune()
+        job = Job(kind, params)
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Hay {pending} sincronizaciones pendientes")
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, fn)
+        logger.info(f"Job {job.id} ({kind}) encolado")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._prune()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            'workers': self.max_workers,
+            'queued': sum(1 for j in jobs if j.status == 'queued'),
+            'running': sum(1 for j in jobs if j.status == 'running'),
+            'finished': sum(1 for j in jobs if j.finished),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job, fn: Callable[[], Tuple[Dict[str, Any], int]]):
+        job.status = 'running'
+        job.started_at = datetime.now()
+        try:
+            with progress_scope(job.report):
+                body, http_status = fn()
+            job.result = body
+            job.http_status = http_status
+            job.status = 'succeeded' if http_status < 400 else 'failed'
+            if http_status >= 400:
+                job.error = body.get('error')
+        except Exception as e:
+            logger.error(f"Job {job.id} falló: {str(e)}", exc_info=True)
+            job.http_status = 500
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = datetime.now()
+            with self._lock:
+                self._finished_at[job.id] = time.monotonic()
+            logger.info(f"Job {job.id} terminado: {job.status}")
+
+    def _prune(self):
+        """Descartar jobs terminados hace más de ttl_seconds"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        with self._lock:
+            for job_id in [j for j, t in self._finished_at.items() if t < cutoff]:
+                self._jobs.pop(job_id, None)
+                del self._finished_at[job_id]
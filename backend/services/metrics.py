@@ -0,0 +1,100 @@
+"""
+Metrics - Histogramas en proceso para tiempos del scraper
+"""
+
+import bisect
+import math
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+# Límites superiores (segundos) de los buckets; el último captura todo lo demás
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, math.inf)
+
+
+class Histogram:
+    """Histograma acumulativo de duraciones (thread-safe)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._count = 0
+        self._sum = 0.0
+        self._min: Optional[float] = None
+        self._max: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._count += 1
+            self._sum += value
+            self._min = value if self._min is None else min(self._min, value)
+            self._max = value if self._max is None else max(self._max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Cuantil aproximado: límite superior del bucket que lo contiene (acotado por el máximo)"""
+        with self._lock:
+            if self._count == 0:
+                return None
+            target = q * self._count
+            seen = 0
+            for bound, count in zip(self.buckets, self._counts):
+                seen += count
+                if seen >= target:
+                    return min(bound, self._max)
+            return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95, p99 = self.quantile(0.5), self.quantile(0.95), self.quantile(0.99)
+        with self._lock:
+            return {
+                'count': self._count,
+                'sum': round(self._sum, 4),
+                'min': self._min,
+                'max': self._max,
+                'p50': p50,
+                'p95': p95,
+                'p99': p99,
+                'buckets': {
+                    ('+Inf' if math.isinf(bound) else str(bound)): count
+                    for bound, count in zip(self.buckets, self._counts)
+                },
+            }
+
+
+class MetricsRegistry:
+    """Registro de histogramas por nombre y etiquetas"""
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            return histogram
+
+    def observe(self, name: str, value: float, **labels: str):
+        self.histogram(name, **labels).observe(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Todos los histogramas agrupados por nombre
+
+        Returns:
+            {name: [{'labels': {...}, 'count': ..., 'p50': ..., ...}, ...]}
+        """
+        with self._lock:
+            items = list(self._histograms.items())
+
+        result: Dict[str, Any] = {}
+        for (name, labels), histogram in sorted(items, key=lambda item: item[0]):
+            result.setdefault(name, []).append({'labels': dict(labels), **histogram.snapshot()})
+        return result
+
+
+# Registro global del proceso
+metrics = MetricsRegistry()
@@ -0,0 +1,40 @@
+"""
+Progress - Reporte de pasos del scraping hacia quien lo pidió (p.ej. un job asíncrono)
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional
+
+ProgressCallback = Callable[[str], None]
+
+# ContextVar en vez de threading.local: aísla el callback por hilo y también
+# por task de asyncio (el scraper async corre muchas sesiones en un solo hilo)
+_callback: ContextVar[Optional[ProgressCallback]] = ContextVar('progress_callback', default=None)
+
+
+def current() -> Optional[ProgressCallback]:
+    """Callback de progreso activo en este hilo / task (o None)"""
+    return _callback.get()
+
+
+@contextmanager
+def progress_scope(callback: Optional[ProgressCallback]) -> Iterator[None]:
+    """
+    Activar un callback de progreso en el hilo (o task) actual
+
+    El trabajo del scraper salta del hilo de la request al hilo del navegador;
+    quien hace el salto captura current() y vuelve a abrir el scope del otro lado.
+    """
+    token = _callback.set(callback)
+    try:
+        yield
+    finally:
+        _callback.reset(token)
+
+
+def report(step: str):
+    """Informar que empieza un paso; no hace nada si no hay callback activo"""
+    callback = current()
+    if callback is not None:
+        callback(step)
@@ -0,0 +1,158 @@
+"""
+Readiness - Esperas basadas en señales concretas de la SPA del SII (en vez de sleeps fijos)
+"""
+
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from .metrics import MetricsRegistry, metrics as default_metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+except ImportError:
+    PlaywrightTimeoutError = TimeoutError
+
+
+# Angular 1.x sin digest en curso ni requests $http pendientes
+ANGULAR_IDLE_JS = """() => {
+    if (document.readyState !== 'complete') return false;
+    if (!window.angular) return true;
+    const root = document.querySelector('[ng-app], .ng-scope') || document.body;
+    const injector = window.angular.element(root).injector();
+    if (!injector) return true;
+    const $http = injector.get('$http');
+    const $rootScope = injector.get('$rootScope');
+    return $http.pendingRequests.length === 0 && !$rootScope.$$phase;
+}"""
+
+# El select N de la página tiene al menos una opción con valor
+SELECT_OPTIONS_JS = """([index]) => {
+    const select = document.querySelectorAll('select')[index];
+    return !!select && Array.from(select.options).some(o => o.value !== '' && o.value !== '?');
+}"""
+
+# Al reanudar una sesión: los selects de la página de libros (sesión vigente) o el
+# formulario de login al que redirige el SII (sesión expirada), lo que aparezca primero
+RESUME_OUTCOME_SELECTOR = "select, input#rutcntr"
+
+# Links de descarga con data URI. Al leer un libro se guarda en cada link la huella de
+# su href (largo + final); un link es "fresco" si su huella cambió desde entonces, así
+# no se vuelve a leer el CSV de otro libro o período que siga en la página
+DATA_LINK_SELECTOR = 'a[href*="data:"]'
+FRESH_DATA_LINK_SELECTOR = 'a[href*="data:"][data-sii-fresco]'
+_DATA_LINK_FINGERPRINT_JS = "a => a.getAttribute('href').length + ':' + a.getAttribute('href').slice(-64)"
+
+# Marca los links frescos con data-sii-fresco y retorna cuántos hay
+MARK_FRESH_DATA_LINKS_JS = f"""() => {{
+    let fresh = 0;
+    document.querySelectorAll('{DATA_LINK_SELECTOR}').forEach(a => {{
+        if (a.dataset.siiLeido === ({_DATA_LINK_FINGERPRINT_JS})(a)) {{
+            a.removeAttribute('data-sii-fresco');
+        }} else {{
+            a.setAttribute('data-sii-fresco', '1');
+            fresh += 1;
+        }}
+    }});
+    return fresh;
+}}"""
+
+# Marca los links actuales como ya leídos
+MARK_DATA_LINKS_READ_JS = f"""() => {{
+    document.querySelectorAll('{DATA_LINK_SELECTOR}').forEach(a => {{
+        a.dataset.siiLeido = ({_DATA_LINK_FINGERPRINT_JS})(a);
+    }});
+}}"""
+
+
+class PageReadiness:
+    """
+    Esperas con timeout propio por señal y registro de su duración real.
+
+    Cada espera observa su duración en el histograma scraper_wait_seconds
+    (etiquetas signal y outcome=ready|timeout|error). Un timeout no es un error:
+    las esperas retornan False y el flujo decide si continúa.
+    """
+
+    # Timeouts por señal (ms)
+    TIMEOUTS: Dict[str, float] = {
+        'angular_idle': 5000,
+        'select_options': 10000,
+        'modal_hidden': 20000,
+        'response': 20000,
+        'selector': 10000,
+        'url': 10000,
+    }
+
+    def __init__(self, page, timeouts: Optional[Dict[str, float]] = None,
+                 registry: Optional[MetricsRegistry] = None):
+        self.page = page
+        self.timeouts = {**self.TIMEOUTS, **(timeouts or {})}
+        self.metrics = registry or default_metrics
+
+    def angular_idle(self, signal: str = 'angular_idle', timeout: Optional[float] = None) -> bool:
+        """Esperar a que Angular termine el digest y no tenga $http pendientes"""
+        return self._timed(signal, 'angular_idle', timeout,
+                           lambda t: self.page.wait_for_function(ANGULAR_IDLE_JS, timeout=t))
+
+    def select_options(self, index: int, signal: str = 'select_options', timeout: Optional[float] = None) -> bool:
+        """Esperar a que el select N (orden en el DOM) tenga opciones cargadas"""
+        return self._timed(signal, 'select_options', timeout,
+                           lambda t: self.page.wait_for_function(SELECT_OPTIONS_JS, arg=[index], timeout=t))
+
+    def modal_hidden(self, signal: str = 'modal_hidden', timeout: Optional[float] = None) -> bool:
+        """Esperar a que desaparezca el modal de carga #esperaDialog"""
+        return self._timed(signal, 'modal_hidden', timeout,
+                           lambda t: self.page.locator("#esperaDialog").wait_for(state="hidden", timeout=t))
+
+    def selector(self, selector: str, state: str = "attached", signal: str = 'selector',
+                 timeout: Optional[float] = None) -> bool:
+        """Esperar a que un selector llegue al estado pedido"""
+        return self._timed(signal, 'selector', timeout,
+                           lambda t: self.page.locator(selector).first.wait_for(state=state, timeout=t))
+
+    def url_contains(self, fragment: str, signal: str = 'url', timeout: Optional[float] = None) -> bool:
+        """Esperar a que la URL de la página contenga fragment"""
+        return self._timed(signal, 'url', timeout,
+                           lambda t: self.page.wait_for_url(lambda url: fragment in url, timeout=t))
+
+    def response_after(self, action: Callable[[], None], url_fragment: str, signal: str = 'response',
+                       timeout: Optional[float] = None) -> bool:
+        """
+        Ejecutar action() y esperar la respuesta XHR cuya URL contiene url_fragment
+
+        Los errores de action() se propagan; sólo el timeout de la respuesta
+        se reporta como False.
+        """
+        acted = {'done': False}
+
+        def wait(t):
+            with self.page.expect_response(lambda r: url_fragment in r.url, timeout=t):
+                action()
+                acted['done'] = True
+
+        return self._timed(signal, 'response', timeout, wait, reraise=lambda: not acted['done'])
+
+    def _timed(self, signal: str, kind: str, timeout: Optional[float], wait: Callable[[float], None],
+               reraise: Optional[Callable[[], bool]] = None) -> bool:
+        t = timeout if timeout is not None else self.timeouts[kind]
+        start = time.perf_counter()
+        outcome = 'ready'
+        try:
+            wait(t)
+            return True
+        except PlaywrightTimeoutError:
+            if reraise is not None and reraise():
+                outcome = 'error'
+                raise
+            outcome = 'timeout'
+            return False
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.observe('scraper_wait_seconds', elapsed, signal=signal, outcome=outcome)
+            logger.info(f"  ⏱ {signal}: {outcome} en {elapsed * 1000:.0f} ms")
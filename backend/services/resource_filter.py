@@ -0,0 +1,116 @@
+"""
+Resource Filter - Bloqueo de recursos innecesarios (imágenes, fuentes, analytics) en las páginas del scraper
+"""
+
+import logging
+import os
+from typing import Iterable, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Tipos de recurso de Playwright que el scraper nunca necesita.
+# "stylesheet" no va por defecto: el CSS define la visibilidad de #esperaDialog
+# y de los botones que el scraper espera en estado "visible".
+DEFAULT_BLOCKED_TYPES = ('image', 'font', 'media')
+
+# Analytics / tracking de terceros que cargan las páginas del SII
+DEFAULT_BLOCKED_HOSTS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'hotjar.com',
+    'facebook.net',
+    'clarity.ms',
+)
+
+# Recursos que deben cargar siempre para que la SPA Angular arranque y autentique
+# (API de datos y páginas/redirects de autenticación)
+DEFAULT_ALLOWLIST = (
+    'consdcvinternetui/services/',
+    'AUT2000',
+)
+
+
+def _split_env(name: str, default: Iterable[str]) -> List[str]:
+    value = os.getenv(name)
+    if value is None:
+        return list(default)
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class ResourceFilter:
+    """
+    Filtro de requests por BrowserContext (context.route).
+
+    Aborta los tipos de recurso bloqueados y cualquier request a hosts de
+    analytics; las URLs que contienen alguno de los fragmentos del allowlist
+    pasan siempre, para no romper el arranque de la app.
+    """
+
+    def __init__(self, blocked_types: Iterable[str] = DEFAULT_BLOCKED_TYPES,
+                 blocked_hosts: Iterable[str] = DEFAULT_BLOCKED_HOSTS,
+                 allowlist: Iterable[str] = DEFAULT_ALLOWLIST):
+        """
+        Inicializar el filtro
+
+        Args:
+            blocked_types: Tipos de recurso a abortar (image, font, media, stylesheet, ...)
+            blocked_hosts: Hosts (o sufijos de host) a abortar siempre
+            allowlist: Fragmentos de URL que nunca se bloquean
+        """
+        self.blocked_types = frozenset(blocked_types)
+        self.blocked_hosts = tuple(blocked_hosts)
+        self.allowlist = tuple(allowlist)
+
+    @classmethod
+    def from_env(cls) -> Optional["ResourceFilter"]:
+        """
+        Crear el filtro desde SII_BLOCK_RESOURCES, SII_BLOCK_HOSTS y SII_ALLOW_URLS
+        (listas separadas por coma). SII_BLOCK_RESOURCES=off deshabilita el filtro.
+        """
+        blocked_types = _split_env('SII_BLOCK_RESOURCES', DEFAULT_BLOCKED_TYPES)
+        if [t.lower() for t in blocked_types] == ['off']:
+            return None
+        return cls(
+            blocked_types=blocked_types,
+            blocked_hosts=_split_env('SII_BLOCK_HOSTS', DEFAULT_BLOCKED_HOSTS),
+            allowlist=_split_env('SII_ALLOW_URLS', DEFAULT_ALLOWLIST),
+        )
+
+    def install(self, context):
+        """Registrar el filtro en todas las páginas del contexto"""
+        context.route("**/*", self._handle)
+
+    async def install_async(self, context):
+        """install() para un BrowserContext de playwright.async_api"""
+        await context.route("**/*", self._handle_async)
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        if any(fragment in url for fragment in self.allowlist):
+            return False
+        if resource_type in self.blocked_types:
+            return True
+        host = urlsplit(url).hostname or ''
+        return any(host == blocked or host.endswith('.' + blocked) for blocked in self.blocked_hosts)
+
+    def _handle(self, route):
+        request = route.request
+        try:
+            if self.should_block(request.url, request.resource_type):
+                route.abort()
+            else:
+                route.continue_()
+        except Exception as e:
+            # La página pudo cerrarse mientras la request estaba en vuelo
+            logger.debug(f"Error filtrando {request.url}: {e}")
+
+    async def _handle_async(self, route):
+        request = route.request
+        try:
+            if self.should_block(request.url, request.resource_type):
+                await route.abort()
+            else:
+                await route.continue_()
+        except Exception as e:
+            logger.debug(f"Error filtrando {request.url}: {e}")
@@ -0,0 +1,132 @@
+"""
+Response Capture - Captura de las respuestas JSON de facadeService que hace la SPA del SII
+"""
+
+import logging
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import timings
+from .sii_records import OPERACIONES, resumen_body_to_records
+
+logger = logging.getLogger(__name__)
+
+try:
+    from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+except ImportError:
+    PlaywrightTimeoutError = TimeoutError
+
+FACADE_PATH = "consdcvinternetui/services/data/facadeService/"
+
+# (servicio, operacion, ptributario, rutEmisor), ej: ('getResumen', 'COMPRA', '202510', '77956294')
+ResponseKey = Tuple[str, Optional[str], Optional[str], Optional[str]]
+
+
+class FacadeResponseCapture:
+    """
+    Registro de las respuestas de consdcvinternetui/services/data/facadeService/*.
+
+    La SPA Angular ya pide el resumen de cada libro a getResumen al presionar
+    Consultar o cambiar de tab; escuchando page.on("response") se obtienen los
+    registros directo del JSON, sin esperar a que la UI renderice el link de
+    descarga ni traer el data URI completo por el bridge CDP. Sólo se guarda
+    el objeto Response: el body se lee recién cuando se pide.
+    """
+
+    _by_page: "weakref.WeakKeyDictionary[Any, FacadeResponseCapture]" = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        self._responses: Dict[ResponseKey, Any] = {}
+
+    @classmethod
+    def attach(cls, page) -> "FacadeResponseCapture":
+        """Empezar a capturar las respuestas de facadeService de una página"""
+        capture = cls()
+        page.on("response", capture._on_response)
+        cls._by_page[page] = capture
+        return capture
+
+    @classmethod
+    def of(cls, page) -> Optional["FacadeResponseCapture"]:
+        """Captura asociada a la página, si se llamó attach()"""
+        return cls._by_page.get(page)
+
+    def resumen_records(self, page, book_type: str, mes: int, ano: int,
+                        timeout: float = 10000, rut: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Registros del libro desde la respuesta de getResumen del período
+
+        Si la respuesta todavía no llegó, espera el XHR hasta timeout (ms).
+        Con rut se descartan respuestas de otra empresa (cuando una misma
+        página consulta varias).
+
+        Returns:
+            Registros con la forma del CSV, o None si no hubo respuesta utilizable
+            (en ese caso se usa el link de descarga como antes)
+        """
+        rut_emisor = rut.split('-')[0].replace('.', '') if rut else None
+        key: ResponseKey = ('getResumen', OPERACIONES[book_type], f"{ano}{mes:02d}", rut_emisor)
+
+        response = self._find(key)
+        if response is None:
+            try:
+                with timings.span('resumen_wait'):
+                    response = page.wait_for_event(
+                        "response",
+                        predicate=lambda r: self._matches(self._key_of(r), key),
+                        timeout=timeout,
+                    )
+            except PlaywrightTimeoutError:
+                logger.info(f"  No llegó respuesta getResumen para {book_type} {mes:02d}/{ano}")
+                return None
+
+        try:
+            if not response.ok:
+                logger.warning(f"  getResumen respondió {response.status}")
+                return None
+
+            with timings.span('decode'):
+                body = response.json()
+            with timings.span('parse'):
+                return resumen_body_to_records(body, book_type)
+
+        except Exception as e:
+            logger.warning(f"  No se pudo leer la respuesta de getResumen: {e}")
+            return None
+
+    def _on_response(self, response):
+        if FACADE_PATH not in response.url:
+            return
+        key = self._key_of(response)
+        # Re-insertar para que la respuesta más reciente quede al final
+        self._responses.pop(key, None)
+        self._responses[key] = response
+
+    def _find(self, key: ResponseKey):
+        for captured_key in reversed(list(self._responses)):
+            if self._matches(captured_key, key):
+                return self._responses[captured_key]
+        return None
+
+    @staticmethod
+    def _key_of(response) -> ResponseKey:
+        if FACADE_PATH not in response.url:
+            return ('', None, None, None)
+
+        service = response.url.split(FACADE_PATH, 1)[1].split('?', 1)[0]
+        try:
+            data = (response.request.post_data_json or {}).get('data') or {}
+        except Exception:
+            data = {}
+        rut_emisor = data.get('rutEmisor')
+        return (service, data.get('operacion'), data.get('ptributario'),
+                str(rut_emisor) if rut_emisor is not None else None)
+
+    @staticmethod
+    def _matches(captured: ResponseKey, wanted: ResponseKey) -> bool:
+        """Mismo servicio y operación; período y RUT se comparan sólo si ambos lados los informan"""
+        service, operacion, ptributario, rut_emisor = captured
+        return (service == wanted[0]
+                and operacion == wanted[1]
+                and (ptributario is None or str(ptributario) == wanted[2])
+                and (rut_emisor is None or wanted[3] is None or rut_emisor == wanted[3]))
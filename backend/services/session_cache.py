@@ -0,0 +1,111 @@
+"""
+Session Cache - Cache en proceso de sesiones SII autenticadas (storage_state de Playwright)
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCache:
+    """
+    Cache de sesiones autenticadas por RUT con expiración por TTL.
+
+    Guarda el storage_state (cookies + localStorage) que deja un login exitoso
+    para que las siguientes consultas del mismo RUT entren directo a la página
+    de libros. Cada entrada recuerda un HMAC de la contraseña con la que se
+    obtuvo: una request con otra contraseña nunca reutiliza la sesión.
+    """
+
+    def __init__(self, ttl_seconds: float = 900, max_entries: int = 256):
+        """
+        Inicializar el cache
+
+        Args:
+            ttl_seconds: Segundos de vida de una sesión (0 = cache deshabilitado)
+            max_entries: Máximo de RUTs guardados; se descartan los más antiguos
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Clave por proceso: los digests no sirven fuera de esta instancia
+        self._key = secrets.token_bytes(32)
+
+    @classmethod
+    def from_env(cls) -> "SessionCache":
+        """Crear el cache leyendo SII_SESSION_TTL_MINUTES (0 deshabilita el cache)"""
+        return cls(ttl_seconds=float(os.getenv('SII_SESSION_TTL_MINUTES', 15)) * 60)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def get(self, rut: str, password: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtener el storage_state vigente de un RUT
+
+        Returns:
+            storage_state para browser.new_context(), o None si no hay sesión
+            vigente para ese RUT y contraseña
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(rut)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry['expires_at']:
+                del self._entries[rut]
+                logger.info(f"Sesión SII expirada para RUT: {rut}")
+                return None
+            if not hmac.compare_digest(entry['digest'], self._digest(password)):
+                return None
+            return entry['state']
+
+    def put(self, rut: str, password: str, state: Dict[str, Any]):
+        """Guardar el storage_state de un login exitoso"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[rut] = {
+                'state': state,
+                'digest': self._digest(password),
+                'expires_at': time.monotonic() + self.ttl_seconds,
+            }
+            self._entries.move_to_end(rut)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, rut: str, password: str):
+        """
+        Descartar la sesión de un RUT (p.ej. porque el SII la dio por expirada)
+
+        Sólo si se obtuvo con esa misma contraseña: un login fallido con otra
+        contraseña no cierra la sesión vigente de quien sí la conoce.
+        """
+        with self._lock:
+            entry = self._entries.get(rut)
+            if entry is not None and hmac.compare_digest(entry['digest'], self._digest(password)):
+                del self._entries[rut]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sessions': len(self._entries),
+                'ttl_seconds': self.ttl_seconds,
+            }
+
+    def _digest(self, password: str) -> bytes:
+        return hmac.new(self._key, password.encode('utf-8'), hashlib.sha256).digest()
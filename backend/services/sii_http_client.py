@@ -0,0 +1,266 @@
+"""
+SII HTTP Client - Backend sin navegador: login y getResumen con peticiones HTTP directas
+
+Origen del contrato (reemplaza al del prototipo debug_http.py):
+- Login: el POST a /cgi_AUT2000/CAutInicio.cgi es el que hace el formulario de
+  IngresoRutClave.html cuando el scraper presiona bt_ingresar (la URL en que
+  queda la página tras un login fallido); los campos son los del formulario:
+  rut, dv, referencia, 411, rutcntr y clave. debug_http.py posteaba a
+  IngresoAut.html con rutcntr/clave/submit.
+- getResumen: el body es el mismo que envía la SPA de consdcvinternetui y que
+  response_capture lee de las requests capturadas (metaData.namespace de
+  FacadeService, data.rutEmisor/dvEmisor/ptributario/operacion...). Los campos
+  rut/periodoMes/periodoAnho/tipoOperacion de debug_http.py no son los de la SPA.
+
+fake_sii.py implementa este mismo contrato, pero todavía no se validó contra el
+SII real: por eso SII_BACKEND sigue en "playwright" por defecto y con
+SII_BACKEND=http el navegador queda de fallback ante cualquier error.
+"""
+
+import logging
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    REQUESTS_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"requests no disponible: {e}")
+    REQUESTS_AVAILABLE = False
+
+from .session_cache import SessionCache
+from .sii_records import OPERACIONES, resumen_to_records
+from . import sii_urls
+
+
+class SIIAuthError(Exception):
+    """El SII rechazó las credenciales o la sesión"""
+
+
+class SIIHttpClient:
+    """
+    Cliente HTTP para consdcvinternetui (facadeService) sin Chromium.
+
+    Todas las requests comparten un único HTTPAdapter (pool de conexiones
+    keep-alive dimensionado para la concurrencia esperada). Cada RUT usa su
+    propia requests.Session montada sobre ese adapter, así las cookies de un
+    contribuyente nunca se mezclan con las de otro.
+    """
+
+    LOGIN_URL = sii_urls.LOGIN_URL
+    LOGIN_POST_URL = sii_urls.LOGIN_POST_URL
+    DESTINATION_URL = sii_urls.DESTINATION_URL
+    FACADE_URL = sii_urls.FACADE_URL
+    RESUMEN_NAMESPACE = "cl.sii.sdi.lob.diii.consdcv.data.api.interfaces.FacadeService/getResumen"
+
+    USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+
+    def __init__(self, timeout: float = 30, pool_size: int = 10, sessions: Optional[SessionCache] = None):
+        """
+        Inicializar el cliente
+
+        Args:
+            timeout: Timeout en segundos por petición
+            pool_size: Conexiones keep-alive por host (≈ syncs HTTP simultáneas)
+            sessions: Cache de sesiones compartido con el scraper (opcional)
+        """
+        if not REQUESTS_AVAILABLE:
+            raise ImportError("requests no está instalado. Ejecuta: pip install requests")
+
+        self.timeout = timeout
+        self.sessions = sessions
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+
+    @classmethod
+    def from_env(cls, sessions: Optional[SessionCache] = None) -> "SIIHttpClient":
+        """Crear el cliente leyendo SII_HTTP_TIMEOUT y SII_HTTP_POOL_SIZE"""
+        return cls(
+            timeout=float(os.getenv('SII_HTTP_TIMEOUT', 30)),
+            pool_size=int(os.getenv('SII_HTTP_POOL_SIZE', 10)),
+            sessions=sessions,
+        )
+
+    def fetch_book(self, rut: str, password: str, mes: int, ano: int,
+                   book_type: str = "COMPRAS") -> Optional[List[Dict[str, Any]]]:
+        """
+        Obtener un libro vía getResumen
+
+        Returns:
+            Registros con la misma forma que SIIScraper._fetch_book_data, o None si hay error
+        """
+        results = self.fetch_many(rut, password, [(mes, ano, book_type)])
+        if results is None:
+            return None
+        return results.get((mes, ano, book_type))
+
+    def fetch_many(self, rut: str, password: str,
+                   queries: List[Tuple[int, int, str]]) -> Optional[Dict[Tuple[int, int, str], Optional[List[Dict[str, Any]]]]]:
+        """
+        Obtener varios libros/períodos con una sola sesión
+
+        Args:
+            rut: RUT con guión (ej: "77956294-8")
+            password: Contraseña del SII
+            queries: Lista de (mes, año, book_type)
+
+        Returns:
+            Dict {(mes, año, book_type): registros o None}, o None si falló el login
+        """
+        session = self._new_session()
+        try:
+            try:
+                self._authenticate(session, rut, password)
+            except SIIAuthError as e:
+                logger.error(f"Login HTTP fallido para RUT {rut}: {e}")
+                return None
+
+            results = {}
+            for mes, ano, book_type in queries:
+                try:
+                    results[(mes, ano, book_type)] = self._get_resumen(session, rut, password, mes, ano, book_type)
+                except Exception as e:
+                    logger.error(f"Error HTTP obteniendo {book_type} {mes:02d}/{ano}: {e}")
+                    results[(mes, ano, book_type)] = None
+            return results
+
+        except Exception as e:
+            logger.error(f"Error en cliente HTTP SII: {e}", exc_info=True)
+            return None
+        finally:
+            # Sin session.close(): cerraría el adapter compartido y su pool keep-alive
+            session.cookies.clear()
+
+    def close(self):
+        """Cerrar las conexiones keep-alive del adapter compartido"""
+        self._adapter.close()
+
+    def _new_session(self) -> "requests.Session":
+        session = requests.Session()
+        session.mount("https://", self._adapter)
+        session.mount("http://", self._adapter)
+        session.headers.update({'User-Agent': self.USER_AGENT, 'Accept-Language': 'es-CL'})
+        return session
+
+    def _authenticate(self, session, rut: str, password: str):
+        """Cargar la sesión del cache si existe; si no, hacer login"""
+        state = self.sessions.get(rut, password) if self.sessions else None
+        if state:
+            for cookie in state.get('cookies', []):
+                session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+            if session.cookies.get('TOKEN'):
+                logger.info("Sesión SII reutilizada desde cache (HTTP)")
+                return
+        self._login(session, rut, password)
+
+    def _login(self, session, rut: str, password: str):
+        """
+        Login por formulario en zeusr.sii.cl (mismos campos que input#rutcntr / input#clave)
+
+        Raises:
+            SIIAuthError: Si el SII no entregó la cookie TOKEN
+        """
+        logger.info(f"Iniciando login HTTP para RUT: {rut}")
+        rut_numero, _, dv = rut.replace('.', '').partition('-')
+
+        session.get(f"{self.LOGIN_URL}?{self.DESTINATION_URL}", timeout=self.timeout)
+        response = session.post(
+            self.LOGIN_POST_URL,
+            data={
+                'rut': rut_numero,
+                'dv': dv.upper(),
+                'referencia': self.DESTINATION_URL,
+                '411': '',
+                'rutcntr': rut,
+                'clave': password,
+            },
+            headers={'Referer': self.LOGIN_URL},
+            timeout=self.timeout,
+            allow_redirects=True,
+        )
+
+        if not session.cookies.get('TOKEN'):
+            text = response.text.lower()
+            for error in ('usuario no existe', 'clave incorrecta', 'usuario inactivo', 'bloqueado'):
+                if error in text:
+                    raise SIIAuthError(error)
+            raise SIIAuthError(f"sin cookie TOKEN (status {response.status_code})")
+
+        logger.info("✓ Login HTTP exitoso")
+        if self.sessions:
+            self.sessions.put(rut, password, self._storage_state(session))
+
+    def _get_resumen(self, session, rut: str, password: str, mes: int, ano: int, book_type: str,
+                     retry_login: bool = True) -> List[Dict[str, Any]]:
+        """POST a facadeService/getResumen; re-hace login una vez si la sesión expiró"""
+        rut_numero, _, dv = rut.replace('.', '').partition('-')
+        payload = {
+            'metaData': {
+                'namespace': self.RESUMEN_NAMESPACE,
+                'conversationId': session.cookies.get('TOKEN'),
+                'transactionId': str(uuid.uuid4()),
+                'page': None,
+            },
+            'data': {
+                'rutEmisor': rut_numero,
+                'dvEmisor': dv.upper(),
+                'ptributario': f"{ano}{mes:02d}",
+                'estadoContab': 'REGISTRO',
+                'operacion': OPERACIONES[book_type],
+                'busquedaInicial': True,
+            },
+        }
+
+        response = session.post(
+            f"{self.FACADE_URL}/getResumen",
+            json=payload,
+            headers={'Accept': 'application/json', 'Referer': self.DESTINATION_URL},
+            timeout=self.timeout,
+        )
+
+        body = None
+        if response.status_code == 200 and 'json' in response.headers.get('Content-Type', ''):
+            body = response.json()
+
+        if body is None:
+            # HTML o redirect al login: la sesión (probablemente del cache) expiró
+            if retry_login:
+                logger.info("Sesión HTTP rechazada por el SII, repitiendo login")
+                if self.sessions:
+                    self.sessions.invalidate(rut, password)
+                session.cookies.clear()
+                self._login(session, rut, password)
+                return self._get_resumen(session, rut, password, mes, ano, book_type, retry_login=False)
+            raise ValueError(f"getResumen respondió {response.status_code} sin JSON")
+
+        estado = body.get('respEstado') or {}
+        if estado.get('codRespuesta') not in (None, 0):
+            raise ValueError(f"getResumen error {estado.get('codRespuesta')}: {estado.get('msgeRespuesta')}")
+
+        records = resumen_to_records(body.get('data') or [], book_type)
+        logger.info(f"✓ {book_type} {mes:02d}/{ano}: {len(records)} registros vía HTTP")
+        return records
+
+    @staticmethod
+    def _storage_state(session) -> Dict[str, Any]:
+        """Cookies de la sesión en formato storage_state de Playwright (para compartir el cache)"""
+        return {
+            'cookies': [
+                {
+                    'name': cookie.name,
+                    'value': cookie.value,
+                    'domain': cookie.domain,
+                    'path': cookie.path or '/',
+                    'expires': cookie.expires if cookie.expires else -1,
+                    'httpOnly': cookie.has_nonstandard_attr('HttpOnly'),
+                    'secure': bool(cookie.secure),
+                    'sameSite': 'Lax',
+                }
+                for cookie in session.cookies
+            ],
+            'origins': [],
+        }
@@ -3,14 +3,40 @@ SII Parser - Módulo para parsear y normalizar datos del SII
 """
 
 import logging
-from typing import List, Dict, Any
+from array import array
+from typing import List, Dict, Any, Mapping, Optional, Sequence, Tuple
+
+from .aggregation import Encoded, encode, group_sums, relabel, to_list
+from .book_schema import compile_schema, document_code, normalize_records
+from .book_table import MISSING, BookTable
 
 logger = logging.getLogger(__name__)
 
+# Tipos de documento que restan en los totales del período (notas de crédito)
+CREDIT_NOTE_TYPES = {'60', '61', '106', '112'}
+
 
 class SIIParser:
     """Parser para procesar datos del SII"""
     
+    def normalize(self, raw_data: List[Dict[str, Any]], book_type: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Normalizar un libro con el esquema de columnas de book_schema
+        
+        Args:
+            raw_data: Registros crudos del SII (lista de dicts o BookTable)
+            book_type: "COMPRAS" o "VENTAS"
+            
+        Returns:
+            (items normalizados, errores por fila); una fila con un monto
+            inválido se conserva con ese campo en None y se reporta
+        """
+        items, errors = normalize_records(raw_data, book_type)
+        if errors:
+            logger.warning(f"{book_type}: {len(errors)} valores no se pudieron interpretar")
+        logger.info(f"Parseados {len(items)} registros de {book_type}")
+        return items, errors
+    
     def parse_compras(self, raw_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Parsear datos de compras
@@ -21,29 +47,7 @@ class SIIParser:
         Returns:
             Datos normalizados de compras
         """
-        parsed = []
-        
-        try:
-            for item in raw_data:
-                parsed_item = {
-                    'rut_proveedor': item.get('rutProveedor', ''),
-                    'razon_social': item.get('nombreProveedor', ''),
-                    'tipo_documento': item.get('tipoDocumento', ''),
-                    'numero_documento': item.get('numeroDocumento', ''),
-                    'fecha_documento': item.get('fechaDocumento', ''),
-                    'monto_neto': float(item.get('montoNeto', 0)),
-                    'impuesto_iva': float(item.get('impuestoIva', 0)),
-                    'monto_total': float(item.get('montoTotal', 0)),
-                    'estado': item.get('estado', ''),
-                }
-                parsed.append(parsed_item)
-                
-            logger.info(f"Parseadas {len(parsed)} compras")
-            return parsed
-            
-        except Exception as e:
-            logger.error(f"Error parseando compras: {str(e)}")
-            return []
+        return self.normalize(raw_data, 'COMPRAS')[0]
     
     def parse_ventas(self, raw_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -55,29 +59,7 @@ class SIIParser:
         Returns:
             Datos normalizados de ventas
         """
-        parsed = []
-        
-        try:
-            for item in raw_data:
-                parsed_item = {
-                    'rut_cliente': item.get('rutCliente', ''),
-                    'razon_social': item.get('nombreCliente', ''),
-                    'tipo_documento': item.get('tipoDocumento', ''),
-                    'numero_documento': item.get('numeroDocumento', ''),
-                    'fecha_documento': item.get('fechaDocumento', ''),
-                    'monto_neto': float(item.get('montoNeto', 0)),
-                    'impuesto_iva': float(item.get('impuestoIva', 0)),
-                    'monto_total': float(item.get('montoTotal', 0)),
-                    'estado': item.get('estado', ''),
-                }
-                parsed.append(parsed_item)
-                
-            logger.info(f"Parseadas {len(parsed)} ventas")
-            return parsed
-            
-        except Exception as e:
-            logger.error(f"Error parseando ventas: {str(e)}")
-            return []
+        return self.normalize(raw_data, 'VENTAS')[0]
     
     def calculate_totals(self, items: List[Dict[str, Any]]) -> Dict[str, float]:
         """
@@ -90,9 +72,11 @@ class SIIParser:
             Dict con totales (neto, iva, total)
         """
         try:
-            total_neto = sum(item.get('monto_neto', 0) for item in items)
-            total_iva = sum(item.get('impuesto_iva', 0) for item in items)
-            total_general = sum(item.get('monto_total', 0) for item in items)
+            total_neto = total_iva = total_general = 0
+            for item in items:
+                total_neto += item.get('monto_neto', 0)
+                total_iva += item.get('impuesto_iva', 0)
+                total_general += item.get('monto_total', 0)
             
             return {
                 'total_neto': total_neto,
@@ -104,3 +88,79 @@ class SIIParser:
         except Exception as e:
             logger.error(f"Error calculando totales: {str(e)}")
             return {}
+    
+    def summarize(self, records: Sequence[Mapping], book_type: str,
+                  use_numpy: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Resumen de un libro: totales agrupados y cifras para el F29
+        
+        Agrupa en una sola pasada por tipo de documento, RUT de la contraparte,
+        día y estado. Las notas de crédito restan, como en la declaración.
+        Trabaja por columnas: con un BookTable usa directo sus arrays de montos y
+        los códigos de diccionario de las columnas de texto, y el signo de cada
+        tipo de documento se calcula una vez por tipo distinto.
+        
+        Args:
+            records: Registros crudos o normalizados (lista de dicts o BookTable)
+            book_type: "COMPRAS" o "VENTAS"
+            use_numpy: Forzar o evitar NumPy (None: según tamaño y disponibilidad)
+            
+        Returns:
+            Dict con totales, agrupaciones (listas), 'f29' con iva_credito (COMPRAS)
+            o iva_debito (VENTAS) y 'errores_normalizacion' si algún monto no se
+            pudo interpretar (cuenta como 0)
+        """
+        rut_field = 'rut_proveedor' if book_type == 'COMPRAS' else 'rut_cliente'
+        rows = len(records)
+        table = records if isinstance(records, BookTable) and not records.ragged else None
+        if table is not None:
+            headers = tuple(table.columns)
+        else:
+            records = list(records)
+            headers = tuple(records[0]) if records else ()
+        schema = compile_schema(book_type, headers)
+        
+        def text(name: str) -> Encoded:
+            source = schema.source(name)
+            if source is None:
+                return array('I', [0]) * rows, ['']
+            if table is not None:
+                encoded = table.encoded(source)
+            else:
+                encoded = encode([record.get(source) for record in records])
+            return relabel(encoded, lambda value: '' if value is None or value is MISSING else value)
+        
+        errors: List[Dict[str, Any]] = []
+        
+        def amounts(name: str) -> Sequence[Any]:
+            values = schema.numbers(table if table is not None else records, name, errors)
+            return [0 if value is None else value for value in values] if errors else values
+        
+        tipos = text('tipo_documento')
+        keys = {
+            'por_tipo_documento': tipos,
+            'por_rut': text(rut_field),
+            'por_dia': relabel(text('fecha_documento'), lambda value: str(value)[:10]),
+            'por_estado': text('estado'),
+        }
+        signs = [-1 if document_code(tipo) in CREDIT_NOTE_TYPES else 1 for tipo in tipos[1]]
+        values = {name: amounts(name) for name in ('monto_neto', 'impuesto_iva', 'monto_total')}
+        
+        sums = group_sums(keys, values, signs=('por_tipo_documento', signs), use_numpy=use_numpy)
+        
+        iva = sums['totales']['impuesto_iva']
+        summary = {
+            'tipo': book_type,
+            'cantidad_registros': rows,
+            'totales': sums['totales'],
+            'por_tipo_documento': to_list(sums['por_tipo_documento'], 'tipo_documento'),
+            'por_rut': to_list(sums['por_rut'], rut_field),
+            'por_dia': to_list(sums['por_dia'], 'fecha'),
+            'por_estado': to_list(sums['por_estado'], 'estado'),
+            'f29': {'iva_credito': iva} if book_type == 'COMPRAS' else {'iva_debito': iva},
+            'engine': sums['engine'],
+        }
+        if errors:
+            summary['errores_normalizacion'] = errors
+        logger.info(f"Resumen de {book_type}: {rows} registros ({sums['engine']})")
+        return summary
@@ -0,0 +1,92 @@
+"""
+SII Records - Conversión de respuestas JSON de consdcvinternetui al formato de registros del CSV
+"""
+
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Operación que usa facadeService para cada libro
+OPERACIONES = {
+    'COMPRAS': 'COMPRA',
+    'VENTAS': 'VENTA',
+}
+
+# RUT dentro del texto de una opción del select (ej: "77.956.294-8 EMPRESA SPA")
+RUT_PATTERN = re.compile(r'\d{1,3}(?:\.?\d{3})*-[\dkK]')
+
+# Columna del CSV de descarga de cada libro -> campo del resumen en getResumen
+RESUMEN_FIELDS: Dict[str, List[Tuple[str, str]]] = {
+    'COMPRAS': [
+        ('Total Documentos', 'rsmnTotDoc'),
+        ('Monto Exento', 'rsmnMntExe'),
+        ('Monto Neto', 'rsmnMntNeto'),
+        ('IVA Recuperable', 'rsmnMntIVA'),
+        ('IVA Uso Comun', 'rsmnIVAUsoComun'),
+        ('IVA No Recuperable', 'rsmnMntIVANoRec'),
+        ('Monto Total', 'rsmnMntTotal'),
+    ],
+    'VENTAS': [
+        ('Total Documentos', 'rsmnTotDoc'),
+        ('Monto Exento', 'rsmnMntExe'),
+        ('Monto Neto', 'rsmnMntNeto'),
+        ('Monto IVA', 'rsmnMntIVA'),
+        ('Monto Total', 'rsmnMntTotal'),
+    ],
+}
+
+
+def rut_in_option(rut: str, option_text: str) -> bool:
+    """El texto de una opción del select de RUT (ej: "76.123.456-7 EMPRESA SPA") contiene el RUT"""
+    wanted = rut.replace('.', '').upper()
+    return any(match.replace('.', '').upper() == wanted for match in RUT_PATTERN.findall(option_text))
+
+
+def _as_csv_value(value: Any) -> str:
+    """Los registros del CSV son siempre strings; los nulos quedan vacíos"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def resumen_to_records(items: Iterable[Dict[str, Any]], book_type: str) -> List[Dict[str, str]]:
+    """
+    Convertir las filas de getResumen a registros con las columnas del CSV
+
+    Args:
+        items: Lista 'data' de la respuesta de facadeService/getResumen
+        book_type: "COMPRAS" o "VENTAS" (cada libro tiene sus propias columnas)
+
+    Returns:
+        Registros con la misma forma que los parseados desde el CSV
+        (ej: {'Tipo Documento': 'Factura Electrónica(33)', 'Monto Neto': '168420', ...})
+    """
+    fields = RESUMEN_FIELDS[book_type]
+    records = []
+    for item in items:
+        nombre = item.get('dcvNombreTipoDoc') or ''
+        codigo = item.get('rsmnTipoDocInteger')
+        record = {'Tipo Documento': f"{nombre}({codigo})" if codigo is not None else nombre}
+        for column, key in fields:
+            record[column] = _as_csv_value(item.get(key))
+        records.append(record)
+    return records
+
+
+def resumen_body_to_records(body: Dict[str, Any], book_type: str) -> Optional[List[Dict[str, str]]]:
+    """
+    Registros desde el JSON completo de getResumen
+
+    Returns:
+        Registros con las columnas del CSV, o None si el SII informó un error
+    """
+    estado = body.get('respEstado') or {}
+    if estado.get('codRespuesta') not in (None, 0):
+        logger.warning(f"  getResumen error {estado.get('codRespuesta')}: {estado.get('msgeRespuesta')}")
+        return None
+    return resumen_to_records(body.get('data') or [], book_type)
+
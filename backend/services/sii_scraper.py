@@ -3,20 +3,17 @@ SII Scraper - Módulo para scrapear libros de compras y ventas del SII
 """
 
 import logging
-import tempfile
 import os
-import csv
-from io import StringIO
+import hashlib
+import hmac
+import secrets
+import time
 
 # Configurar logger PRIMERO
 logger = logging.getLogger(__name__)
 
 try:
-    from playwright.sync_api import sync_playwright, Download
-    try:
-        from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
-    except ImportError:
-        PlaywrightTimeoutError = TimeoutError
+    from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
     PLAYWRIGHT_AVAILABLE = True
 except ImportError as e:
     logger.warning(f"Playwright no disponible: {e}")
@@ -25,29 +22,75 @@ except ImportError as e:
     
 from typing import Optional, Tuple, List, Dict, Any
 
+from .browser_pool import BrowserPool
+from .session_cache import SessionCache
+from .sii_http_client import SIIHttpClient
+from .response_capture import FacadeResponseCapture
+from .sii_records import RUT_PATTERN, rut_in_option
+from .csv_stream import iter_csv_records
+from .book_table import BookTable
+from .readiness import (DATA_LINK_SELECTOR, FRESH_DATA_LINK_SELECTOR, MARK_DATA_LINKS_READ_JS,
+                        MARK_FRESH_DATA_LINKS_JS, RESUME_OUTCOME_SELECTOR, PageReadiness)
+from .resource_filter import ResourceFilter
+from .singleflight import SingleFlight
+from .admission import AdmissionController, AdmissionRejected
+from .async_sii_scraper import AsyncScraperBridge
+from . import progress
+from . import sii_urls
+from . import timings
+
 
 class SIIScraper:
     """Scraper para obtener libros de compras y ventas del SII"""
     
-    # URLs del SII
-    LOGIN_URL = "https://zeusr.sii.cl/AUT2000/InicioAutenticacion/IngresoRutClave.html"
+    # URLs del SII (SII_LOGIN_URL / SII_DESTINATION_URL las reemplazan, ver sii_urls)
+    LOGIN_URL = sii_urls.LOGIN_URL
     # URL de destino tras login - se pasará como parámetro a LOGIN_URL
-    DESTINATION_URL = "https://www4.sii.cl/consdcvinternetui/#/index"
-    BOOKS_API_URL = "https://www4.sii.cl/consdcvinternetui/services/data/facadeService/getResumen"
+    DESTINATION_URL = sii_urls.DESTINATION_URL
+    BOOKS_API_URL = f"{sii_urls.FACADE_URL}/getResumen"
     
-    def __init__(self, headless: bool = True, timeout: int = 120000):
+    def __init__(self, headless: bool = True, timeout: int = 120000, pool: Optional[BrowserPool] = None,
+                 sessions: Optional[SessionCache] = None, http_client: Optional[SIIHttpClient] = None,
+                 resource_filter: Optional[ResourceFilter] = None, admission: Optional[AdmissionController] = None):
         """
         Inicializar el scraper
         
         Args:
             headless: Ejecutar navegador sin interfaz gráfica
             timeout: Timeout en milisegundos para operaciones (aumentado a 120s para Render)
+            pool: Pool de navegadores a usar (default: uno nuevo configurado por entorno)
+            sessions: Cache de sesiones autenticadas (default: uno nuevo configurado por entorno)
+            http_client: Backend HTTP a intentar antes de Playwright (default: según SII_BACKEND)
+            resource_filter: Filtro de recursos por contexto (default: según SII_BLOCK_RESOURCES)
+            admission: Control de admisión del trabajo con navegador (default: según entorno)
         """
         if not PLAYWRIGHT_AVAILABLE:
             raise ImportError("Playwright no está instalado. Ejecuta: pip install playwright && playwright install chromium")
             
         self.headless = headless
         self.timeout = timeout
+        # Navegadores de larga vida: evita lanzar Chromium en cada request
+        self.pool = pool or BrowserPool.from_env(headless=headless)
+        # Sesiones SII reutilizables por RUT: evita repetir el login
+        self.sessions = sessions or SessionCache.from_env()
+        # Con SII_BACKEND=http se intenta primero getResumen sin navegador; Playwright queda de fallback
+        if http_client is None and os.getenv('SII_BACKEND', 'playwright').lower() == 'http':
+            http_client = SIIHttpClient.from_env(sessions=self.sessions)
+        self.http_client = http_client
+        # Sin imágenes, fuentes ni analytics: menos ancho de banda y CPU por sync
+        self.resource_filter = resource_filter or ResourceFilter.from_env()
+        # Con SII_SCRAPER_ENGINE=async los libros de un período se leen con el scraper
+        # asyncio (muchas sesiones en un solo hilo); fetch_range sigue usando el pool
+        self.async_engine = None
+        if os.getenv('SII_SCRAPER_ENGINE', 'sync').lower() == 'async':
+            self.async_engine = AsyncScraperBridge.from_env(sessions=self.sessions, headless=headless)
+        # Cola de espera acotada frente al navegador (pool o scraper async): una ráfaga recibe 429
+        # en vez de acumularse
+        default_in_flight = self.async_engine.scraper.max_sessions if self.async_engine else self.pool.size
+        self.admission = admission or AdmissionController.from_env(default_in_flight=default_in_flight)
+        # Requests idénticas concurrentes (doble click en "Sinc") comparten un solo scraping
+        self.flights = SingleFlight()
+        self._flight_secret = secrets.token_bytes(32)
     
     def test_credentials(self, rut: str, password: str) -> bool:
         """
@@ -66,55 +109,12 @@ class SIIScraper:
             
         try:
             logger.info(f"Testeando credenciales para RUT: {rut}")
-            
-            with sync_playwright() as p:
-                # Usar Chrome en lugar de Chromium para evitar detección de bot
-                browser = p.chromium.launch(
-                    headless=self.headless,
-                    args=[
-                        '--disable-blink-features=AutomationControlled',
-                        '--disable-dev-shm-usage',
-                        '--no-sandbox',
-                        '--disable-gpu',
-                        '--disable-web-resources',
-                        '--disable-extensions',
-                    ]
-                )
-                page = browser.new_page()
-                
-                # Anti-bot stealth
-                page.add_init_script("""
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => false,
-                    });
-                """)
-                
-                try:
-                    # Ir a página de login (usando networkidle para mejor estabilidad en Railway)
-                    page.goto(self.LOGIN_URL, wait_until="networkidle", timeout=self.timeout)
-                    logger.info("Página de login cargada")
-                    
-                    # Llenar formulario de login
-                    page.fill('input[name="rutclave"]', rut)
-                    page.fill('input[name="password"]', password)
-                    
-                    # Hacer click en botón de login
-                    page.click('button[type="submit"]')
-                    
-                    # Esperar respuesta
-                    page.wait_for_load_state("domcontentloaded", timeout=self.timeout)
-                    
-                    # Verificar si hay error de autenticación
-                    if "Usuario no existe" in page.content() or "Clave incorrecta" in page.content():
-                        logger.warning(f"Credenciales inválidas para RUT: {rut}")
-                        return False
-                    
-                    logger.info(f"Credenciales válidas para RUT: {rut}")
-                    return True
-                    
-                finally:
-                    browser.close()
+            if self.async_engine is not None:
+                return self._run_async(lambda: self.async_engine.test_credentials(rut, password))
+            return self._run_in_browser(lambda context: self._test_credentials_in_context(context, rut, password))
                     
+        except AdmissionRejected:
+            raise
         except PlaywrightTimeoutError:
             logger.error("Timeout al testear credenciales")
             return False
@@ -122,6 +122,35 @@ class SIIScraper:
             logger.error(f"Error al testear credenciales: {str(e)}")
             return False
     
+    def _test_credentials_in_context(self, context, rut: str, password: str) -> bool:
+        """Flujo de test_credentials dentro de un BrowserContext del pool"""
+        page = self._new_page(context)
+        
+        # Ir a página de login (usando networkidle para mejor estabilidad en Railway)
+        with timings.span('login_goto'):
+            page.goto(self.LOGIN_URL, wait_until="networkidle", timeout=self.timeout)
+        logger.info("Página de login cargada")
+        
+        with timings.span('login_submit'):
+            # Llenar formulario de login
+            page.fill('input[name="rutclave"]', rut)
+            page.fill('input[name="password"]', password)
+            
+            # Hacer click en botón de login
+            page.click('button[type="submit"]')
+        
+        # Esperar respuesta
+        with timings.span('login_redirect'):
+            page.wait_for_load_state("domcontentloaded", timeout=self.timeout)
+        
+        # Verificar si hay error de autenticación
+        if "Usuario no existe" in page.content() or "Clave incorrecta" in page.content():
+            logger.warning(f"Credenciales inválidas para RUT: {rut}")
+            return False
+        
+        logger.info(f"Credenciales válidas para RUT: {rut}")
+        return True
+    
     def fetch_books(self, rut: str, password: str, mes: int, ano: int, book_type: str = "COMPRAS") -> Optional[List[Dict[str, Any]]]:
         """
         Obtener libros del SII (COMPRAS o VENTAS)
@@ -136,64 +165,392 @@ class SIIScraper:
         Returns:
             Lista de registros del libro o None si hay error
         """
+        key = self._flight_key('books', rut, password, mes, ano, book_type)
+        return self.flights.do(key, lambda: self._fetch_books(rut, password, mes, ano, book_type))
+    
+    def _fetch_books(self, rut: str, password: str, mes: int, ano: int, book_type: str) -> Optional[List[Dict[str, Any]]]:
         try:
             logger.info(f"Iniciando fetch de {book_type} para RUT: {rut}, mes: {mes}, año: {ano}")
-            logger.info(f"Playwright disponible: {PLAYWRIGHT_AVAILABLE}")
             
-            logger.info("Iniciando Playwright...")
-            with sync_playwright() as p:
-                logger.info("Playwright context creado, lanzando Chromium...")
-                try:
-                    browser = p.chromium.launch(
-                        headless=self.headless,
-                        args=[
-                            '--disable-blink-features=AutomationControlled',
-                            '--disable-dev-shm-usage',
-                            '--no-sandbox',
-                            '--disable-gpu',
-                        ]
-                    )
-                    logger.info("Chromium lanzado exitosamente")
-                except Exception as e:
-                    logger.error(f"FALLO al lanzar Chromium: {str(e)}", exc_info=True)
-                    return None
-                    
-                try:
-                    context = browser.new_context()
-                    page = context.new_page()
-                    logger.info("Página de navegador creada")
-                    
-                    # Anti-bot stealth
-                    page.add_init_script("""
-                        Object.defineProperty(navigator, 'webdriver', {
-                            get: () => false,
-                        });
-                    """)
-                    
-                    # Realizar login
-                    logger.info("Iniciando procedimiento de login...")
-                    if not self._login(page, rut, password):
-                        logger.error("Fallo en login")
-                        return None
-                    
-                    logger.info("Login exitoso, obteniendo datos de libros...")
-                    # Obtener libros (solo COMPRAS por ahora)
-                    books = self._fetch_book_data(page, book_type, mes, ano, rut)
-                    
-                    logger.info(f"{book_type} obtenidos: {len(books) if books else 0} registros")
-                    
-                    return books
-                    
-                finally:
-                    logger.info("Cerrando navegador...")
-                    browser.close()
+            books = self._fetch_via_http(rut, password, [(mes, ano, book_type)]).get((mes, ano, book_type))
+            if books is not None:
+                return books
+            
+            if self.async_engine is not None:
+                return self._run_async(lambda: self.async_engine.fetch_books(rut, password, mes, ano, book_type))
+            return self._run_authenticated(rut, password, lambda page: self._fetch_book_data(page, book_type, mes, ano, rut))
                     
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"EXCEPCIÓN al obtener {book_type}: {str(e)}", exc_info=True)
-            import traceback
-            logger.error(f"Traceback completo: {traceback.format_exc()}")
             return None
     
+    def _flight_key(self, kind: str, rut: str, password: str, *params) -> Tuple:
+        """Clave single-flight; incluye un HMAC de la contraseña para no compartir resultados entre credenciales"""
+        password_key = hmac.new(self._flight_secret, password.encode('utf-8'), hashlib.sha256).hexdigest()
+        return (kind, rut, password_key) + params
+    
+    def _fetch_via_http(self, rut: str, password: str,
+                        queries: List[Tuple[int, int, str]]) -> Dict[Tuple[int, int, str], Optional[List[Dict[str, Any]]]]:
+        """
+        Intentar las consultas con el backend HTTP (si está configurado)
+        
+        Returns:
+            Dict {(mes, año, book_type): registros o None}; vacío si no hay backend
+            HTTP o si su login falló. Lo que falte se obtiene luego con Playwright.
+        """
+        if self.http_client is None:
+            return {}
+        
+        progress.report('consulta_http')
+        try:
+            results = self.http_client.fetch_many(rut, password, queries) or {}
+        except Exception as e:
+            logger.warning(f"Backend HTTP falló: {e}")
+            results = {}
+        
+        if any(results.get(query) is None for query in queries):
+            logger.warning("Backend HTTP incompleto, usando Playwright para lo faltante")
+        return results
+    
+    def _run_authenticated(self, rut: str, password: str, fn):
+        """
+        Ejecutar fn(page) en un contexto del pool con sesión SII iniciada
+        
+        Si hay una sesión vigente en cache para el RUT, el contexto se crea con
+        su storage_state y se entra directo a DESTINATION_URL; sólo si el SII la
+        rechaza se hace el login completo. Tras un login exitoso la sesión se
+        guarda en cache.
+        
+        Returns:
+            Lo que retorne fn, o None si no se pudo iniciar sesión
+        """
+        state = self.sessions.get(rut, password)
+        context_options = {'storage_state': state} if state else None
+        # El trabajo corre en el hilo del navegador: llevar el callback de progreso hasta allá
+        on_progress = progress.current()
+        
+        def run(context):
+            with progress.progress_scope(on_progress):
+                return self._run_on_session(context, rut, password, state is not None, fn)
+        
+        progress.report('esperando_navegador')
+        return self._run_in_browser(run, context_options=context_options)
+    
+    def _run_in_browser(self, fn, context_options: Optional[Dict[str, Any]] = None):
+        """
+        Ejecutar fn(context) en el pool pasando antes por el control de admisión
+        
+        Raises:
+            AdmissionRejected: Si la cola de espera por navegador está llena
+        """
+        with self.admission.admit():
+            return self.pool.run(fn, context_options=context_options)
+    
+    def _run_async(self, call):
+        """
+        Ejecutar una llamada al scraper async pasando por el mismo control de admisión
+        
+        Raises:
+            AdmissionRejected: Si la cola de espera por navegador está llena
+        """
+        with self.admission.admit():
+            return call()
+    
+    def _run_on_session(self, context, rut: str, password: str, has_cached_session: bool, fn):
+        """Iniciar (o reanudar) la sesión dentro del contexto y ejecutar fn(page)"""
+        page = self._new_page(context)
+        logger.info("Página de navegador creada")
+        
+        if has_cached_session:
+            progress.report('reanudando_sesion')
+        if has_cached_session and self._resume_session(page, rut, password):
+            logger.info("Sesión SII reutilizada desde cache, omitiendo login")
+        else:
+            logger.info("Iniciando procedimiento de login...")
+            progress.report('login')
+            if not self._login(page, rut, password):
+                logger.error("Fallo en login")
+                self.sessions.invalidate(rut, password)
+                return None
+            
+            try:
+                self.sessions.put(rut, password, context.storage_state())
+            except Exception as e:
+                logger.warning(f"No se pudo guardar la sesión en cache: {e}")
+        
+        logger.info("Login exitoso, obteniendo datos de libros...")
+        return fn(page)
+    
+    def _resume_session(self, page, rut: str, password: str) -> bool:
+        """
+        Entrar directo a la página de libros con una sesión en cache
+        
+        Returns:
+            True si el SII aceptó la sesión, False si expiró (se descarta del cache)
+        """
+        try:
+            with timings.span('resume_session'):
+                page.goto(self.DESTINATION_URL, wait_until="domcontentloaded", timeout=self.timeout)
+                # Con sesión vigente Angular renderiza los selects; si expiró, el SII redirige a
+                # AUT2000 y se corta apenas aparece el login en vez de agotar el timeout
+                if "consdcvinternetui" in page.url:
+                    page.locator(RESUME_OUTCOME_SELECTOR).first.wait_for(state="attached", timeout=15000)
+            if "consdcvinternetui" in page.url and page.locator("select").count() > 0:
+                return True
+        except PlaywrightTimeoutError:
+            pass
+        except Exception as e:
+            logger.warning(f"Error reanudando sesión SII: {e}")
+        
+        logger.info(f"Sesión en cache rechazada por el SII para RUT: {rut}, haciendo login completo")
+        self.sessions.invalidate(rut, password)
+        return False
+    
+    def fetch_books_multi(self, rut: str, password: str, mes: int, ano: int,
+                          book_types: Tuple[str, ...] = ("COMPRAS", "VENTAS")) -> Optional[Dict[str, Optional[List[Dict[str, Any]]]]]:
+        """
+        Obtener varios libros del mismo período con un solo login y una sola consulta
+        
+        Hace login, consulta el período una vez (mes/año + Consultar) y luego lee
+        cada libro cambiando de tab en la misma página.
+        
+        Args:
+            rut: RUT sin formato (ej: "77956294-8")
+            password: Contraseña del SII
+            mes: Mes (1-12)
+            ano: Año (YYYY)
+            book_types: Libros a obtener, en orden (default: COMPRAS y VENTAS)
+            
+        Returns:
+            Dict {book_type: registros o None si ese libro falló}, o None si
+            fallaron el login o la consulta del período
+        """
+        key = self._flight_key('multi', rut, password, mes, ano, tuple(book_types))
+        return self.flights.do(key, lambda: self._fetch_books_multi(rut, password, mes, ano, tuple(book_types)))
+    
+    def _fetch_books_multi(self, rut: str, password: str, mes: int, ano: int,
+                           book_types: Tuple[str, ...]) -> Optional[Dict[str, Optional[List[Dict[str, Any]]]]]:
+        try:
+            logger.info(f"Iniciando fetch de {', '.join(book_types)} para RUT: {rut}, mes: {mes}, año: {ano}")
+            
+            http_results = self._fetch_via_http(rut, password, [(mes, ano, t) for t in book_types])
+            results = {t: http_results.get((mes, ano, t)) for t in book_types}
+            missing = tuple(t for t in book_types if results[t] is None)
+            if not missing:
+                return results
+            
+            if self.async_engine is not None:
+                browser_results = self._run_async(
+                    lambda: self.async_engine.fetch_books_multi(rut, password, mes, ano, missing))
+            else:
+                browser_results = self._run_authenticated(rut, password, lambda page: self._fetch_books_multi_on_page(page, mes, ano, rut, missing))
+            if browser_results is None:
+                # Sin login en el navegador: sólo sirve lo que haya traído el backend HTTP
+                return results if len(missing) < len(book_types) else None
+            results.update(browser_results)
+            return results
+            
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"EXCEPCIÓN al obtener {', '.join(book_types)}: {str(e)}", exc_info=True)
+            return None
+    
+    def _fetch_books_multi_on_page(self, page, mes: int, ano: int, rut: str,
+                                   book_types: Tuple[str, ...]) -> Optional[Dict[str, Optional[List[Dict[str, Any]]]]]:
+        """Consultar el período una vez y leer cada libro (página ya autenticada)"""
+        if not self._query_period(page, mes, ano, rut):
+            return None
+        
+        return self._read_books(page, book_types, (mes, ano))
+    
+    def fetch_range(self, rut: str, password: str, periods: List[Tuple[int, int]],
+                    book_types: Tuple[str, ...] = ("COMPRAS", "VENTAS")) -> Optional[Dict[Tuple[int, int], Dict[str, Optional[List[Dict[str, Any]]]]]]:
+        """
+        Obtener libros de varios períodos con un solo login
+        
+        Inicia sesión una vez y, en la misma página, va cambiando los selects
+        periodoMes/periodoAnho y presionando Consultar para cada período.
+        
+        Args:
+            rut: RUT sin formato (ej: "77956294-8")
+            password: Contraseña del SII
+            periods: Lista de (mes, año) a consultar, en orden
+            book_types: Libros a obtener por período (default: COMPRAS y VENTAS)
+            
+        Returns:
+            Dict {(mes, año): {book_type: registros o None}}, o None si falló el login.
+            Un período cuya consulta falla queda con todos sus libros en None.
+        """
+        key = self._flight_key('range', rut, password, tuple(periods), tuple(book_types))
+        return self.flights.do(key, lambda: self._fetch_range(rut, password, list(periods), tuple(book_types)))
+    
+    def _fetch_range(self, rut: str, password: str, periods: List[Tuple[int, int]],
+                     book_types: Tuple[str, ...]) -> Optional[Dict[Tuple[int, int], Dict[str, Optional[List[Dict[str, Any]]]]]]:
+        try:
+            logger.info(f"Iniciando fetch de {len(periods)} períodos ({', '.join(book_types)}) para RUT: {rut}")
+            
+            http_results = self._fetch_via_http(rut, password, [(mes, ano, t) for mes, ano in periods for t in book_types])
+            results = {(mes, ano): {t: http_results.get((mes, ano, t)) for t in book_types} for mes, ano in periods}
+            missing = [period for period in periods if any(v is None for v in results[period].values())]
+            if not missing:
+                return results
+            
+            browser_results = self._run_authenticated(rut, password, lambda page: self._fetch_range_on_page(page, rut, missing, book_types))
+            if browser_results is None:
+                return results if len(missing) < len(periods) else None
+            for period, books in browser_results.items():
+                for book_type, records in books.items():
+                    if results[period][book_type] is None:
+                        results[period][book_type] = records
+            return results
+            
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"EXCEPCIÓN al obtener rango de períodos: {str(e)}", exc_info=True)
+            return None
+    
+    def _fetch_range_on_page(self, page, rut: str, periods: List[Tuple[int, int]],
+                             book_types: Tuple[str, ...]) -> Dict[Tuple[int, int], Dict[str, Optional[List[Dict[str, Any]]]]]:
+        """Consultar cada período en la misma página ya autenticada"""
+        results = {}
+        for i, (mes, ano) in enumerate(periods):
+            logger.info(f"Período {i + 1}/{len(periods)}: {mes:02d}/{ano}")
+            if not self._query_period(page, mes, ano, rut):
+                results[(mes, ano)] = {book_type: None for book_type in book_types}
+                continue
+            
+            # Tras la primera lectura la página puede conservar links del período anterior
+            results[(mes, ano)] = self._read_books(page, book_types, (mes, ano), first_read=(i == 0))
+        
+        return results
+    
+    def fetch_portfolio(self, rut: str, password: str, mes: int, ano: int,
+                        book_types: Tuple[str, ...] = ("COMPRAS", "VENTAS")) -> Optional[Dict[str, Dict[str, Optional[List[Dict[str, Any]]]]]]:
+        """
+        Obtener los libros de todas las empresas que representa una persona natural
+        
+        Con un solo login recorre las opciones del select de RUT (PASO 1) y,
+        para cada empresa, consulta el período y lee cada libro. Si el select
+        está deshabilitado (login de empresa) sólo se consulta ese RUT.
+        
+        Args:
+            rut: RUT de la persona natural que inicia sesión
+            password: Contraseña del SII
+            mes: Mes (1-12)
+            ano: Año (YYYY)
+            book_types: Libros a obtener por empresa (default: COMPRAS y VENTAS)
+            
+        Returns:
+            Dict {rut_empresa: {book_type: registros o None}}, o None si falló el login
+        """
+        key = self._flight_key('portfolio', rut, password, mes, ano, tuple(book_types))
+        return self.flights.do(key, lambda: self._fetch_portfolio(rut, password, mes, ano, tuple(book_types)))
+    
+    def _fetch_portfolio(self, rut: str, password: str, mes: int, ano: int,
+                         book_types: Tuple[str, ...]) -> Optional[Dict[str, Dict[str, Optional[List[Dict[str, Any]]]]]]:
+        try:
+            logger.info(f"Iniciando fetch de cartera para RUT: {rut}, mes: {mes}, año: {ano}")
+            return self._run_authenticated(rut, password, lambda page: self._fetch_portfolio_on_page(page, rut, mes, ano, book_types))
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"EXCEPCIÓN al obtener cartera: {str(e)}", exc_info=True)
+            return None
+    
+    def _fetch_portfolio_on_page(self, page, rut: str, mes: int, ano: int,
+                                 book_types: Tuple[str, ...]) -> Dict[str, Dict[str, Optional[List[Dict[str, Any]]]]]:
+        """Consultar el período para cada empresa del select de RUT (página ya autenticada)"""
+        companies = self._list_companies(page, rut)
+        logger.info(f"Cartera de {rut}: {len(companies)} empresas")
+        
+        results = {}
+        for i, company in enumerate(companies):
+            progress.report(f'empresa:{company}')
+            if not self._query_period(page, mes, ano, company):
+                logger.error(f"Falló la consulta de {mes:02d}/{ano} para {company}")
+                results[company] = {t: None for t in book_types}
+                continue
+            results[company] = self._read_books(page, book_types, (mes, ano), first_read=(i == 0), rut=company)
+        
+        return results
+    
+    def _list_companies(self, page, rut: str) -> List[str]:
+        """RUTs (sin puntos) de las opciones del select de RUT; sólo rut si el select está deshabilitado"""
+        rut_select = page.locator("select").first
+        rut_select.wait_for(state="attached", timeout=30000)
+        PageReadiness(page).select_options(0, signal='rut_options')
+        
+        if rut_select.get_attribute("disabled"):
+            return [rut]
+        
+        companies = []
+        for text in rut_select.locator("option").all_inner_texts():
+            match = RUT_PATTERN.search(text)
+            if match:
+                company = match.group(0).replace('.', '')
+                if company not in companies:
+                    companies.append(company)
+        return companies or [rut]
+    
+    def _read_books(self, page, book_types: Tuple[str, ...], period: Tuple[int, int],
+                    first_read: bool = True, rut: Optional[str] = None) -> Dict[str, Optional[List[Dict[str, Any]]]]:
+        """
+        Leer cada libro del período ya consultado cambiando de tab
+        
+        Args:
+            page: Página con el período consultado
+            book_types: Libros a leer, en orden
+            period: (mes, año) consultado
+            first_read: False si ya se leyeron libros antes en esta página
+            rut: Empresa consultada, si la página consulta varias (modo cartera)
+        """
+        results = {}
+        for i, book_type in enumerate(book_types):
+            reused_page = i > 0 or not first_read
+            progress.report(f'libro:{book_type}')
+            try:
+                # Si la página ya se usó hay que ir explícitamente al tab pedido
+                self._select_book_tab(page, book_type, force=reused_page)
+                results[book_type] = self._extract_book_records(page, book_type, skip_read=reused_page,
+                                                                period=period, rut=rut)
+            except Exception as e:
+                logger.error(f"Error obteniendo {book_type}: {str(e)}", exc_info=True)
+                results[book_type] = None
+            
+            logger.info(f"{book_type} obtenidos: {len(results[book_type]) if results[book_type] else 0} registros")
+        
+        return results
+    
+    def _new_page(self, context):
+        """Crear una página en el contexto con el script anti-bot básico y el filtro de recursos"""
+        if self.resource_filter is not None:
+            self.resource_filter.install(context)
+        
+        page = context.new_page()
+        
+        # Anti-bot stealth
+        page.add_init_script("""
+            Object.defineProperty(navigator, 'webdriver', {
+                get: () => false,
+            });
+        """)
+        
+        # Registrar las respuestas JSON de facadeService (fuente primaria de los registros)
+        FacadeResponseCapture.attach(page)
+        return page
+    
+    def close(self):
+        """Cerrar los navegadores del pool (y el scraper async y el cliente HTTP si están activos)"""
+        if self.async_engine is not None:
+            self.async_engine.close()
+        if self.http_client is not None:
+            self.http_client.close()
+        self.pool.close()
+    
     def _login(self, page, rut: str, password: str) -> bool:
         """
         Realizar login en el SII
@@ -225,24 +582,27 @@ class SIIScraper:
             
             # Ir a página de login CON parámetro de redirección a la página de libros
             login_url_with_redirect = f"{self.LOGIN_URL}?{self.DESTINATION_URL}"
-            page.goto(login_url_with_redirect, wait_until="domcontentloaded", timeout=self.timeout)
-            logger.info(f"Página de login cargada con redirección. URL: {page.url}")
-            
-            # Esperar a que cargue el formulario
-            page.wait_for_selector("input#rutcntr", timeout=self.timeout)
+            with timings.span('login_goto'):
+                page.goto(login_url_with_redirect, wait_until="domcontentloaded", timeout=self.timeout)
+                logger.info(f"Página de login cargada con redirección. URL: {page.url}")
+                
+                # Esperar a que cargue el formulario
+                page.wait_for_selector("input#rutcntr", timeout=self.timeout)
             logger.info("Formulario listo")
             
-            # Llenar formulario
-            page.fill('input#rutcntr', rut)  # RUT
-            page.fill('input#clave', password)  # Password
-            logger.info(f"Formulario llenado con RUT y contraseña")
-            
-            # Enviar login
-            page.click('button#bt_ingresar')
+            with timings.span('login_submit'):
+                # Llenar formulario
+                page.fill('input#rutcntr', rut)  # RUT
+                page.fill('input#clave', password)  # Password
+                logger.info(f"Formulario llenado con RUT y contraseña")
+                
+                # Enviar login
+                page.click('button#bt_ingresar')
             logger.info("Click en submit realizado, esperando respuesta...")
             
             # Esperar a que se cargue la página de libros (domcontentloaded es más rápido para Render)
-            page.wait_for_load_state("domcontentloaded", timeout=self.timeout)
+            with timings.span('login_redirect'):
+                page.wait_for_load_state("domcontentloaded", timeout=self.timeout)
             logger.info(f"Login completado. URL actual: {page.url}")
             
             # Verificar si estamos en la página de libros
@@ -273,8 +633,9 @@ class SIIScraper:
             else:
                 logger.warning(f"URL inesperada después de login: {current_url}")
                 # Todavía intentar proseguir - tal vez simplemente hay un redirect en progreso
-                page.wait_for_timeout(2000)
-                if "consdcvinternetui" in page.url:
+                with timings.span('login_redirect_wait'):
+                    redirected = PageReadiness(page).url_contains("consdcvinternetui", signal='login_redirect')
+                if redirected:
                     logger.info(f"✓ Finalmente llegamos a página de libros")
                     return True
                 else:
@@ -305,11 +666,42 @@ class SIIScraper:
         try:
             logger.info(f"Obteniendo datos de {book_type} para mes: {mes}, año: {ano}")
             
+            if not self._query_period(page, mes, ano, rut):
+                return None
+            
+            progress.report(f'libro:{book_type}')
+            self._select_book_tab(page, book_type)
+            return self._extract_book_records(page, book_type, period=(mes, ano))
+                    
+        except Exception as e:
+            logger.error(f"Error obteniendo {book_type}: {str(e)}", exc_info=True)
+            return None
+    
+    def _query_period(self, page, mes: int, ano: int, rut: str) -> bool:
+        """
+        Consultar un período en consdcvinternetui (PASOS 0 a 4)
+        
+        Deja la página con el resumen del período cargado y el tab COMPRA activo.
+        
+        Args:
+            page: Página de Playwright (ya autenticada)
+            mes: Mes (1-12)
+            ano: Año (YYYY)
+            rut: RUT a consultar (para seleccionar en cascada si aplica)
+            
+        Returns:
+            True si la consulta se realizó, False en caso contrario
+        """
+        try:
+            logger.info(f"Consultando período {mes:02d}/{ano}")
+            progress.report(f'consulta_periodo:{mes:02d}/{ano}')
+            
             # Asegurarse de que estamos en la página de libros
             current_url = page.url
             if "consdcvinternetui" not in current_url:
                 logger.warning(f"No estamos en la página de libros. URL actual: {current_url}")
-                page.goto("https://www4.sii.cl/consdcvinternetui/#/index", wait_until="networkidle", timeout=self.timeout)
+                with timings.span('destination_goto'):
+                    page.goto(self.DESTINATION_URL, wait_until="networkidle", timeout=self.timeout)
                 logger.info("Navegado a página de libros")
             
             # Convertir número de mes a nombre en español
@@ -319,281 +711,348 @@ class SIIScraper:
                 9: "Septiembre", 10: "Octubre", 11: "Noviembre", 12: "Diciembre"
             }
             mes_nombre = meses.get(mes, str(mes))
+            readiness = PageReadiness(page)
             
-            logger.info("PASO 0: Esperando a que los selects estén disponibles en el DOM...")
-            # ESPERAR ACTIVAMENTE a que los selects aparezcan - esto es CRÍTICO
-            try:
-                page.locator("select").first.wait_for(state="attached", timeout=30000)
-                logger.info("✓ Selectores detectados en el DOM")
-            except PlaywrightTimeoutError:
-                logger.error("Timeout esperando selectores - página no renderizó correctamente")
-                return None
-            
-            # Dar tiempo adicional para que Angular termide de renderizar
-            page.wait_for_timeout(3000)
-            logger.info("✓ Página lista para interactuar")
+            with timings.span('selects_ready'):
+                logger.info("PASO 0: Esperando a que los selects estén disponibles en el DOM...")
+                # ESPERAR ACTIVAMENTE a que los selects aparezcan - esto es CRÍTICO
+                try:
+                    page.locator("select").first.wait_for(state="attached", timeout=30000)
+                    logger.info("✓ Selectores detectados en el DOM")
+                except PlaywrightTimeoutError:
+                    logger.error("Timeout esperando selectores - página no renderizó correctamente")
+                    return False
+                
+                # Esperar a que Angular termine de renderizar y cargue las opciones de mes
+                readiness.angular_idle(signal='selects_ready')
+                readiness.select_options(1, signal='month_options')
+                logger.info("✓ Página lista para interactuar")
             
             # PASO 1: Detectar y seleccionar RUT si es persona natural
             try:
-                rut_select = page.locator("select").first
-                is_disabled = rut_select.get_attribute("disabled")
-                
-                if not is_disabled:
-                    # Persona natural - cascada habilitada
-                    logger.info("PASO 1: RUT Persona Natural detectado - seleccionando RUT...")
+                with timings.span('rut_select'):
+                    rut_select = page.locator("select").first
+                    is_disabled = rut_select.get_attribute("disabled")
                     
-                    options = rut_select.locator("option")
-                    option_count = options.count()
-                    logger.info(f"  Opciones disponibles: {option_count}")
+                    if not is_disabled:
+                        # Persona natural - cascada habilitada
+                        logger.info("PASO 1: RUT Persona Natural detectado - seleccionando RUT...")
                     
-                    for i in range(option_count):
-                        option_text = options.nth(i).inner_text()
-                        logger.info(f"    Opción {i}: {option_text}")
-                        
-                        # Buscar el RUT del request en las opciones
-                        if rut in option_text:
-                            rut_select.select_option(options.nth(i).get_attribute("value"))
-                            logger.info(f"  ✓ RUT seleccionado: {option_text}")
-                            page.wait_for_timeout(1000)
-                            break
-                else:
-                    logger.info("PASO 1: RUT Empresa detectado - cascada deshabilitada")
+                        options = rut_select.locator("option")
+                        option_count = options.count()
+                        logger.info(f"  Opciones disponibles: {option_count}")
                     
+                        for i in range(option_count):
+                            option_text = options.nth(i).inner_text()
+                            logger.info(f"    Opción {i}: {option_text}")
+                    
+                            # Buscar el RUT del request en las opciones
+                            if rut_in_option(rut, option_text):
+                                rut_select.select_option(options.nth(i).get_attribute("value"))
+                                logger.info(f"  ✓ RUT seleccionado: {option_text}")
+                                readiness.angular_idle(signal='rut_selected')
+                                break
+                    else:
+                        logger.info("PASO 1: RUT Empresa detectado - cascada deshabilitada")
+                
             except Exception as e:
                 logger.warning(f"  ⚠ Error en PASO 1: {e}")
             
             # PASO 2: Seleccionar mes
             try:
-                logger.info(f"PASO 2: Seleccionando mes: {mes_nombre}")
-                
-                # Encontrar todos los selects
-                selects = page.locator("select")
-                select_count = selects.count()
-                logger.info(f"Encontrados {select_count} selects")
-                
-                if select_count >= 2:
-                    # El SEGUNDO select (índice 1) es el de mes (ng-model="periodoMes")
-                    # NO el primero que es RUT
-                    periodo_select = selects.nth(1)
-                    periodo_select.wait_for(state="visible", timeout=5000)
+                with timings.span('month_select'):
+                    logger.info(f"PASO 2: Seleccionando mes: {mes_nombre}")
                     
-                    # Convertir mes a formato "01", "02", etc
-                    mes_value = f"{mes:02d}"
-                    logger.info(f"Seleccionando valor: '{mes_value}'")
+                    # Encontrar todos los selects
+                    selects = page.locator("select")
+                    select_count = selects.count()
+                    logger.info(f"Encontrados {select_count} selects")
                     
-                    # Seleccionar por valor (no por texto)
-                    periodo_select.select_option(mes_value)
-                    logger.info(f"✓ Mes {mes:02d} ({mes_nombre}) seleccionado")
+                    if select_count >= 2:
+                        # El SEGUNDO select (índice 1) es el de mes (ng-model="periodoMes")
+                        # NO el primero que es RUT
+                        periodo_select = selects.nth(1)
+                        periodo_select.wait_for(state="visible", timeout=5000)
                     
-                    page.wait_for_timeout(800)
-                else:
-                    logger.error(f"No hay selects disponibles")
-                    return None
+                        # Convertir mes a formato "01", "02", etc
+                        mes_value = f"{mes:02d}"
+                        logger.info(f"Seleccionando valor: '{mes_value}'")
+                    
+                        # Seleccionar por valor (no por texto)
+                        periodo_select.select_option(mes_value)
+                        logger.info(f"✓ Mes {mes:02d} ({mes_nombre}) seleccionado")
                     
+                        readiness.angular_idle(signal='month_selected')
+                    else:
+                        logger.error(f"No hay selects disponibles")
+                        return False
+                
             except Exception as e:
                 logger.error(f"Error en paso de mes: {e}")
-                return None
+                return False
             
             # PASO 3: Seleccionar año
             try:
-                logger.info(f"PASO 3: Seleccionando año: {ano}")
-                
-                selects = page.locator("select")
-                
-                if selects.count() >= 3:
-                    # El TERCER select (índice 2) es el de año (ng-model="periodoAnho")
-                    ano_select = selects.nth(2)
-                    ano_select.wait_for(state="visible", timeout=5000)
-                    ano_select.select_option(str(ano))
-                    logger.info(f"✓ Año {ano} seleccionado")
-                    page.wait_for_timeout(800)
-                else:
-                    logger.warning(f"Solo hay {selects.count()} selects, esperado al menos 3")
+                with timings.span('year_select'):
+                    logger.info(f"PASO 3: Seleccionando año: {ano}")
                     
+                    selects = page.locator("select")
+                    
+                    if selects.count() >= 3:
+                        # El TERCER select (índice 2) es el de año (ng-model="periodoAnho")
+                        ano_select = selects.nth(2)
+                        ano_select.wait_for(state="visible", timeout=5000)
+                        ano_select.select_option(str(ano))
+                        logger.info(f"✓ Año {ano} seleccionado")
+                        readiness.angular_idle(signal='year_selected')
+                    else:
+                        logger.warning(f"Solo hay {selects.count()} selects, esperado al menos 3")
+                
             except Exception as e:
                 logger.error(f"Error en paso de año: {e}")
-                return None
+                return False
             
             # PASO 4: Hacer click en Consultar
             try:
-                logger.info("PASO 4: Buscando botón Consultar...")
-                
-                consultar_btn = page.locator("button").filter(has_text="Consultar").first
-                consultar_btn.wait_for(state="visible", timeout=5000)
-                
-                logger.info("Clickeando Consultar...")
-                consultar_btn.click()
-                logger.info("✓ Consultar clickeado")
-                
-                # ESPERA CRÍTICA: El modal (#esperaDialog) aparece cuando se inicia la consulta
-                # Debemos esperar a que Angular lo cierre, lo que significa que terminó de renderizar
-                logger.info("Esperando a que desaparezca el modal de carga...")
-                try:
-                    page.locator("#esperaDialog").wait_for(state="hidden", timeout=20000)
-                    logger.info("✓ Modal desapareció - Angular terminó de renderizar")
-                except PlaywrightTimeoutError:
-                    logger.warning("⚠ Modal no desapareció en 20s, continuando de todas formas...")
-                    page.wait_for_timeout(2000)
+                with timings.span('consultar'):
+                    logger.info("PASO 4: Buscando botón Consultar...")
+                    
+                    consultar_btn = page.locator("button").filter(has_text="Consultar").first
+                    consultar_btn.wait_for(state="visible", timeout=5000)
+                    
+                    logger.info("Clickeando Consultar...")
+                    # El click dispara el XHR a getResumen; esperamos esa respuesta concreta
+                    readiness.response_after(consultar_btn.click, "facadeService/getResumen", signal='consultar_xhr')
+                    logger.info("✓ Consultar clickeado")
+                    
+                    # ESPERA CRÍTICA: El modal (#esperaDialog) aparece cuando se inicia la consulta
+                    # Debemos esperar a que Angular lo cierre, lo que significa que terminó de renderizar
+                    logger.info("Esperando a que desaparezca el modal de carga...")
+                    if readiness.modal_hidden(signal='consultar_modal'):
+                        logger.info("✓ Modal desapareció - Angular terminó de renderizar")
+                    else:
+                        logger.warning("⚠ Modal no desapareció a tiempo, esperando a Angular y continuando...")
+                        readiness.angular_idle(signal='consultar_render')
                 
             except Exception as e:
                 logger.error(f"Error clickeando Consultar: {e}")
-                return None
+                return False
             
-            # PASO 5: Cambiar tab para VENTAS (si aplica)
-            if book_type == "VENTAS":
-                try:
-                    logger.info("PASO 5: Clickeando tab VENTA (reconociendo texto)...")
-                    
-                    # Buscar elemento que contiene el texto "VENTA" exacto
-                    venta_tab = page.locator('text="VENTA"')
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error consultando período {mes:02d}/{ano}: {str(e)}", exc_info=True)
+            return False
+    
+    def _select_book_tab(self, page, book_type: str, force: bool = False):
+        """
+        Activar el tab del libro pedido (PASO 5)
+        
+        Tras Consultar el SII deja activo el tab COMPRA, así que por defecto sólo
+        se hace click para VENTAS. Con force=True también se vuelve a COMPRA
+        (necesario cuando se leen varios libros desde la misma página).
+        
+        Args:
+            page: Página de Playwright con el período ya consultado
+            book_type: "COMPRAS" o "VENTAS"
+            force: Hacer click aunque sea el tab por defecto
+        """
+        if book_type == "COMPRAS" and not force:
+            return
+        
+        tab_label = "VENTA" if book_type == "VENTAS" else "COMPRA"
+        try:
+            logger.info(f"PASO 5: Clickeando tab {tab_label} (reconociendo texto)...")
+            
+            # Buscar elemento que contiene el texto exacto del tab
+            tab = page.locator(f'text="{tab_label}"')
+            
+            if tab.count() > 0:
+                logger.info(f"  ✓ Tab {tab_label} encontrado por texto")
+                readiness = PageReadiness(page)
+                with timings.span('tab_switch'):
+                    # El cambio de tab puede pedir el resumen del libro (o usar uno ya cargado)
+                    readiness.response_after(tab.first.click, "facadeService/getResumen",
+                                             signal='tab_xhr', timeout=8000)
+                    logger.info(f"  ✓ Click en tab {tab_label} realizado")
                     
-                    if venta_tab.count() > 0:
-                        logger.info("  ✓ Tab VENTA encontrado por texto")
-                        venta_tab.click()
-                        logger.info("  ✓ Click en tab VENTA realizado")
-                        
-                        # Esperar a que Angular renderice VENTAS (puede demorar)
-                        logger.info("  Esperando renderizado de VENTAS después del cambio de tab...")
-                        page.wait_for_timeout(2000)
-                        logger.info("  ✓ Renderizado completado")
-                    else:
-                        logger.warning("  ⚠ Tab VENTA no encontrado por texto, continuando...")
-                        
-                except Exception as e:
-                    logger.warning(f"  ⚠ Error en cambio de tab VENTA: {e}")
-                    # Continuar de todas formas
+                    # Esperar a que Angular renderice el libro
+                    logger.info(f"  Esperando renderizado de {book_type} después del cambio de tab...")
+                    readiness.angular_idle(signal='tab_render')
+                logger.info("  ✓ Renderizado completado")
+            else:
+                logger.warning(f"  ⚠ Tab {tab_label} no encontrado por texto, continuando...")
+                
+        except Exception as e:
+            logger.warning(f"  ⚠ Error en cambio de tab {tab_label}: {e}")
+            # Continuar de todas formas
+    
+    def _extract_book_records(self, page, book_type: str, skip_read: bool = False,
+                              period: Optional[Tuple[int, int]] = None,
+                              rut: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Extraer los registros del libro visible (PASO 6)
+        
+        Primero usa la respuesta JSON de getResumen capturada de la red; si no
+        está disponible, lee el CSV desde el data URI del link de descarga.
+        
+        Args:
+            page: Página de Playwright con el tab del libro activo
+            book_type: "COMPRAS" o "VENTAS"
+            skip_read: Ignorar links cuyo data URI ya fue leído en esta página
+                (al leer varios libros desde la misma consulta)
+            period: (mes, año) consultado; necesario para usar la respuesta capturada
+            rut: Empresa consultada; descarta respuestas capturadas de otra empresa
             
-            # PASO 6: Extraer CSV desde el data URI del link
+        Returns:
+            Lista de registros del libro o None si hay error
+        """
+        capture = FacadeResponseCapture.of(page)
+        if capture is not None and period is not None:
+            logger.info("PASO 6: Leyendo registros desde la respuesta de getResumen...")
+            records = capture.resumen_records(page, book_type, period[0], period[1], rut=rut)
+            if records is not None:
+                logger.info(f"✓ {book_type}: {len(records)} registros desde la respuesta JSON")
+                return records
+            logger.info("  Sin respuesta JSON utilizable, usando link de descarga")
+        
+        # PASO 6: Extraer CSV desde el data URI del link
+        extract_started = time.perf_counter()
+        try:
+            logger.info("PASO 6: Buscando link de descarga con data URI...")
+            
+            # Primero, esperar a que el botón "Descargar" sea visible
+            # (así como esperamos a que "Consultar" fuera visible en PASO 4)
+            logger.info("  Esperando a que aparezca el botón 'Descargar'...")
             try:
-                logger.info("PASO 6: Buscando link de descarga con data URI...")
-                
-                # Primero, esperar a que el botón "Descargar" sea visible
-                # (así como esperamos a que "Consultar" fuera visible en PASO 4)
-                logger.info("  Esperando a que aparezca el botón 'Descargar'...")
-                try:
-                    descargar_btn = page.locator("button").filter(has_text="Descargar").first
-                    descargar_btn.wait_for(state="visible", timeout=10000)
-                    logger.info("  ✓ Botón 'Descargar' encontrado")
-                except PlaywrightTimeoutError:
-                    logger.warning("  ⚠ Botón 'Descargar' no apareció en 10s")
-                
-                # Estrategia 1: Buscar elemento <a> con href que empiece con "data:"
-                download_links = page.locator('a[href*="data:"]')
-                count = download_links.count()
-                logger.info(f"  Estrategia 1 - Links a[href*='data:']: {count}")
-                
-                # Estrategia 2: Si no hay, buscar cualquier <a> que sea visible
-                if count == 0:
-                    visible_links = page.locator('a')
-                    count2 = visible_links.count()
-                    logger.info(f"  Estrategia 2 - Links totales encontrados: {count2}")
-                    
-                    if count2 > 0:
-                        for i in range(min(5, count2)):
-                            try:
-                                link = visible_links.nth(i)
-                                href = link.get_attribute("href") or ""
-                                text = link.inner_text()
-                                if text.strip():  # Solo si tiene texto
-                                    logger.info(f"    Link {i}: {text[:50]} → {href[:80]}")
-                            except:
-                                pass
+                descargar_btn = page.locator("button").filter(has_text="Descargar").first
+                descargar_btn.wait_for(state="visible", timeout=10000)
+                logger.info("  ✓ Botón 'Descargar' encontrado")
+            except PlaywrightTimeoutError:
+                logger.warning("  ⚠ Botón 'Descargar' no apareció en 10s")
+            
+            # Estrategia 1: Buscar elemento <a> con href que empiece con "data:"
+            download_links = self._data_links(page, skip_read)
+            count = download_links.count()
+            logger.info(f"  Estrategia 1 - Links a[href*='data:']: {count}")
+            
+            # Estrategia 2: Si no hay, buscar cualquier <a> que sea visible
+            if count == 0:
+                visible_links = page.locator('a')
+                count2 = visible_links.count()
+                logger.info(f"  Estrategia 2 - Links totales encontrados: {count2}")
                 
-                # Estrategia 3: Buscar botones "Descargar" o "Descargar Detalles"
-                if count == 0:
-                    descargar_btns = page.locator("button").filter(has_text="Descargar")
-                    count3 = descargar_btns.count()
-                    logger.info(f"  Estrategia 3 - Botones 'Descargar': {count3}")
-                    
-                    if count3 > 0:
-                        # Si hay botón Descargar, clickearlo
-                        logger.info("    Clickeando botón Descargar...")
-                        descargar_btns.first.click()
-                        
-                        # Esperar a que Angular renderice después del click
-                        logger.info("    Esperando a que Angular renderice después del click...")
-                        page.wait_for_timeout(3000)
-                        
-                        # Buscar links de nuevo
-                        download_links = page.locator('a[href*="data:"]')
-                        count = download_links.count()
-                        logger.info(f"    Después del click - Links con data URI: {count}")
+                if count2 > 0:
+                    for i in range(min(5, count2)):
+                        try:
+                            link = visible_links.nth(i)
+                            href = link.get_attribute("href") or ""
+                            text = link.inner_text()
+                            if text.strip():  # Solo si tiene texto
+                                logger.info(f"    Link {i}: {text[:50]} → {href[:80]}")
+                        except:
+                            pass
+            
+            # Estrategia 3: Buscar botones "Descargar" o "Descargar Detalles"
+            if count == 0:
+                descargar_btns = page.locator("button").filter(has_text="Descargar")
+                count3 = descargar_btns.count()
+                logger.info(f"  Estrategia 3 - Botones 'Descargar': {count3}")
                 
-                # Si aún no hay nada, examinar el HTML
-                if count == 0:
-                    logger.warning("  No se encontró link de descarga en ninguna estrategia")
-                    html = page.content()
+                if count3 > 0:
+                    # Si hay botón Descargar, clickearlo
+                    logger.info("    Clickeando botón Descargar...")
+                    descargar_btns.first.click()
                     
-                    # Buscar "data:" en el HTML
-                    if "data:" in html:
-                        logger.info("    ✓ 'data:' ENCONTRADO en el HTML")
-                        idx = html.find("data:")
-                        context = html[max(0, idx-100):idx+200]
-                        logger.info(f"    Contexto: ...{context}...")
-                    else:
-                        logger.error("    ✗ 'data:' NO encontrado en el HTML")
+                    # Esperar a que Angular renderice después del click
+                    logger.info("    Esperando a que Angular renderice después del click...")
+                    readiness = PageReadiness(page)
+                    readiness.angular_idle(signal='descargar_render')
+                    if not skip_read:
+                        readiness.selector('a[href*="data:"]', signal='data_link')
                     
-                    return None
+                    # Buscar links de nuevo
+                    download_links = self._data_links(page, skip_read)
+                    count = download_links.count()
+                    logger.info(f"    Después del click - Links con data URI: {count}")
+            
+            # Si con skip_read no apareció un link nuevo, el data URI es idéntico
+            # al del libro anterior (p.ej. dos libros vacíos): es el mismo contenido
+            if count == 0 and skip_read:
+                download_links = self._data_links(page)
+                count = download_links.count()
+                if count > 0:
+                    logger.info("  Data URI idéntico al del libro anterior, reutilizando contenido")
+            
+            # Si aún no hay nada, examinar el HTML
+            if count == 0:
+                logger.warning("  No se encontró link de descarga en ninguna estrategia")
+                html = page.content()
                 
-                logger.info(f"✓ Encontrados {count} links con data URI")
+                # Buscar "data:" en el HTML
+                if "data:" in html:
+                    logger.info("    ✓ 'data:' ENCONTRADO en el HTML")
+                    idx = html.find("data:")
+                    context = html[max(0, idx-100):idx+200]
+                    logger.info(f"    Contexto: ...{context}...")
+                else:
+                    logger.error("    ✗ 'data:' NO encontrado en el HTML")
                 
-                # Obtener el href del primer link
-                href_value = download_links.first.get_attribute("href")
-                logger.info(f"Link obtenido (primeros 150 chars): {href_value[:150] if href_value else 'None'}")
+                timings.record('download_extract', time.perf_counter() - extract_started, ok=False)
+                return None
+            
+            logger.info(f"✓ Encontrados {count} links con data URI")
+            
+            # Obtener el href del primer link
+            href_value = download_links.first.get_attribute("href")
+            timings.record('download_extract', time.perf_counter() - extract_started)
+            logger.info(f"Link obtenido (primeros 150 chars): {href_value[:150] if href_value else 'None'}")
+            
+            if not href_value or not href_value.startswith("data:"):
+                logger.error(f"El href no es un data URI válido")
+                return None
+            
+            # Decodificar y parsear el data URI por trozos: nunca se arma el CSV completo
+            logger.info(f"Decodificando data URI ({len(href_value)} chars)...")
+            try:
+                # decode: data URI -> filas del CSV; parse: filas -> BookTable (el stream los intercala)
+                rows = timings.TimedIterator(iter_csv_records(href_value))
+                parse_started = time.perf_counter()
+                records = BookTable.from_rows(rows)
+                timings.record('decode', rows.seconds)
+                timings.record('parse', time.perf_counter() - parse_started - rows.seconds)
                 
-                if not href_value or not href_value.startswith("data:"):
-                    logger.error(f"El href no es un data URI válido")
-                    return None
+                logger.info(f"✓ {book_type}: {len(records)} registros parseados del CSV")
+                self._mark_data_links_read(page)
+                return records
                 
-                # Parsear el data URI
-                logger.info("Decodificando data URI...")
-                try:
-                    import base64
-                    from urllib.parse import unquote
-                    
-                    # Formato: data:text/csv;charset=utf-8,<URL-encoded-content>
-                    # o       : data:text/csv;charset=utf-8;base64,<base64-content>
-                    if ",base64," in href_value.lower():
-                        # Base64 encoded
-                        data_part = href_value.split(",", 1)[1] if "," in href_value else ""
-                        csv_content = base64.b64decode(data_part).decode('utf-8')
-                        logger.info("  Decodificación: base64")
-                    else:
-                        # URL encoded (formato: data:text/csv;charset=utf-8,contenido%20URL%20encoded)
-                        data_part = href_value.split(",", 1)[1] if "," in href_value else ""
-                        try:
-                            # Primero intentar decodificar como base64
-                            csv_content = base64.b64decode(data_part).decode('utf-8')
-                            logger.info("  Decodificación: base64 (fallback)")
-                        except:
-                            # Si falla, es URL-encoded
-                            csv_content = unquote(data_part)
-                            logger.info("  Decodificación: URL-encoded")
-                    
-                    logger.info(f"✓ CSV decodificado ({len(csv_content)} chars)")
-                    logger.info(f"  Primeras líneas: {csv_content[:200]}")
-                    
-                    # Parsear como CSV
-                    records = []
-                    reader = csv.DictReader(StringIO(csv_content), delimiter=';')
-                    if reader.fieldnames:
-                        for row in reader:
-                            records.append(dict(row))
-                    
-                    logger.info(f"✓ {book_type}: {len(records)} registros parseados del CSV")
-                    return records
-                    
-                except Exception as decode_error:
-                    logger.error(f"Error decodificando data URI: {decode_error}", exc_info=True)
-                    return None
-                    
-            except PlaywrightTimeoutError as e:
-                logger.error(f"Timeout esperando elemento de descarga: {e}")
-                return None
-            except Exception as e:
-                logger.error(f"Error en descarga desde data URI: {e}", exc_info=True)
+            except Exception as decode_error:
+                logger.error(f"Error decodificando data URI: {decode_error}", exc_info=True)
                 return None
-                    
+                
+        except PlaywrightTimeoutError as e:
+            logger.error(f"Timeout esperando elemento de descarga: {e}")
+            return None
         except Exception as e:
-            logger.error(f"Error obteniendo {book_type}: {str(e)}", exc_info=True)
+            logger.error(f"Error en descarga desde data URI: {e}", exc_info=True)
             return None
+    
+    def _data_links(self, page, skip_read: bool = False):
+        """
+        Locator de los links con data URI
+        
+        Con skip_read=True sólo considera los links cuyo href cambió desde la
+        última vez que se marcaron como leídos (ver _mark_data_links_read).
+        """
+        if not skip_read:
+            return page.locator(DATA_LINK_SELECTOR)
+        
+        page.evaluate(MARK_FRESH_DATA_LINKS_JS)
+        return page.locator(FRESH_DATA_LINK_SELECTOR)
+    
+    def _mark_data_links_read(self, page):
+        """Marcar los links con data URI actuales como ya leídos"""
+        try:
+            page.evaluate(MARK_DATA_LINKS_READ_JS)
+        except Exception as e:
+            logger.warning(f"  ⚠ No se pudieron marcar los links leídos: {e}")
@@ -0,0 +1,15 @@
+"""
+SII URLs - Direcciones del SII, reemplazables por entorno (ej: el SII falso de fake_sii.py)
+"""
+
+import os
+from urllib.parse import urljoin
+
+# Formulario de login; la URL de destino se pasa como query string
+LOGIN_URL = os.getenv('SII_LOGIN_URL', "https://zeusr.sii.cl/AUT2000/InicioAutenticacion/IngresoRutClave.html")
+# Página de libros a la que redirige el login
+DESTINATION_URL = os.getenv('SII_DESTINATION_URL', "https://www4.sii.cl/consdcvinternetui/#/index")
+
+# Derivadas del mismo host que cada una de las anteriores
+LOGIN_POST_URL = urljoin(LOGIN_URL, "/cgi_AUT2000/CAutInicio.cgi")
+FACADE_URL = urljoin(DESTINATION_URL, "/consdcvinternetui/services/data/facadeService")
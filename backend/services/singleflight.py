@@ -0,0 +1,79 @@
+"""
+Single Flight - Deduplicación de llamadas idénticas concurrentes
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coordinador single-flight: mientras una llamada con cierta clave está en
+    curso, las demás llamadas con la misma clave esperan y reciben su mismo
+    resultado (o su misma excepción) en vez de repetir el trabajo.
+
+    No es un cache: en cuanto la llamada termina, la próxima con esa clave
+    vuelve a ejecutarse.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Ejecutar fn() o sumarse a la ejecución en curso con la misma clave
+
+        Returns:
+            El resultado de fn (compartido entre todos los que esperaban)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._executed += 1
+                leader = True
+
+        if not leader:
+            logger.info("Request idéntica en curso, esperando su resultado")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'waiting': sum(call.waiters for call in self._calls.values()),
+                'executed': self._executed,
+                'shared': self._shared,
+            }
@@ -0,0 +1,100 @@
+"""
+Timings - Duración de cada paso del scraping (histogramas en proceso y, si se pide, en la respuesta)
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from .metrics import metrics
+
+# Histograma de /api/metrics con una serie por paso (etiquetas step y outcome)
+STEP_METRIC = 'scraper_step_seconds'
+
+
+class StepTimings:
+    """Pasos medidos durante una request, en el orden en que ocurrieron"""
+
+    def __init__(self):
+        self.steps: List[Dict[str, Any]] = []
+        self._started = time.perf_counter()
+
+    def add(self, step: str, seconds: float, ok: bool = True):
+        entry: Dict[str, Any] = {'paso': step, 'segundos': round(seconds, 4)}
+        if not ok:
+            entry['error'] = True
+        self.steps.append(entry)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total_segundos': round(time.perf_counter() - self._started, 4),
+            'pasos': list(self.steps),
+        }
+
+
+# Igual que progress: ContextVar para aislar el registro por hilo y por task de asyncio
+_recorder: ContextVar[Optional[StepTimings]] = ContextVar('step_timings', default=None)
+
+
+def current() -> Optional[StepTimings]:
+    """Registro de pasos activo en este hilo / task (o None)"""
+    return _recorder.get()
+
+
+@contextmanager
+def timing_scope(recorder: Optional[StepTimings]) -> Iterator[None]:
+    """
+    Activar un registro de pasos en el hilo (o task) actual
+
+    Como con progress_scope, quien despacha trabajo a otro hilo (el pool de
+    navegadores) captura current() y vuelve a abrir el scope del otro lado.
+    """
+    token = _recorder.set(recorder)
+    try:
+        yield
+    finally:
+        _recorder.reset(token)
+
+
+def record(step: str, seconds: float, ok: bool = True):
+    """Registrar la duración de un paso en el histograma y en el registro activo (si hay)"""
+    metrics.observe(STEP_METRIC, seconds, step=step, outcome='ok' if ok else 'error')
+    recorder = current()
+    if recorder is not None:
+        recorder.add(step, seconds, ok)
+
+
+@contextmanager
+def span(step: str) -> Iterator[None]:
+    """Medir el bloque como un paso; si levanta una excepción queda con outcome 'error'"""
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        record(step, time.perf_counter() - started, ok)
+
+
+class TimedIterator:
+    """
+    Iterador que acumula sólo el tiempo pasado dentro de next() del iterable
+
+    Sirve para separar, en un stream, lo que cuesta producir cada elemento
+    (p.ej. decodificar el data URI) de lo que hace quien los consume.
+    """
+
+    def __init__(self, iterable: Iterable[Any]):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self) -> "TimedIterator":
+        return self
+
+    def __next__(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
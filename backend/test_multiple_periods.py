@@ -28,14 +28,21 @@ def test_multiple_periods():
             (10, 2025),
         ]
         
+        # Un solo login para todos los períodos
+        results = scraper.fetch_range(rut, password, periods, ("COMPRAS", "VENTAS"))
+        
+        if results is None:
+            print(f"  ERROR: fetch_range retornó None (login fallido)")
+            return False
+        
         for mes, ano in periods:
             for book_type in ["COMPRAS", "VENTAS"]:
-                print(f"\nDescargando {book_type} - {mes:02d}/{ano}...")
+                print(f"\n{book_type} - {mes:02d}/{ano}...")
                 
-                records = scraper.fetch_books(rut, password, mes=mes, ano=ano, book_type=book_type)
+                records = results[(mes, ano)][book_type]
                 
                 if records is None:
-                    print(f"  ERROR: fetch_books retornó None")
+                    print(f"  ERROR: no se obtuvieron registros")
                 else:
                     print(f"  OK: {len(records)} registros descargados")
                     if len(records) > 0:
@@ -0,0 +1,3 @@
+"""
+Tests unitarios de los servicios (sin navegador ni red)
+"""
@@ -0,0 +1,140 @@
+"""
+Tests de BookStore: diff por documento, versiones, tombstones y tokens de sincronización
+"""
+
+import os
+import tempfile
+import unittest
+
+from services.book_store import BookStore, make_token, parse_token
+
+RUT = '76123456-7'
+PASSWORD = 'clave'
+
+
+def _doc(folio: str, total: str, rut: str = '11111111-1', tipo: str = '33') -> dict:
+    return {'Tipo Doc': tipo, 'RUT Proveedor': rut, 'Folio': folio, 'Monto Total': total}
+
+
+class TokenTests(unittest.TestCase):
+
+    def test_round_trip(self):
+        token = make_token(RUT, '2025-10', 'COMPRAS', 7)
+        self.assertNotIn('=', token)
+        self.assertEqual(parse_token(token), (RUT, '2025-10', 'COMPRAS', 7))
+
+    def test_invalid_token(self):
+        for token in ('', 'no-es-base64!', make_token(RUT, '2025-10', 'COMPRAS', 1)[:-3],
+                      'YXxifGM'):  # "a|b|c": faltan campos
+            with self.subTest(token=token):
+                with self.assertRaises(ValueError):
+                    parse_token(token)
+
+
+class BookStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.store = BookStore(os.path.join(self._dir.name, 'books.db'))
+
+    def tearDown(self):
+        self.store._connection().close()
+        self._dir.cleanup()
+
+    def save(self, records):
+        return self.store.save(RUT, PASSWORD, 10, 2025, 'COMPRAS', records)
+
+    def changes(self, since):
+        return self.store.changes_since(RUT, 10, 2025, 'COMPRAS', since)
+
+    def test_first_save_inserts_everything(self):
+        result = self.save([_doc('1', '100'), _doc('2', '200')])
+        self.assertEqual(result['insertados'], ['33|11111111-1|1', '33|11111111-1|2'])
+        self.assertEqual((result['actualizados'], result['eliminados'], result['sin_cambios']), ([], [], 0))
+        self.assertEqual(parse_token(result['token']), (RUT, '2025-10', 'COMPRAS', 1))
+        self.assertEqual(self.store.token(RUT, 10, 2025, 'COMPRAS'), result['token'])
+
+    def test_resave_diffs_by_document(self):
+        self.save([_doc('1', '100'), _doc('2', '200'), _doc('3', '300')])
+        result = self.save([_doc('1', '100'), _doc('2', '250'), _doc('4', '400')])
+
+        self.assertEqual(result['insertados'], ['33|11111111-1|4'])
+        self.assertEqual(result['actualizados'], ['33|11111111-1|2'])
+        self.assertEqual(result['eliminados'], ['33|11111111-1|3'])
+        self.assertEqual(result['sin_cambios'], 1)
+        self.assertEqual(parse_token(result['token'])[3], 2)
+
+    def test_unchanged_save_keeps_version(self):
+        first = self.save([_doc('1', '100'), _doc('2', '200')])
+        # Mismo contenido en otro orden: no hay escrituras ni versión nueva
+        second = self.save([_doc('2', '200'), _doc('1', '100')])
+        self.assertEqual(second['sin_cambios'], 2)
+        self.assertEqual(second['token'], first['token'])
+
+        books = self.store.books(RUT, 10, 2025, 'COMPRAS')
+        self.assertEqual([r['Folio'] for r in books[0]['registros']], ['2', '1'])
+
+    def test_repeated_keys_are_numbered(self):
+        result = self.save([_doc('1', '100'), _doc('1', '100')])
+        self.assertEqual(result['insertados'], ['33|11111111-1|1', '33|11111111-1|1#1'])
+
+    def test_changes_since_zero_returns_full_book(self):
+        self.save([_doc('1', '100'), _doc('2', '200')])
+        changes = self.changes('0')
+        self.assertEqual([c['doc_key'] for c in changes['agregados']], ['33|11111111-1|1', '33|11111111-1|2'])
+        self.assertEqual(changes['agregados'][1]['registro'], _doc('2', '200'))
+        self.assertEqual((changes['modificados'], changes['eliminados']), ([], []))
+
+    def test_changes_since_token_returns_delta(self):
+        token = self.save([_doc('1', '100'), _doc('2', '200'), _doc('3', '300')])['token']
+        latest = self.save([_doc('1', '100'), _doc('2', '250'), _doc('4', '400')])['token']
+
+        changes = self.changes(token)
+        self.assertEqual([c['doc_key'] for c in changes['agregados']], ['33|11111111-1|4'])
+        self.assertEqual([c['registro'] for c in changes['modificados']], [_doc('2', '250')])
+        self.assertEqual(changes['eliminados'], ['33|11111111-1|3'])
+        self.assertEqual(changes['token'], latest)
+
+        # Desde el token actual no hay nada nuevo
+        empty = self.changes(latest)
+        self.assertEqual((empty['agregados'], empty['modificados'], empty['eliminados']), ([], [], []))
+
+    def test_tombstones(self):
+        token = self.save([_doc('1', '100')])['token']
+        self.save([_doc('1', '100'), _doc('2', '200')])
+        # El 2 se crea y se borra después del token: el cliente nunca lo vio
+        self.save([_doc('1', '100')])
+        self.assertEqual(self.changes(token)['eliminados'], [])
+
+        # Un documento borrado que vuelve cuenta como agregado para quien tenía el tombstone
+        after_delete = self.save([])['token']
+        self.assertEqual(self.store.books(RUT, 10, 2025, 'COMPRAS'), [])
+        result = self.save([_doc('1', '100')])
+        self.assertEqual(result['insertados'], ['33|11111111-1|1'])
+        self.assertEqual([c['doc_key'] for c in self.changes(after_delete)['agregados']], ['33|11111111-1|1'])
+        # Recreado después del token: vuelve como agregado aunque el cliente ya tuviera esa clave
+        self.assertEqual([c['doc_key'] for c in self.changes(token)['agregados']], ['33|11111111-1|1'])
+
+    def test_changes_since_rejects_foreign_or_future_tokens(self):
+        self.save([_doc('1', '100')])
+        for token in (make_token(RUT, '2025-09', 'COMPRAS', 1),
+                      make_token(RUT, '2025-10', 'VENTAS', 1),
+                      make_token(RUT, '2025-10', 'COMPRAS', 5),
+                      'basura'):
+            with self.subTest(token=token):
+                with self.assertRaises(ValueError):
+                    self.changes(token)
+
+    def test_reopen_keeps_data(self):
+        token = self.save([_doc('1', '100')])['token']
+        reopened = BookStore(self.store.path)
+        try:
+            self.assertEqual(reopened.token(RUT, 10, 2025, 'COMPRAS'), token)
+            self.assertTrue(reopened.authorized(RUT, PASSWORD))
+            self.assertFalse(reopened.authorized(RUT, 'otra'))
+        finally:
+            reopened._connection().close()
+
+
+if __name__ == '__main__':
+    unittest.main()
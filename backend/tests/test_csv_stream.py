@@ -0,0 +1,92 @@
+"""
+Tests de csv_stream: el resultado no depende de dónde caen los cortes entre trozos
+"""
+
+import base64
+import csv
+import io
+import unittest
+from urllib.parse import quote
+
+from services.csv_stream import iter_csv_records, iter_data_uri_text, iter_lines
+
+# Multibyte UTF-8, ';' y saltos de línea dentro de comillas, y una última línea sin '\n'
+CSV_TEXT = (
+    'Tipo Doc;RUT Proveedor;Razon Social;Folio;Monto Total\n'
+    '33;76123456-7;Comercial Ñuñoa Ltda.;1001;119000\n'
+    '34;11111111-1;"Servicios; Asesorías";1002;50000\n'
+    '61;22222222-2;"Línea 1\nLínea 2 €";1003;-2380\n'
+    '33;33333333-3;Café ☕ Peñalolén;1004;0'
+)
+
+CHUNK_SIZES = list(range(4, 41)) + [64, 1024, 64 * 1024]
+
+
+def _expected_records():
+    return list(csv.DictReader(io.StringIO(CSV_TEXT, newline=''), delimiter=';'))
+
+
+def _percent_uri() -> str:
+    return 'data:text/csv;charset=utf-8,' + quote(CSV_TEXT, safe='')
+
+
+def _base64_uri(header: bool = True) -> str:
+    body = base64.b64encode(CSV_TEXT.encode('utf-8')).decode('ascii')
+    return ('data:text/csv;charset=utf-8;base64,' if header else 'data:text/csv;charset=utf-8,') + body
+
+
+class DataUriTextTests(unittest.TestCase):
+
+    def assert_decodes(self, href):
+        for chunk_size in CHUNK_SIZES:
+            for value in (href, href.encode('ascii')):
+                with self.subTest(chunk_size=chunk_size, kind=type(value).__name__):
+                    self.assertEqual(''.join(iter_data_uri_text(value, chunk_size)), CSV_TEXT)
+
+    def test_percent_encoded(self):
+        # Los escapes %XX de los caracteres multibyte quedan cortados en casi todos los tamaños
+        self.assert_decodes(_percent_uri())
+
+    def test_base64(self):
+        self.assert_decodes(_base64_uri())
+
+    def test_base64_without_header_flag(self):
+        self.assert_decodes(_base64_uri(header=False))
+
+    def test_chunk_size_is_rounded_to_base64_quantum(self):
+        href = _base64_uri()
+        for chunk_size in (1, 2, 5, 7, 13):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(''.join(iter_data_uri_text(href, chunk_size)), CSV_TEXT)
+
+    def test_empty_body(self):
+        self.assertEqual(''.join(iter_data_uri_text('data:text/csv;charset=utf-8,', 4)), '')
+
+
+class IterLinesTests(unittest.TestCase):
+
+    def test_lines_across_chunks(self):
+        chunks = ['a;b', '\nc', ';d\n\ne', '', 'nd']
+        self.assertEqual(list(iter_lines(iter(chunks))), ['a;b\n', 'c;d\n', '\n', 'end'])
+
+
+class CsvRecordsTests(unittest.TestCase):
+
+    def test_matches_full_parse(self):
+        expected = _expected_records()
+        for href in (_percent_uri(), _base64_uri()):
+            for chunk_size in CHUNK_SIZES:
+                with self.subTest(base64=href.startswith('data:text/csv;charset=utf-8;base64'),
+                                  chunk_size=chunk_size):
+                    self.assertEqual(list(iter_csv_records(href, chunk_size=chunk_size)), expected)
+
+    def test_quoted_newline_and_multibyte(self):
+        records = list(iter_csv_records(_percent_uri(), chunk_size=4))
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[1]['Razon Social'], 'Servicios; Asesorías')
+        self.assertEqual(records[2]['Razon Social'], 'Línea 1\nLínea 2 €')
+        self.assertEqual(records[3]['Folio'], '1004')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Tests de SessionCache: una sesión sólo se entrega o descarta con la contraseña con que se obtuvo
+"""
+
+import unittest
+
+from services.session_cache import SessionCache
+
+RUT = '76123456-7'
+STATE = {'cookies': [{'name': 'TOKEN', 'value': 'abc'}]}
+
+
+class SessionCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = SessionCache(ttl_seconds=60)
+        self.cache.put(RUT, 'clave', STATE)
+
+    def test_get_requires_same_password(self):
+        self.assertEqual(self.cache.get(RUT, 'clave'), STATE)
+        self.assertIsNone(self.cache.get(RUT, 'otra'))
+
+    def test_invalidate_with_other_password_keeps_session(self):
+        # Un login fallido con otra contraseña no cierra la sesión vigente
+        self.cache.invalidate(RUT, 'otra')
+        self.assertEqual(self.cache.get(RUT, 'clave'), STATE)
+
+    def test_invalidate_with_same_password(self):
+        self.cache.invalidate(RUT, 'clave')
+        self.assertIsNone(self.cache.get(RUT, 'clave'))
+        # Sin entrada no pasa nada
+        self.cache.invalidate(RUT, 'clave')
+
+    def test_disabled_cache(self):
+        cache = SessionCache(ttl_seconds=0)
+        cache.put(RUT, 'clave', STATE)
+        self.assertIsNone(cache.get(RUT, 'clave'))
+
+
+if __name__ == '__main__':
+    unittest.main()